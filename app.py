@@ -1,6 +1,8 @@
 import streamlit as st
 from src.query_processor import QueryProcessor
-from src.utils import update_database
+from src.retrieval import get_retriever
+from src.registry import registry
+from src.metrics import get_metrics
 import json
 from datetime import datetime
 import logging
@@ -68,17 +70,20 @@ else:
         with chat_container:
             with st.chat_message("user"):
                 st.write(query)
-            with st.spinner("Elaborazione in corso..."):
-                try:
-                    response = st.session_state.processor.process(query)
-                    logging.info(f"Risposta inviata all'interfaccia: {response}")
-                    with st.chat_message("assistant"):
-                        st.markdown(f"**{response}**")
-                    st.session_state.chat_history.append({"query": query, "response": response})
-                    st.session_state.last_query = query
-                except Exception as e:
-                    logging.error(f"Errore durante elaborazione query '{query}': {str(e)}")
-                    st.error("Errore durante l'elaborazione della query.")
+            try:
+                # I token vengono mostrati man mano che arrivano
+                with st.chat_message("assistant"):
+                    placeholder = st.empty()
+                    placeholder.markdown("_Elaborazione in corso..._")
+                    response = ""
+                    for chunk in st.session_state.processor.process_stream(query):
+                        response += chunk
+                        placeholder.markdown(f"**{response}**")
+                st.session_state.chat_history.append({"query": query, "response": response})
+                st.session_state.last_query = query
+            except Exception as e:
+                logging.error(f"Errore durante elaborazione query '{query}': {str(e)}")
+                st.error("Errore durante l'elaborazione della query.")
 
     if st.button("Termina sessione"):
         st.session_state.session_active = False
@@ -95,11 +100,33 @@ with st.sidebar:
     if uploaded_file:
         try:
             new_data = json.load(uploaded_file)
-            update_database("data/database.json", new_data)
-            st.success("Database aggiornato con successo!")
-            if st.session_state.processor is not None:
-                st.session_state.processor = QueryProcessor()
-                logging.info("Processor ricaricato dopo aggiornamento database")
+            # Upsert incrementale sul retriever condiviso: le sessioni aperte vedono subito la nuova versione
+            version = get_retriever("data/database.json").upsert(new_data)
+            st.success(f"Database aggiornato con successo! (versione {version})")
         except Exception as e:
             logging.error(f"Errore durante aggiornamento database: {str(e)}")
-            st.error("Errore durante l'aggiornamento del database.")
\ No newline at end of file
+            st.error("Errore durante l'aggiornamento del database.")
+
+    resource_stats = registry.stats()
+    if resource_stats:
+        with st.expander("Risorse condivise"):
+            for name, stats in resource_stats.items():
+                st.caption(f"{name}: {stats['load_seconds']}s, +{stats['rss_delta_mb']} MB")
+            if st.session_state.processor is not None:
+                queue_stats = st.session_state.processor.scheduler.stats()
+                st.caption(
+                    f"Coda generazione: {queue_stats['queue_depth']} in attesa, "
+                    f"batch medio {queue_stats['batch_size_mean']}, "
+                    f"attesa p95 {queue_stats['wait_seconds_p95']}s"
+                )
+                if st.session_state.processor.answer_cache is not None:
+                    cache_stats = st.session_state.processor.answer_cache.stats()
+                    st.caption(
+                        f"Cache risposte: {cache_stats['entries']} voci, "
+                        f"hit rate {cache_stats['hit_rate']:.0%}"
+                    )
+            # Tempo medio per fase della pipeline (metriche di processo)
+            for histogram in get_metrics().snapshot()["histograms"]:
+                if histogram["name"] == "stage_seconds" and histogram["count"]:
+                    mean_ms = histogram["sum"] / histogram["count"] * 1000
+                    st.caption(f"{histogram['labels']['stage']}: {mean_ms:.1f} ms medi su {histogram['count']}")
\ No newline at end of file
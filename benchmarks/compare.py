@@ -0,0 +1,74 @@
+"""Confronto tra due run del benchmark end-to-end.
+
+    python -m benchmarks.compare baseline.json current.json --tolerance 0.2
+
+Esce con codice 1 se una fase peggiora oltre la tolleranza.
+"""
+import argparse
+import json
+import sys
+
+# Metrica -> True se un valore più alto è peggiore
+METRICS = {
+    "p50_ms": True,
+    "p95_ms": True,
+    "p99_ms": True,
+    "throughput_per_s": False,
+    "rss_mb": True,
+    "errors": True,
+}
+
+
+def compare(baseline, current, tolerance=0.2):
+    """Regressioni come lista di (fase, metrica, valore di riferimento, valore attuale)"""
+    regressions = []
+    for stage, stats in current["stages"].items():
+        reference = baseline.get("stages", {}).get(stage)
+        if reference is None:
+            continue
+        for metric, higher_is_worse in METRICS.items():
+            if metric not in stats or metric not in reference:
+                continue
+            old, new = reference[metric], stats[metric]
+            if metric == "errors":
+                worse = new > old
+            elif higher_is_worse:
+                worse = new > old * (1 + tolerance)
+            else:
+                worse = new < old * (1 - tolerance)
+            if worse:
+                regressions.append((stage, metric, old, new))
+    return regressions
+
+
+def print_comparison(baseline, current, regressions):
+    flagged = {(stage, metric) for stage, metric, _, _ in regressions}
+    print(f"{'fase':<18}{'metrica':<18}{'riferimento':>14}{'attuale':>14}{'delta':>10}")
+    for stage, stats in current["stages"].items():
+        reference = baseline.get("stages", {}).get(stage, {})
+        for metric in METRICS:
+            if metric not in stats or metric not in reference:
+                continue
+            old, new = reference[metric], stats[metric]
+            delta = f"{(new - old) / old:+.1%}" if old else "-"
+            mark = "  <-- regressione" if (stage, metric) in flagged else ""
+            print(f"{stage:<18}{metric:<18}{old:>14}{new:>14}{delta:>10}{mark}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Confronta due run di benchmarks.run")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, "r", encoding="utf-8") as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, tolerance=args.tolerance)
+    print_comparison(baseline, current, regressions)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Generatore di corpora giuridici sintetici, validi per ``validate_entry``.
+
+Stessa semantica del database reale: leggi dei codici, sentenze che citano articoli
+esistenti (``riferimenti``), procedure per evento e circolari. A parità di ``seed``
+il corpus è identico, così due run del benchmark sono confrontabili.
+
+    python -m benchmarks.corpus data/bench/corpus.jsonl --docs 100000
+"""
+import argparse
+import random
+
+from src.utils import write_database
+
+CODES = {
+    "CC": ("Codice Civile", ["Responsabilità civile", "Persone fisiche", "Contratti", "Proprietà",
+                             "Successioni", "Obbligazioni", "Famiglia"]),
+    "CP": ("Codice Penale", ["Principi generali", "Delitti contro la persona", "Delitti contro il patrimonio",
+                             "Pene", "Reati colposi"]),
+}
+EVENTS = ["Incendio", "Alluvione", "Terremoto", "Infortunio", "Sfratto", "Sinistro stradale"]
+ENTI = ["INPS", "INAIL", "Agenzia delle Entrate", "Ministero dell'Interno", "Ministero della Giustizia"]
+BOOKS = ["Primo", "Secondo", "Terzo", "Quarto", "Quinto", "Sesto"]
+
+SUBJECTS = ["Chiunque", "Il debitore", "Il proprietario", "Il custode", "Il datore di lavoro", "Il pubblico ufficiale"]
+VERBS = ["è tenuto a risarcire", "risponde", "è punito per", "deve comunicare", "può chiedere la risoluzione per"]
+OBJECTS = ["il danno ingiusto", "l'inadempimento", "le cose in custodia", "la capacità giuridica",
+           "il fatto doloso o colposo", "la lesione personale", "il contratto di locazione", "la successione legittima"]
+QUALIFIERS = ["salvo che provi il caso fortuito", "nei termini previsti dalla legge", "entro trenta giorni",
+              "con la pena della reclusione", "secondo le norme del presente codice", "anche in via d'urgenza"]
+
+# Proporzioni predefinite dei tipi di documento
+DEFAULT_MIX = {"legge": 0.6, "sentenza": 0.25, "procedura": 0.1, "circolare": 0.05}
+
+
+def _sentence(rng):
+    return f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)}, {rng.choice(QUALIFIERS)}."
+
+
+def _text(rng, sentences=(1, 3)):
+    return " ".join(_sentence(rng) for _ in range(rng.randint(*sentences)))
+
+
+def _legge(rng, article):
+    prefix = rng.choice(list(CODES))
+    codice, contexts = CODES[prefix]
+    book = rng.randrange(len(BOOKS))
+    title = rng.randint(1, 20)
+    capo = rng.randint(1, 5)
+    commi = [{"numero": str(i + 1), "testo": _text(rng, (1, 2))} for i in range(rng.randint(1, 3))]
+    return {
+        "id": f"{prefix}-L{book + 1}-T{title}-C{capo}-Art.{article}",
+        "type": "legge",
+        "text": " ".join(comma["testo"] for comma in commi),
+        "context": f"{codice}, {rng.choice(contexts)}",
+        "structure": {
+            "codice": codice,
+            "libro": f"Libro {BOOKS[book]}",
+            "titolo": f"Titolo {title}",
+            "capo": f"Capo {capo}",
+            "articolo": str(article),
+            "commi": commi,
+        },
+    }
+
+
+def _sentenza(rng, number, laws):
+    area = rng.choice(["Civ", "Pen"])
+    year = rng.randint(1990, 2024)
+    refs = sorted({rng.choice(laws)["id"] for _ in range(rng.randint(1, 3))}) if laws else []
+    return {
+        "id": f"Cass-{area}-{number}-{year}",
+        "type": "sentenza",
+        "text": _text(rng, (2, 4)),
+        "context": f"Cassazione {'Civile' if area == 'Civ' else 'Penale'}, {rng.choice(OBJECTS)}",
+        "structure": {
+            "numero": str(number),
+            "anno": str(year),
+            "sezione": f"Sezione {rng.choice(['I', 'II', 'III', 'Unite'])}",
+            "riferimenti": refs,
+        },
+    }
+
+
+def _procedura(rng, number):
+    event = rng.choice(EVENTS)
+    return {
+        "id": f"Proc-{event.replace(' ', '')}-{number:06d}",
+        "type": "procedura",
+        "text": f"Procedura in caso di {event.lower()}. {_text(rng, (1, 2))}",
+        "context": f"Procedura di emergenza per {event.lower()}",
+        "structure": {
+            "evento": event,
+            "steps": [_sentence(rng) for _ in range(rng.randint(2, 5))],
+        },
+    }
+
+
+def _circolare(rng, number):
+    ente = rng.choice(ENTI)
+    return {
+        "id": f"Circ-{number:06d}-{rng.randint(2000, 2024)}",
+        "type": "circolare",
+        "text": _text(rng, (1, 3)),
+        "context": f"Circolare {ente}",
+        "structure": {
+            "ente": ente,
+            "numero": str(number),
+            "data": f"{rng.randint(2000, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        },
+    }
+
+
+def generate_corpus(n_docs, seed=0, mix=None):
+    """Lista di ``n_docs`` entries valide; le sentenze citano solo leggi generate prima"""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    types, weights = zip(*mix.items())
+    entries, laws = [], []
+    for number in range(1, n_docs + 1):
+        tipo = rng.choices(types, weights)[0]
+        if tipo == "sentenza" and not laws:
+            tipo = "legge"
+        if tipo == "legge":
+            # Il numero progressivo nell'articolo rende l'id univoco
+            entry = _legge(rng, number)
+            laws.append(entry)
+        elif tipo == "sentenza":
+            entry = _sentenza(rng, number, laws)
+        elif tipo == "procedura":
+            entry = _procedura(rng, number)
+        else:
+            entry = _circolare(rng, number)
+        entries.append(entry)
+    return entries
+
+
+def generate_queries(entries, n_queries, seed=0):
+    """Workload riproducibile: riferimenti diretti, articoli, confronti, procedure e domande generiche"""
+    rng = random.Random(seed + 1)
+    laws = [entry for entry in entries if entry["type"] == "legge"]
+    templates = [
+        lambda: f"Cosa dice {rng.choice(laws)['id']}?",
+        lambda: (lambda law: f"Cosa dice l'articolo {law['structure']['articolo']} del "
+                             f"{law['structure']['codice'].lower()}?")(rng.choice(laws)),
+        lambda: f"Confronta le sentenze su {rng.choice(OBJECTS)}",
+        lambda: f"Qual è la procedura in caso di {rng.choice(EVENTS).lower()}?",
+        lambda: f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)}?",
+        lambda: f"Differenze tra circolare e sentenza su {rng.choice(OBJECTS)}",
+    ]
+    return [rng.choice(templates)() for _ in range(n_queries)]
+
+
+def write_corpus(path, n_docs, seed=0):
+    entries = generate_corpus(n_docs, seed=seed)
+    write_database(path, entries)
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un corpus giuridico sintetico (JSON o JSONL)")
+    parser.add_argument("path")
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    write_corpus(args.path, args.docs, seed=args.seed)
+    print(f"{args.docs} entries scritte in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
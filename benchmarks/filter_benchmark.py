@@ -0,0 +1,107 @@
+"""Ricerca filtrata sui metadati contro ricerca non filtrata con scarto successivo.
+
+Su un corpus sintetico, per filtri ricavati dalle query (``QueryParser``) o scelti a
+caso tra tipo, codice ed evento, riporta selettività, filtri allentati, latenza e
+quanti dei ``k`` risultati rispettano i filtri con e senza filtro nella ricerca FAISS.
+
+    python -m benchmarks.filter_benchmark --docs 20000 --queries 300 --index hnsw
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from .corpus import EVENTS, generate_queries, write_corpus
+
+FILTER_CHOICES = [
+    {"type": "sentenza"},
+    {"type": "procedura"},
+    {"type": "circolare"},
+    {"type": "legge", "codice": "codice civile"},
+    {"type": "legge", "codice": "codice penale"},
+] + [{"type": "procedura", "evento": event} for event in EVENTS]
+
+
+def _satisfied(retriever, docs, filters):
+    """Quota dei documenti che rispettano i filtri"""
+    if not docs or not filters:
+        return 1.0
+    mask = retriever.metadata.mask(filters)
+    return sum(bool(mask[doc.row]) for doc in docs) / len(docs)
+
+
+def _percentiles(values):
+    values = np.asarray(values) * 1000
+    return {f"p{p}_ms": round(float(np.percentile(values, p)), 3) for p in (50, 95, 99)}
+
+
+def run(n_docs, n_queries, k=10, seed=0, workdir=None, index_config=None):
+    os.environ["LEGALAI_LLM_BACKEND"] = "stub"
+    from src.metadata_filter import filters_from_entities
+    from src.query_parser import QueryParser
+    from src.retrieval import Retriever
+
+    workdir = workdir or tempfile.mkdtemp(prefix="legalai-filter-")
+    db_path = os.path.join(workdir, "database.jsonl")
+    entries = write_corpus(db_path, n_docs, seed=seed)
+    queries = generate_queries(entries, n_queries, seed=seed)
+    del entries
+    retriever = Retriever(db_path, cache_dir=os.path.join(workdir, "cache"), index_config=index_config)
+
+    # Filtri dalle entità della query; per le query senza entità un filtro casuale
+    rng = random.Random(seed)
+    parser = QueryParser()
+    workload = []
+    for query, parsed in zip(queries, parser.parse_batch(queries)):
+        workload.append((query, filters_from_entities(parsed["entities"]) or rng.choice(FILTER_CHOICES)))
+    embeddings = retriever.encode_queries([query for query, _ in workload])
+
+    report = {"docs": n_docs, "queries": len(workload), "k": k, "index": retriever.index_config}
+    unfiltered, filtered, selectivity, relaxed, post, inside, counts = [], [], [], 0, [], [], []
+    for (query, filters), embedding in zip(workload, embeddings):
+        embedding = embedding.reshape(1, -1)
+        start = time.perf_counter()
+        docs, _ = retriever.search_hybrid(query, k=k, embedding=embedding)
+        unfiltered.append(time.perf_counter() - start)
+        # Scarto successivo: dei k risultati restano solo quelli che rispettano i filtri
+        post.append(_satisfied(retriever, docs, filters))
+
+        start = time.perf_counter()
+        docs, timings = retriever.search_hybrid(query, k=k, embedding=embedding, filters=filters)
+        filtered.append(time.perf_counter() - start)
+        info = timings["filter"]
+        selectivity.append(info["selectivity"])
+        relaxed += bool(info["relaxed"])
+        inside.append(_satisfied(retriever, docs, info["applied"]))
+        counts.append(len(docs))
+
+    report["unfiltered"] = {**_percentiles(unfiltered), "satisfying_filters": round(float(np.mean(post)), 4)}
+    report["filtered"] = {
+        **_percentiles(filtered),
+        "satisfying_filters": round(float(np.mean(inside)), 4),
+        "mean_results": round(float(np.mean(counts)), 2),
+        "selectivity_p50": round(float(np.percentile(selectivity, 50)), 4),
+        "selectivity_min": round(float(np.min(selectivity)), 6),
+        "relaxed_queries": relaxed,
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Selettività e latenza della ricerca filtrata sui metadati")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--index", default="flat", help="flat, ivf_flat, ivf_pq o hnsw")
+    parser.add_argument("--workdir", help="cartella per corpus e cache (predefinita: temporanea)")
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.docs, args.queries, args.k, args.seed, args.workdir, {"kind": args.index}), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Test di carico per il servizio HTTP (src.server), solo libreria standard.
+
+Con ``--spawn`` avvia in locale un server con il backend LLM ``stub`` e attende /ready:
+
+    python -m benchmarks.load_test --spawn --concurrency 16 --requests 1000
+    python -m benchmarks.load_test --host 10.0.0.5 --port 8000 --endpoint /query/stream
+
+Riporta latenza p50/p95/p99 (e tempo al primo chunk per lo streaming), throughput
+e conteggio dei codici di stato, in JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+DEFAULT_QUERIES = [
+    "Cosa dice l'articolo 2043 del codice civile?",
+    "Cosa dice CC-L1-T1-C1-Art.1?",
+    "Qual è la procedura in caso di incendio?",
+    "Responsabilità per le cose in custodia",
+    "Confronta le sentenze sul risarcimento del danno",
+]
+
+
+async def _request(reader, writer, host, method, path, payload=None):
+    """Invia una richiesta sulla connessione keep-alive; restituisce (stato, secondi al primo chunk, corpo)"""
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    start = time.perf_counter()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    first_chunk = None
+    if headers.get("transfer-encoding") == "chunked":
+        parts = []
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            if size == 0:
+                await reader.readline()
+                break
+            parts.append(await reader.readexactly(size))
+            await reader.readline()
+        data = b"".join(parts)
+    else:
+        data = await reader.readexactly(int(headers.get("content-length", 0)))
+        first_chunk = time.perf_counter() - start
+    return status, first_chunk, data
+
+
+async def _worker(host, port, endpoint, queries, counter, total, results):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            query = queries[i % len(queries)]
+            payload = {"queries": [query]} if endpoint == "/batch" else {"query": query}
+            start = time.perf_counter()
+            try:
+                status, first_chunk, _ = await _request(reader, writer, host, "POST", endpoint, payload)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                results.append(("connection_error", time.perf_counter() - start, None))
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+                continue
+            results.append((status, time.perf_counter() - start, first_chunk))
+    finally:
+        writer.close()
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values) * 1000
+    return {f"p{p}_ms": round(float(np.percentile(values, p)), 2) for p in (50, 95, 99)}
+
+
+async def run_load(host, port, endpoint="/query", concurrency=8, requests=200, queries=None):
+    queries = queries or DEFAULT_QUERIES
+    counter = iter(range(requests + concurrency))
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _worker(host, port, endpoint, queries, counter, requests, results) for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+    ok = [result for result in results if result[0] == 200]
+    report = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(len(results) / elapsed, 2) if elapsed > 0 else 0.0,
+        "status": {str(status): count for status, count in Counter(result[0] for result in results).items()},
+        "latency": _percentiles([result[1] for result in ok]),
+    }
+    if endpoint == "/query/stream":
+        report["first_chunk"] = _percentiles([result[2] for result in ok])
+    return report
+
+
+async def wait_ready(host, port, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                status, _, _ = await _request(reader, writer, host, "GET", "/ready")
+            finally:
+                writer.close()
+            if status == 200:
+                return
+        except (ConnectionError, OSError, ValueError, IndexError):
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"Servizio non pronto entro {timeout}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test di carico del servizio HTTP di LegalAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--endpoint", default="/query", choices=["/query", "/query/stream", "/batch"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--queries", help="file di testo con una domanda per riga")
+    parser.add_argument("--spawn", action="store_true", help="avvia un server locale con il backend stub")
+    parser.add_argument("--db", default="data/database.json")
+    args = parser.parse_args(argv)
+
+    queries = None
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    server = None
+    if args.spawn:
+        env = {**os.environ, "LEGALAI_LLM_BACKEND": "stub"}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "src.server", "--host", args.host, "--port", str(args.port), "--db", args.db],
+            env=env, stderr=subprocess.DEVNULL
+        )
+    try:
+        asyncio.run(wait_ready(args.host, args.port))
+        report = asyncio.run(run_load(args.host, args.port, args.endpoint, args.concurrency, args.requests, queries))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
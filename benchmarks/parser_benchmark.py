@@ -0,0 +1,85 @@
+"""Confronto tra parser a regole e parser originale (pipeline completa it_core_news_lg).
+
+Ogni misura gira in un interprete separato per avere tempi di import e memoria puliti:
+
+    python -m benchmarks.parser_benchmark --queries 2000
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+QUERIES = [
+    "Cosa dice l'articolo 2043 del codice civile?",
+    "Confronta le sentenze sulla responsabilità da cose in custodia",
+    "Qual è la procedura in caso di incendio?",
+    "art. 1 codice penale",
+    "Differenze tra circolare e sentenza sul risarcimento del danno",
+    "Quando si acquista la capacità giuridica?",
+]
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import src.query_parser
+print(time.perf_counter() - start)
+"""
+
+MODE_SCRIPT = """
+import json, sys, time
+import numpy as np
+from src.query_parser import QueryParser
+from src.registry import rss_bytes
+
+mode, n_queries = sys.argv[1], int(sys.argv[2])
+queries = json.loads(sys.argv[3])
+workload = [queries[i % len(queries)] for i in range(n_queries)]
+rss_before = rss_bytes()
+parser = QueryParser(mode=mode)
+start = time.perf_counter()
+try:
+    parser.parse(workload[0])
+except OSError as e:
+    print(json.dumps({"mode": mode, "error": str(e)}))
+    sys.exit(0)
+first_parse = time.perf_counter() - start
+
+latencies = []
+for query in workload:
+    start = time.perf_counter()
+    parser.parse(query)
+    latencies.append((time.perf_counter() - start) * 1000)
+
+start = time.perf_counter()
+parser.parse_batch(workload)
+batch_seconds = time.perf_counter() - start
+
+print(json.dumps({
+    "mode": mode,
+    "first_parse_seconds": round(first_parse, 3),
+    "parse_ms_p50": round(float(np.percentile(latencies, 50)), 4),
+    "parse_ms_p95": round(float(np.percentile(latencies, 95)), 4),
+    "batch_queries_per_second": round(len(workload) / batch_seconds, 1),
+    "rss_delta_mb": round((rss_bytes() - rss_before) / 2**20, 1),
+}))
+"""
+
+
+def run(script, *args):
+    result = subprocess.run([sys.executable, "-c", script, *args], capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--modes", nargs="*", default=["rules", "full"])
+    args = parser.parse_args(argv)
+
+    print(json.dumps({"import_seconds": round(float(run(IMPORT_SCRIPT)), 4)}))
+    for mode in args.modes:
+        print(run(MODE_SCRIPT, mode, str(args.queries), json.dumps(QUERIES)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Benchmark end-to-end su un corpus sintetico.
+
+Fasi misurate: ``load_database``, costruzione del ``Retriever``, ``search``,
+``QueryParser.parse``, ``check_ambiguity`` e ``process`` (backend LLM ``stub``).
+Per ogni fase: latenza p50/p95/p99, throughput, RSS ed errori, salvati in JSON.
+
+    python -m benchmarks.run --docs 20000 --queries 500 --out bench.json
+    python -m benchmarks.run --docs 20000 --queries 500 --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from src.registry import peak_rss_bytes, rss_bytes
+from .compare import compare, print_comparison
+from .corpus import generate_queries, write_corpus
+
+
+def summarize(latencies, elapsed, errors=0, first_error=None):
+    """Percentili in millisecondi, throughput e memoria al termine della fase"""
+    values = np.asarray(latencies, dtype="float64") * 1000
+    summary = {
+        "count": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "rss_mb": round(rss_bytes() / 2**20, 1),
+    }
+    if len(values):
+        for p in (50, 95, 99):
+            summary[f"p{p}_ms"] = round(float(np.percentile(values, p)), 3)
+        summary["mean_ms"] = round(float(values.mean()), 3)
+    if first_error:
+        summary["first_error"] = first_error
+    return summary
+
+
+def measure(fn, items):
+    """Esegue ``fn`` su ogni elemento; un errore viene contato senza fermare la fase"""
+    latencies, errors, first_error = [], 0, None
+    start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        try:
+            fn(item)
+        except Exception as e:
+            errors += 1
+            first_error = first_error or f"{type(e).__name__}: {e}"
+            continue
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - start, errors, first_error)
+
+
+def measure_once(fn, items=1):
+    """Fase eseguita una sola volta; il throughput è espresso in ``items`` (es. documenti) al secondo"""
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    summary = summarize([elapsed], elapsed)
+    summary["throughput_per_s"] = round(items / elapsed, 2) if elapsed > 0 else 0.0
+    return result, summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(n_docs, n_queries, seed=0, workdir=None, index_config=None, answer_cache=False):
+    # Generazione deterministica e nessuna cache delle risposte: si misura il percorso completo
+    os.environ["LEGALAI_LLM_BACKEND"] = "stub"
+    os.environ["LEGALAI_ANSWER_CACHE_ENABLED"] = "1" if answer_cache else "0"
+    from src.query_parser import QueryParser
+    from src.query_processor import QueryProcessor
+    from src.retrieval import get_retriever
+    from src.utils import load_database
+
+    workdir = workdir or tempfile.mkdtemp(prefix="legalai-bench-")
+    db_path = os.path.join(workdir, "database.jsonl")
+    entries = write_corpus(db_path, n_docs, seed=seed)
+    queries = generate_queries(entries, n_queries, seed=seed)
+    del entries
+
+    stages = {}
+    _, stages["load_database"] = measure_once(lambda: load_database(db_path), items=n_docs)
+    # Cache degli embedding vuota: la costruzione include la codifica di tutto il corpus
+    retriever, stages["retriever_build"] = measure_once(lambda: get_retriever(
+        db_path, cache_dir=os.path.join(workdir, "cache"), index_config=index_config), items=n_docs)
+    stages["search"] = measure(retriever.search, queries)
+
+    parser = QueryParser()
+    parser.parse(queries[0])  # caricamento delle regole escluso dalle latenze
+    stages["parse"] = measure(parser.parse, queries)
+
+    processor = QueryProcessor(db_path, retriever=retriever)
+    results = {query: retriever.search(query) for query in set(queries)}
+    stages["check_ambiguity"] = measure(lambda query: processor.check_ambiguity(query, results[query]), queries)
+    stages["process"] = measure(processor.process, queries)
+
+    return {
+        "meta": {
+            "docs": n_docs,
+            "queries": n_queries,
+            "seed": seed,
+            "index": retriever.index_config,
+            "answer_cache": answer_cache,
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1),
+        },
+        "stages": stages,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end di LegalAI su corpus sintetico")
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--index", default="flat", help="flat, ivf_flat, ivf_pq o hnsw")
+    parser.add_argument("--answer-cache", action="store_true", help="abilita la cache semantica delle risposte")
+    parser.add_argument("--workdir", help="cartella per corpus e cache (predefinita: temporanea)")
+    parser.add_argument("--out", help="file JSON dei risultati")
+    parser.add_argument("--baseline", help="risultati precedenti da confrontare")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="peggioramento relativo ammesso")
+    args = parser.parse_args(argv)
+
+    results = run(args.docs, args.queries, seed=args.seed, workdir=args.workdir,
+                  index_config={"kind": args.index}, answer_cache=args.answer_cache)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, tolerance=args.tolerance)
+        print_comparison(baseline, results, regressions)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Memoria del corpus: lista di dizionari (``load_database``) contro ``DocumentStore`` a colonne.
+
+Misura con tracemalloc la memoria Python allocata dopo il caricamento e la normalizza
+per 100k documenti; per lo store riporta a parte il file dei testi mappato in memoria
+(page cache del sistema, non heap del processo).
+
+    python -m benchmarks.store_memory --docs 100000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from .corpus import write_corpus
+
+
+def measure(load):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"seconds": round(elapsed, 3), "heap_mb": round(current / 2**20, 1),
+                    "peak_heap_mb": round(peak / 2**20, 1)}
+
+
+def sample_access(docs, n=10000, seed=0):
+    """Millisecondi per accesso a testo, contesto e structure di documenti casuali"""
+    rng = random.Random(seed)
+    picks = [docs[rng.randrange(len(docs))] for _ in range(n)]
+    start = time.perf_counter()
+    for doc in picks:
+        doc["text"], doc["context"], doc["structure"]
+    return round((time.perf_counter() - start) * 1000 / n, 5)
+
+
+def run(n_docs, seed=0, workdir=None):
+    from src.document_store import DocumentStore
+    from src.utils import load_database
+
+    workdir = workdir or tempfile.mkdtemp(prefix="legalai-store-")
+    db_path = os.path.join(workdir, "database.jsonl")
+    write_corpus(db_path, n_docs, seed=seed)
+    scale = 100000 / n_docs
+
+    data, dicts = measure(lambda: load_database(db_path))
+    dicts["access_ms"] = sample_access(data, seed=seed)
+    del data
+
+    store, columns = measure(lambda: DocumentStore(db_path))
+    columns["access_ms"] = sample_access(store.docs, seed=seed)
+    columns["text_file_mb"] = round(store.columns.nbytes()["text_file"] / 2**20, 1)
+
+    for report in (dicts, columns):
+        report["heap_mb_per_100k"] = round(report["heap_mb"] * scale, 1)
+    return {
+        "docs": n_docs,
+        "file_mb": round(os.path.getsize(db_path) / 2**20, 1),
+        "list_of_dicts": dicts,
+        "document_store": columns,
+        "heap_ratio": round(dicts["heap_mb"] / columns["heap_mb"], 2) if columns["heap_mb"] else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memoria del corpus: lista di dizionari contro DocumentStore")
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="cartella per il corpus (predefinita: temporanea)")
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.docs, seed=args.seed, workdir=args.workdir), indent=2))
+
+
+if __name__ == "__main__":
+    main()
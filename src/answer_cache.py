@@ -0,0 +1,176 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Stima dell'overhead per voce oltre a vettore e testo (dict, chiavi, timestamp)
+ENTRY_OVERHEAD_BYTES = 512
+
+
+def docs_fingerprint(docs):
+    """Hash degli id dei documenti recuperati, nell'ordine di rilevanza"""
+    return hashlib.sha1("\x00".join(doc["id"] for doc in docs).encode("utf-8")).hexdigest()
+
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype="float32").reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class SemanticAnswerCache:
+    """Cache delle risposte per similarità della query.
+
+    Una risposta viene riusata solo se i documenti recuperati (``docs_hash``) e la
+    versione del database coincidono e la similarità coseno tra le query supera
+    ``threshold``. Eviction LRU per numero di voci e memoria, più scadenza TTL.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=2000, max_bytes=64 * 2**20, ttl=86400, path=None,
+                 save_every=50):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.save_every = save_every
+        self.version = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # chiave -> voce, in ordine di utilizzo
+        self._buckets = {}             # (versione, docs_hash) -> chiavi
+        self._next_key = 0
+        self._bytes = 0
+        self._unsaved = 0
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+        if path:
+            self._load()
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, embedding, docs_hash, version):
+        """Risposta della query più simile con gli stessi documenti e versione, o None"""
+        query = _normalize(embedding)
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for key in list(self._buckets.get((version, docs_hash), ())):
+                entry = self._entries[key]
+                if self.ttl and now - entry["created_at"] > self.ttl:
+                    self._evict(key)
+                    self._counters["expired"] += 1
+                    continue
+                score = float(np.dot(entry["embedding"], query))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self._counters["hits"] += 1
+            return self._entries[best_key]["answer"]
+
+    def store(self, query, embedding, docs_hash, version, answer):
+        vector = _normalize(embedding)
+        entry = {
+            "query": query,
+            "embedding": vector,
+            "docs_hash": docs_hash,
+            "version": version,
+            "answer": answer,
+            "created_at": time.time(),
+        }
+        entry["size"] = vector.nbytes + len(answer.encode("utf-8")) + len(query.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            self._insert(entry)
+            self._counters["stores"] += 1
+            self._unsaved += 1
+            save_now = self.path and self._unsaved >= self.save_every
+        if save_now:
+            self.save()
+
+    def _insert(self, entry):
+        key = self._next_key
+        self._next_key += 1
+        self._entries[key] = entry
+        self._buckets.setdefault((entry["version"], entry["docs_hash"]), []).append(key)
+        self._bytes += entry["size"]
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._evict(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+        bucket_key = (entry["version"], entry["docs_hash"])
+        bucket = self._buckets[bucket_key]
+        bucket.remove(key)
+        if not bucket:
+            del self._buckets[bucket_key]
+
+    def invalidate(self, version=None):
+        """Elimina le risposte di versioni del database diverse da ``version`` (tutte se None)"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if version is None or entry["version"] != version]
+            for key in stale:
+                self._evict(key)
+            self.version = version
+            self._counters["invalidations"] += 1
+            self._unsaved += len(stale)
+        if stale:
+            logging.info(f"Cache risposte invalidata: {len(stale)} voci rimosse")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def save(self):
+        """Salvataggio atomico su disco (solo se è configurato ``path``)"""
+        if not self.path:
+            return
+        with self._lock:
+            data = [
+                {**{k: v for k, v in entry.items() if k not in ("embedding", "size")},
+                 "embedding": entry["embedding"].tolist()}
+                for entry in self._entries.values()
+            ]
+            self._unsaved = 0
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Cache risposte illeggibile in {self.path}, verrà ricreata: {str(e)}")
+            return
+        now = time.time()
+        with self._lock:
+            for item in data:
+                if self.ttl and now - item["created_at"] > self.ttl:
+                    continue
+                vector = np.asarray(item["embedding"], dtype="float32")
+                item["embedding"] = vector
+                item["size"] = (vector.nbytes + len(item["answer"].encode("utf-8"))
+                                + len(item["query"].encode("utf-8")) + ENTRY_OVERHEAD_BYTES)
+                self._insert(item)
+        logging.info(f"Cache risposte caricata: {len(self._entries)} voci da {self.path}")
@@ -0,0 +1,67 @@
+"""Elaborazione offline di un elenco di domande, con risultati in streaming su JSONL.
+
+    python -m src.batch domande.jsonl risposte.jsonl --batch-size 64
+
+L'input è un file JSONL con un campo ``query`` per riga oppure un file di testo con
+una domanda per riga. Ogni riga di output contiene ``index``, ``query``, ``response``
+ed ``error``; il file viene scritto blocco per blocco, senza tenere i risultati in memoria.
+"""
+import argparse
+import json
+import logging
+import time
+
+
+def iter_queries(path):
+    """Domande dal file, lette una riga alla volta"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            yield json.loads(line)["query"] if path.endswith(".jsonl") else line
+
+
+def write_results(results, output_path):
+    """Scrive i risultati in JSONL man mano che arrivano; restituisce (totale, errori)"""
+    total = errors = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False))
+            f.write("\n")
+            total += 1
+            errors += result["error"] is not None
+            if total % 100 == 0:
+                f.flush()
+    return total, errors
+
+
+def run_batch(input_path, output_path, db_path="data/database.json", batch_size=None, timeout=None):
+    from .query_processor import QueryProcessor
+
+    processor = QueryProcessor(db_path)
+    start = time.perf_counter()
+    total, errors = write_results(
+        processor.process_batch(iter_queries(input_path), batch_size=batch_size, timeout=timeout), output_path
+    )
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Batch completato: {total} query in {elapsed:.1f}s ({total / elapsed if elapsed > 0 else 0:.1f} query/s), "
+        f"{errors} errori"
+    )
+    return {"queries": total, "errors": errors, "seconds": round(elapsed, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Elaborazione offline di domande con risultati in JSONL")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--db", default="data/database.json")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None, help="timeout di generazione per query (secondi)")
+    args = parser.parse_args(argv)
+    print(json.dumps(run_batch(args.input, args.output, args.db, args.batch_size, args.timeout)))
+
+
+if __name__ == "__main__":
+    main()
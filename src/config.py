@@ -0,0 +1,49 @@
+import os
+
+# Valori predefiniti; ogni impostazione si può sovrascrivere con LEGALAI_<NOME>
+DEFAULTS = {
+    # Backend di generazione: "hf" (pipeline completa), "cpu" (int8, modello ridotto), "stub" (test)
+    "llm_backend": "hf",
+    # Modello del backend; vuoto = predefinito del backend
+    "llm_model": "",
+    # Token riservati alla risposta (non più condivisi con il prompt come con max_length)
+    "llm_max_new_tokens": 512,
+    # Riuso della KV cache del prefisso costante del prompt (istruzioni)
+    "llm_prefix_cache": True,
+    # Budget di token per i documenti nel contesto del prompt
+    "context_max_tokens": 2048,
+    # Cache semantica delle risposte
+    "answer_cache_enabled": True,
+    "answer_cache_threshold": 0.95,
+    "answer_cache_max_entries": 2000,
+    "answer_cache_max_mb": 64,
+    "answer_cache_ttl": 86400,
+    # File di persistenza; vuoto = solo in memoria
+    "answer_cache_path": "",
+    # Cartella del file temporaneo con i testi del DocumentStore (mappato in memoria); vuoto = cartella temporanea di sistema
+    "store_dir": "",
+    # Documenti minimi ammessi dai filtri sui metadati prima di allentarli (ricerca più ampia)
+    "filter_min_matches": 3,
+    # Dimensione dei blocchi di QueryProcessor.process_batch
+    "batch_size": 32,
+    # Servizio HTTP (src/server.py)
+    "server_host": "127.0.0.1",
+    "server_port": 8000,
+    "server_max_concurrency": 8,
+    "server_max_pending": 32,
+    "server_timeout": 120.0,
+    # Metriche e tracing per fase; exporter: "memory", "prometheus" o "json" (una riga di log per richiesta)
+    "metrics_enabled": True,
+    "metrics_exporter": "memory",
+}
+
+
+def get(name):
+    """Legge un'impostazione dall'ambiente al momento della chiamata, con il tipo del valore predefinito"""
+    default = DEFAULTS[name]
+    value = os.environ.get(f"LEGALAI_{name.upper()}")
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
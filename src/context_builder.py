@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+from . import config
+from .registry import registry
+
+# Sezioni del contesto, nell'ordine in cui compaiono nel prompt
+SECTIONS = (
+    ("legge", "Articoli di legge pertinenti:"),
+    ("sentenza", "Interpretazioni giurisprudenziali:"),
+    ("procedura", "Procedure correlate:"),
+)
+SECTION_TYPES = {tipo for tipo, _ in SECTIONS}
+
+
+def render_doc(doc):
+    """Blocco di testo di un documento nel contesto del prompt"""
+    if doc["type"] == "legge":
+        return f"- {doc['id']}: {doc['text']}\n  Contesto: {doc['context']}"
+    if doc["type"] == "sentenza":
+        return f"- Sentenza {doc['id']}:\n  {doc['text']}"
+    return f"- {doc['id']}:\n  {doc['text']}"
+
+
+class ContextBuilder:
+    """Assembla il contesto del prompt entro un budget di token.
+
+    I documenti arrivano in ordine di rilevanza: duplicati (stesso id o stesso testo)
+    vengono scartati e si includono i più rilevanti finché c'è spazio, saltando quelli
+    che da soli supererebbero il budget residuo. I token di ogni blocco sono contati
+    con il tokenizer del modello e memorizzati in una LRU per testo del blocco.
+    """
+
+    def __init__(self, count_tokens, budget=2048, cache_size=10000):
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._token_cache = OrderedDict()
+
+    def tokens(self, text):
+        with self._lock:
+            count = self._token_cache.get(text)
+            if count is not None:
+                self._token_cache.move_to_end(text)
+                return count
+        count = self.count_tokens(text)
+        with self._lock:
+            self._token_cache[text] = count
+            if len(self._token_cache) > self.cache_size:
+                self._token_cache.popitem(last=False)
+        return count
+
+    def select(self, docs, budget=None):
+        """Documenti da includere (in ordine di rilevanza), token usati e documenti esclusi per il budget"""
+        budget = self.budget if budget is None else budget
+        selected, used, dropped = [], 0, 0
+        seen_ids, seen_texts, sections = set(), set(), set()
+        for doc in docs:
+            if doc["type"] not in SECTION_TYPES or doc["id"] in seen_ids or doc["text"] in seen_texts:
+                continue
+            seen_ids.add(doc["id"])
+            seen_texts.add(doc["text"])
+            # Un token in più per ogni a capo di separazione; l'intestazione si paga una volta per sezione
+            cost = self.tokens(render_doc(doc)) + 1
+            if doc["type"] not in sections:
+                cost += self.tokens(dict(SECTIONS)[doc["type"]]) + 2
+            if used + cost > budget:
+                dropped += 1
+                continue
+            selected.append(doc)
+            sections.add(doc["type"])
+            used += cost
+        return selected, used, dropped
+
+    def build(self, docs, budget=None):
+        """Contesto strutturato per sezioni e statistiche ``{"tokens", "docs", "dropped"}``"""
+        selected, used, dropped = self.select(docs, budget)
+        parts = []
+        for tipo, header in SECTIONS:
+            blocks = [render_doc(doc) for doc in selected if doc["type"] == tipo]
+            if blocks:
+                parts.append(f"\n{header}" if parts else header)
+                parts.extend(blocks)
+        return "\n".join(parts), {"tokens": used, "docs": len(selected), "dropped": dropped}
+
+
+def get_context_builder(llm):
+    """Builder condiviso per il modello dell'LLM (la cache dei conteggi vale per il suo tokenizer)"""
+    return registry.get(
+        f"context:{llm.model_name}",
+        lambda: ContextBuilder(llm.count_tokens, budget=config.get("context_max_tokens"))
+    )
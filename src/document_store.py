@@ -0,0 +1,479 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sys
+import tempfile
+import threading
+from array import array
+from collections import defaultdict
+from collections.abc import Mapping
+
+from . import config
+from .utils import database_files, file_lock, load_database_with_stats, validate_entry, write_database
+
+# Campi tenuti in colonne dedicate; il resto dell'entry (structure ed eventuali campi extra)
+# è serializzato in JSON nel file mappato insieme al testo
+COLUMN_FIELDS = ("id", "type", "text", "context")
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+# Quota di byte morti (versioni sostituite o eliminate) oltre la quale il file dei testi è compattato
+COMPACT_RATIO = 0.25
+
+
+class StaleDatabaseError(RuntimeError):
+    """Il file del database è stato modificato da un'altra istanza dopo l'ultimo caricamento"""
+
+
+class StaleDocumentError(RuntimeError):
+    """La riga di una vista ``Document`` è stata liberata o riusata da un altro documento"""
+
+
+class Interner:
+    """Valori ripetuti (tipo, contesto) memorizzati una volta sola e riferiti con un codice intero"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return code
+
+
+class DocumentColumns:
+    """Documenti in colonne compatte, indicizzati per riga intera.
+
+    ``id`` in una lista, ``type`` e ``context`` come codici in array di interi, ``text`` e
+    il resto dell'entry (JSON) in un file temporaneo mappato in memoria: i testi stanno
+    nella page cache del sistema e sono decodificati solo quando vengono letti.
+    Una riga liberata (``free``) può essere riscritta con ``put``; i suoi byte restano nel
+    file finché ``compact`` non lo riscrive con le sole righe occupate. ``generations``
+    conta liberazioni e riscritture di ogni riga: le viste la confrontano a ogni lettura.
+    """
+
+    def __init__(self, directory=None):
+        self.ids = []
+        self.types = Interner()
+        self.contexts = Interner()
+        self.type_codes = array("H")
+        self.context_codes = array("I")
+        self.generations = array("I")
+        self._directory = directory or None
+        self._file = tempfile.TemporaryFile(prefix="legalai-docs-", dir=self._directory)
+        # Scritture sul file e pubblicazione di ``_size`` avvengono sotto lo stesso lock della rimappatura
+        self._lock = threading.Lock()
+        self._size = 0
+        self.dead_bytes = 0
+        # (posizione del testo, lunghezza del testo, lunghezza del resto dell'entry, mappa, byte mappati):
+        # sostituita in blocco (nuova mappa o compattazione), chi legge ne prende una copia coerente
+        self._layout = (array("Q"), array("I"), array("I"), None, 0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def text_offsets(self):
+        return self._layout[0]
+
+    @property
+    def text_lengths(self):
+        return self._layout[1]
+
+    @property
+    def extra_lengths(self):
+        return self._layout[2]
+
+    def _write(self, entry, row):
+        text = entry["text"].encode("utf-8")
+        extra = _ENCODER.encode(
+            {key: value for key, value in entry.items() if key not in COLUMN_FIELDS}
+        ).encode("utf-8")
+        with self._lock:
+            offsets, text_lengths, extra_lengths, _, _ = self._layout
+            self._file.write(text + extra)
+            if row == len(offsets):
+                offsets.append(self._size)
+                text_lengths.append(len(text))
+                extra_lengths.append(len(extra))
+            else:
+                offsets[row], text_lengths[row], extra_lengths[row] = self._size, len(text), len(extra)
+            self._size += len(text) + len(extra)
+
+    def append(self, entry):
+        """Aggiunge l'entry in una nuova riga e ne restituisce l'indice"""
+        return self.put(len(self.ids), entry)
+
+    def put(self, row, entry):
+        """Scrive l'entry nella riga (una riga liberata o la prima dopo l'ultima) e ne restituisce l'indice"""
+        if row < len(self.ids):
+            # Generazione incrementata prima di riscrivere: chi legge la riga se ne accorge
+            self.generations[row] += 1
+        self._write(entry, row)
+        type_code = self.types.code(entry["type"])
+        context_code = self.contexts.code(entry["context"])
+        id = sys.intern(entry["id"])
+        if row == len(self.ids):
+            self.type_codes.append(type_code)
+            self.context_codes.append(context_code)
+            self.generations.append(0)
+            self.ids.append(id)
+        else:
+            self.type_codes[row], self.context_codes[row], self.ids[row] = type_code, context_code, id
+        return row
+
+    def free(self, row):
+        """Segna come morti i byte della riga: non saranno copiati dalla prossima compattazione"""
+        self.generations[row] += 1
+        with self._lock:
+            offsets, text_lengths, extra_lengths, _, _ = self._layout
+            self.dead_bytes += text_lengths[row] + extra_lengths[row]
+            offsets[row], text_lengths[row], extra_lengths[row] = 0, 0, 0
+
+    def compact(self):
+        """Riscrive il file con i soli byte delle righe occupate (le righe mantengono il loro indice)"""
+        with self._lock:
+            old_offsets, text_lengths, extra_lengths, buffer, mapped = self._layout
+            self._file.flush()
+            if self._size > mapped:
+                buffer = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ) if self._size else None
+            target = tempfile.TemporaryFile(prefix="legalai-docs-", dir=self._directory)
+            offsets = array("Q", bytes(old_offsets.itemsize * len(old_offsets)))
+            size = 0
+            for row, start in enumerate(old_offsets):
+                length = text_lengths[row] + extra_lengths[row]
+                if length:
+                    target.write(buffer[start:start + length])
+                    offsets[row] = size
+                    size += length
+            target.flush()
+            # Le mappe precedenti restano valide per chi le sta leggendo (mmap tiene un proprio descrittore)
+            new_buffer = mmap.mmap(target.fileno(), size, access=mmap.ACCESS_READ) if size else None
+            self._layout = (offsets, array("I", text_lengths), array("I", extra_lengths), new_buffer, size)
+            self._file.close()
+            self._file = target
+            logging.info(f"File dei testi compattato: {self._size} -> {size} byte")
+            self._size = size
+            self.dead_bytes = 0
+
+    def _bytes(self, row, extra=False):
+        while True:
+            layout = self._layout
+            offsets, text_lengths, extra_lengths, buffer, mapped = layout
+            start = offsets[row]
+            length = text_lengths[row]
+            if extra:
+                start, length = start + length, extra_lengths[row]
+            if not length:
+                return b""
+            if start + length <= mapped:
+                return buffer[start:start + length]
+            # Righe scritte dopo l'ultima mappatura: si rimappa il file fino ai byte già scritti e
+            # svuotati dal buffer (le vecchie mappe restano valide per chi le sta leggendo)
+            with self._lock:
+                if self._layout is layout:
+                    self._file.flush()
+                    buffer = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+                    self._layout = (offsets, text_lengths, extra_lengths, buffer, self._size)
+            # Se nel frattempo il file è stato compattato le posizioni vanno rilette dal nuovo layout
+
+    def type(self, row):
+        return self.types.values[self.type_codes[row]]
+
+    def context(self, row):
+        return self.contexts.values[self.context_codes[row]]
+
+    def text(self, row):
+        return self._bytes(row).decode("utf-8")
+
+    def extra(self, row):
+        """Campi dell'entry oltre alle colonne (almeno ``structure``), decodificati a ogni lettura"""
+        return json.loads(self._bytes(row, extra=True))
+
+    def field(self, row, key):
+        if key == "id":
+            return self.ids[row]
+        if key == "type":
+            return self.type(row)
+        if key == "context":
+            return self.context(row)
+        if key == "text":
+            return self.text(row)
+        return self.extra(row)[key]
+
+    def to_dict(self, row):
+        return {"id": self.ids[row], "type": self.type(row), "text": self.text(row),
+                "context": self.context(row), **self.extra(row)}
+
+    def nbytes(self):
+        """Byte occupati da colonne in memoria e file dei testi (senza la lista degli id)"""
+        arrays = (self.type_codes, self.context_codes, self.generations, self.text_offsets, self.text_lengths,
+                  self.extra_lengths)
+        return {
+            "columns": sum(column.itemsize * len(column) for column in arrays),
+            "text_file": self._size,
+            "dead": self.dead_bytes,
+        }
+
+    def close(self):
+        buffer = self._layout[3]
+        if buffer is not None:
+            buffer.close()
+        self._file.close()
+
+
+class Document(Mapping):
+    """Vista in sola lettura di una riga, compatibile con il dizionario dell'entry.
+
+    I campi sono letti dalle colonne a ogni accesso; ``dict(doc)`` o ``copy.deepcopy(doc)``
+    restituiscono un dizionario modificabile. La vista ricorda la generazione della riga:
+    se la riga viene liberata o riusata da un altro documento, ogni lettura solleva
+    ``StaleDocumentError`` invece di restituire i campi del nuovo occupante.
+    """
+
+    __slots__ = ("_columns", "_row", "_generation")
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self._row = row
+        self._generation = columns.generations[row]
+
+    @property
+    def row(self):
+        return self._row
+
+    def _read(self, read, *args):
+        # Generazione controllata prima e dopo: una riscrittura concorrente non passa inosservata
+        generations = self._columns.generations
+        try:
+            if generations[self._row] == self._generation:
+                value = read(self._row, *args)
+                if generations[self._row] == self._generation:
+                    return value
+        except ValueError:
+            # Byte di una riga liberata durante la lettura
+            if generations[self._row] == self._generation:
+                raise
+        raise StaleDocumentError(f"La riga {self._row} non contiene più il documento di questa vista")
+
+    def __getitem__(self, key):
+        try:
+            return self._read(self._columns.field, key)
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in COLUMN_FIELDS or key in self._read(self._columns.extra)
+
+    def __iter__(self):
+        yield from COLUMN_FIELDS
+        yield from self._read(self._columns.extra)
+
+    def __len__(self):
+        return len(COLUMN_FIELDS) + len(self._read(self._columns.extra))
+
+    def to_dict(self):
+        return self._read(self._columns.to_dict)
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __copy__(self):
+        return self.to_dict()
+
+    def __deepcopy__(self, memo):
+        return self.to_dict()
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class DocumentStore:
+    """Documenti del database indicizzati per id, con aggiornamenti incrementali versionati.
+
+    Ogni upsert/delete valida solo le entry coinvolte, riscrive il file in modo atomico
+    e incrementa ``version``: chi condivide lo store vede subito la nuova versione.
+    I documenti sono tenuti in ``DocumentColumns`` e restituiti come viste ``Document``;
+    ``row`` è l'intero di ogni versione di un documento (usato come id FAISS). Le righe
+    sostituite o eliminate da un commit sono riusate dal commit successivo: le viste sulla
+    versione precedente restano leggibili fino ad allora, poi sollevano ``StaleDocumentError``;
+    righe, etichette e bitmap non crescono con il numero di aggiornamenti.
+    """
+
+    def __init__(self, db_path, directory=None):
+        self.path = db_path
+        self.version = 0
+        self._lock = threading.RLock()
+        self.columns = DocumentColumns(directory or config.get("store_dir"))
+        self.row_by_id = {}  # id -> riga corrente, nell'ordine del file
+        self.cited_by = defaultdict(dict)  # id citato -> {id che lo cita: None}, in ordine di inserimento
+        self._released = []  # righe lasciate dall'ultimo commit, riusabili dal successivo
+        self._free = []  # righe riusabili da _insert
+        # Caricamento in streaming direttamente nelle colonne (nessuna lista di dizionari)
+        load_database_with_stats(db_path, into=self)
+        self._docs = None
+        self.revision = self._file_revision()
+
+    def _file_revision(self):
+        """Impronta del contenuto su disco (SHA-256 dei file, shard compresi): stabile tra riavvii e
+        diversa dopo ogni modifica, anche se dimensione e mtime del file restano uguali"""
+        digest = hashlib.sha256()
+        for path in database_files(self.path):
+            digest.update(os.path.basename(path).encode("utf-8") + b"\x00")
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()[:32]
+
+    def __len__(self):
+        return len(self.row_by_id)
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def __contains__(self, id):
+        return id in self.row_by_id
+
+    @property
+    def docs(self):
+        """Lista dei documenti nell'ordine del file (ricalcolata solo dopo un aggiornamento)"""
+        docs = self._docs
+        if docs is None:
+            with self._lock:
+                docs = self._docs = [Document(self.columns, row) for row in self.row_by_id.values()]
+        return docs
+
+    def rows(self):
+        """Righe correnti nell'ordine del file"""
+        return list(self.row_by_id.values())
+
+    def row(self, id):
+        return self.row_by_id.get(id)
+
+    def at(self, row):
+        """Documento della riga, se è ancora la versione corrente"""
+        if 0 <= row < len(self.columns) and self.row_by_id.get(self.columns.ids[row]) == row:
+            return Document(self.columns, row)
+        return None
+
+    def get(self, id):
+        row = self.row_by_id.get(id)
+        return Document(self.columns, row) if row is not None else None
+
+    def citing(self, id):
+        """Documenti che citano l'id (es. sentenze su un articolo)"""
+        return [self.get(citing) for citing in self.cited_by.get(id, {})]
+
+    def cites(self, id):
+        """Documenti citati dall'id"""
+        doc = self.get(id)
+        if doc is None:
+            return []
+        return [self.get(ref) for ref in doc["structure"].get("riferimenti", []) if ref in self.row_by_id]
+
+    def _unlink(self, row):
+        id = self.columns.ids[row]
+        for ref in self.columns.extra(row)["structure"].get("riferimenti", []):
+            citing = self.cited_by.get(ref)
+            if citing is not None:
+                citing.pop(id, None)
+                if not citing:
+                    del self.cited_by[ref]
+
+    def _insert(self, doc):
+        # Un documento esistente mantiene la sua posizione (la chiave del dizionario non si sposta)
+        old = self.row_by_id.get(doc["id"])
+        if old is not None:
+            self._unlink(old)
+            self._released.append(old)
+        if self._free:
+            row = self.columns.put(self._free.pop(), doc)
+        else:
+            row = self.columns.append(doc)
+        self.row_by_id[doc["id"]] = row
+        for ref in doc["structure"].get("riferimenti", []):
+            self.cited_by[ref][doc["id"]] = None
+
+    # Destinazione di load_database_with_stats
+    append = _insert
+
+    def _remove(self, id):
+        row = self.row_by_id.pop(id)
+        self._unlink(row)
+        self._released.append(row)
+        return row
+
+    def _recycle(self):
+        """Rende riusabili le righe lasciate dal commit precedente"""
+        for row in self._released:
+            self.columns.free(row)
+        self._free.extend(reversed(self._released))
+        self._released = []
+
+    def prepare_upsert(self, entries):
+        """Valida le entry nuove o modificate e le restituisce (quelle identiche vengono ignorate)"""
+        changed = {}
+        for entry in entries:
+            if self.get(entry.get("id")) != entry:
+                changed[entry["id"]] = entry
+        known_ids = self.row_by_id.keys() | changed.keys()
+        for entry in changed.values():
+            validate_entry(entry, known_ids=known_ids)
+        return list(changed.values())
+
+    def prepare_delete(self, ids):
+        """Verifica che gli id esistano e che nessun documento rimanente li citi"""
+        ids = list(dict.fromkeys(ids))
+        missing = [id for id in ids if id not in self.row_by_id]
+        if missing:
+            raise ValueError(f"Documenti non trovati nel database: {missing}")
+        removed = set(ids)
+        for id in ids:
+            still_citing = [citing for citing in self.cited_by.get(id, {}) if citing not in removed]
+            if still_citing:
+                raise ValueError(f"Documento {id} citato da: {still_citing}")
+        return ids
+
+    def commit(self, upserts=(), deletes=()):
+        """Applica modifiche già validate: file riscritto atomicamente, poi aggiornamento in memoria.
+
+        Il file viene riscritto dallo stato in memoria solo se è ancora quello letto da questa
+        istanza: se un'altra istanza (o un altro processo) lo ha modificato nel frattempo solleva
+        ``StaleDatabaseError`` invece di cancellarne le modifiche.
+        """
+        with self._lock, file_lock(f"{self.path}.lock"):
+            if not upserts and not deletes:
+                return self.version
+            if self._file_revision() != self.revision:
+                raise StaleDatabaseError(
+                    f"Database {self.path} modificato da un'altra istanza: ricaricarlo prima di aggiornarlo"
+                )
+            removed = set(deletes)
+            pending = {entry["id"]: entry for entry in upserts}
+            data = [
+                pending.pop(id) if id in pending else self.columns.to_dict(row)
+                for id, row in self.row_by_id.items() if id not in removed
+            ]
+            data.extend(pending.values())
+            write_database(self.path, data)
+
+            self._recycle()
+            for id in deletes:
+                self._remove(id)
+            for entry in upserts:
+                self._insert(entry)
+            if self.columns.dead_bytes > COMPACT_RATIO * self.columns.nbytes()["text_file"]:
+                self.columns.compact()
+            self._docs = None
+            self.version += 1
+            self.revision = self._file_revision()
+            logging.info(
+                f"Database {self.path} alla versione {self.version}: "
+                f"{len(upserts)} upsert, {len(deletes)} eliminazioni"
+            )
+            return self.version
@@ -0,0 +1,329 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import uuid
+
+import faiss
+import numpy as np
+
+from .utils import file_lock
+
+
+def doc_text(doc):
+    """Testo usato per l'embedding di un documento"""
+    return f"{doc['text']} {doc['context']}"
+
+
+def content_key(model_name, text):
+    """Chiave stabile: hash del nome del modello e del testo da codificare"""
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def _atomic_write(path, write_fn, mode="wb"):
+    tmp_path = f"{path}.tmp"
+    encoding = None if "b" in mode else "utf-8"
+    with open(tmp_path, mode, encoding=encoding) as f:
+        write_fn(f)
+    os.replace(tmp_path, path)
+
+
+# Compattazione quando le righe superate o non più usate superano questa quota del file
+COMPACT_RATIO = 0.25
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.txt"
+META_FILE = "meta.json"
+LOCK_FILE = "lock"
+
+
+def _slug(name):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+
+def scope_dir(db_path):
+    """Sottocartella della cache per un database: nome del file e hash del percorso assoluto"""
+    path = os.path.abspath(db_path)
+    return f"{_slug(os.path.basename(path))}-{hashlib.sha256(path.encode('utf-8')).hexdigest()[:8]}"
+
+
+def read_vectors(directory):
+    """Vettori confermati di una cartella della cache, come array memory-mapped (None se vuota)"""
+    with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if not meta["rows"]:
+        return None
+    return np.memmap(os.path.join(directory, VECTORS_FILE), dtype="float32", mode="r",
+                     shape=(meta["rows"], meta["dim"]))
+
+
+class EmbeddingCache:
+    """Archivio persistente degli embedding, scritto solo in aggiunta.
+
+    ``vectors.f32`` contiene le righe float32 una dopo l'altra e ``keys.txt`` le chiavi
+    nello stesso ordine (una per riga); ``meta.json`` registra righe e byte confermati e la
+    ``generation``, che cambia a ogni riscrittura dei file. Un flush aggiunge in coda solo i
+    vettori nuovi e poi aggiorna ``meta.json`` in modo atomico: byte oltre quelli confermati
+    (scrittura interrotta) vengono troncati. Le righe superate (``discard``) o non più usate
+    (``flush(keep=...)``) si eliminano riscrivendo i file solo quando superano ``COMPACT_RATIO``.
+
+    Più istanze (e più processi) possono condividere la cartella: ogni scrittura avviene
+    sotto un lock consultivo sul file ``lock`` e rilegge prima ``meta.json``, adottando le
+    righe aggiunte dalle altre istanze; dopo una compattazione altrui le chiavi ancora vive
+    per questa istanza vengono riaggiunte dalla mappa precedente. Una cartella per modello
+    evita di mescolare dimensioni diverse e ``scope`` (es. il percorso del database) separa
+    i corpus, così ``keep`` di un database non scarta i vettori di un altro.
+    """
+
+    def __init__(self, cache_dir, model_name, scope=None):
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, _slug(model_name))
+        if scope is not None:
+            self.dir = os.path.join(self.dir, scope_dir(scope))
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.dir, VECTORS_FILE)
+        self.keys_path = os.path.join(self.dir, KEYS_FILE)
+        self.meta_path = os.path.join(self.dir, META_FILE)
+        self.lock_path = os.path.join(self.dir, LOCK_FILE)
+        self.dim = None
+        self._keys = []          # chiavi delle righe su disco, nell'ordine del file
+        self._keys_bytes = 0     # byte di keys.txt corrispondenti a _keys
+        self._generation = None  # generation dei file letta all'ultima sincronizzazione
+        self._rows = {}          # chiave viva -> riga su disco
+        self._pending = {}       # chiave viva -> vettore non ancora scritto
+        self._vectors = None
+        with self._locked():
+            self._sync()
+        if self._keys:
+            logging.info(f"Cache embedding caricata: {len(self._keys)} vettori da {self.dir}")
+
+    def __len__(self):
+        return len(self._rows) + len(self._pending)
+
+    def __contains__(self, key):
+        return key in self._rows or key in self._pending
+
+    @property
+    def stale(self):
+        """Righe su disco non più vive per questa istanza"""
+        return len(self._keys) - len(self._rows)
+
+    def _locked(self):
+        """Lock esclusivo tra istanze e processi sulla cartella (non rientrante)"""
+        return file_lock(self.lock_path)
+
+    def _read_meta(self):
+        """``meta.json`` se coerente con i file, altrimenti None (la cache riparte vuota)"""
+        if not os.path.exists(self.meta_path):
+            return None
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            rows, dim, keys_bytes = meta["rows"], meta["dim"], meta["keys_bytes"]
+            consistent = (os.path.getsize(self.vectors_path) >= rows * (dim or 0) * 4
+                          and os.path.getsize(self.keys_path) >= keys_bytes
+                          and (self.dim is None or not rows or dim == self.dim))
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Cache embedding illeggibile in {self.dir}, verrà ricostruita: {str(e)}")
+            return None
+        if not consistent:
+            logging.warning(f"Cache embedding incoerente in {self.dir}, verrà ricostruita")
+            return None
+        return meta
+
+    def _read_keys(self, start, end):
+        with open(self.keys_path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start).decode("ascii").split()
+
+    def _truncate(self, rows, keys_bytes):
+        # Righe aggiunte ma non confermate da meta.json (scrittura interrotta): scartate
+        for path, size in ((self.vectors_path, rows * (self.dim or 0) * 4), (self.keys_path, keys_bytes)):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _sync(self):
+        """Allinea lo stato in memoria ai file; da chiamare sotto lock prima di ogni scrittura"""
+        meta = self._read_meta()
+        if meta is None:
+            generation, rows, keys_bytes = None, 0, 0
+        else:
+            generation, rows, keys_bytes = meta["generation"], meta["rows"], meta["keys_bytes"]
+            if rows:
+                self.dim = meta["dim"]
+        self._truncate(rows, keys_bytes)
+        if generation == self._generation and rows == len(self._keys):
+            return
+        if generation == self._generation and rows > len(self._keys):
+            # Righe aggiunte in coda da un'altra istanza
+            start, new_keys = len(self._keys), self._read_keys(self._keys_bytes, keys_bytes)
+        else:
+            # File riscritti da un'altra istanza (o ricreati): le chiavi vive che non vi compaiono
+            # più tornano in sospeso, copiate dalla mappa precedente
+            start, new_keys = 0, self._read_keys(0, keys_bytes)
+            on_disk = set(new_keys)
+            for key, row in self._rows.items():
+                if key not in on_disk:
+                    self._pending[key] = np.array(self._vectors[row])
+            self._keys, self._rows = [], {}
+        for row, key in enumerate(new_keys, start):
+            self._rows[key] = row
+            self._pending.pop(key, None)
+        self._keys.extend(new_keys)
+        self._keys_bytes = keys_bytes
+        self._generation = generation
+        self._map()
+
+    def _map(self):
+        rows = len(self._keys)
+        self._vectors = np.memmap(self.vectors_path, dtype="float32", mode="r",
+                                  shape=(rows, self.dim)) if rows else None
+
+    def _write_meta(self, rows, keys_bytes, generation):
+        meta = {"rows": rows, "dim": self.dim, "keys_bytes": keys_bytes, "generation": generation}
+        _atomic_write(self.meta_path, lambda f: json.dump(meta, f), mode="w")
+        self._generation = generation
+
+    def get(self, keys):
+        """Restituisce i vettori per le chiavi indicate (tutte devono essere presenti).
+
+        I vettori in sospeso sono serviti dalla memoria: nessuna scrittura su disco.
+        """
+        if not keys:
+            return np.empty((0, self.dim or 0), dtype="float32")
+        pending = self._pending
+        if not pending or not any(key in pending for key in keys):
+            rows = [self._rows[key] for key in keys]
+            # Righe contigue: vista diretta sul file mappato, senza copia
+            if rows == list(range(rows[0], rows[0] + len(rows))):
+                return self._vectors[rows[0]:rows[0] + len(rows)]
+            return np.asarray(self._vectors[rows])
+        out = np.empty((len(keys), self.dim), dtype="float32")
+        for i, key in enumerate(keys):
+            vector = pending.get(key)
+            out[i] = vector if vector is not None else self._vectors[self._rows[key]]
+        return out
+
+    def put(self, keys, vectors):
+        """Aggiunge vettori nuovi; restano in memoria fino al prossimo flush"""
+        vectors = np.asarray(vectors, dtype="float32")
+        if self.dim is None and len(vectors):
+            self.dim = vectors.shape[1]
+        for key, vector in zip(keys, vectors):
+            if key not in self:
+                self._pending[key] = vector
+
+    def discard(self, keys):
+        """Segna come superati i vettori delle chiavi (es. versioni precedenti di documenti aggiornati)"""
+        for key in keys:
+            if self._rows.pop(key, None) is None:
+                self._pending.pop(key, None)
+
+    def encode_missing(self, texts, encode_fn):
+        """Codifica solo i testi assenti dalla cache e restituisce le chiavi di tutti i testi"""
+        keys = [content_key(self.model_name, text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self and key not in missing:
+                missing[key] = text
+        if missing:
+            logging.info(f"Embedding da calcolare: {len(missing)} su {len(keys)} documenti")
+            self.put(list(missing), encode_fn(list(missing.values())))
+        else:
+            logging.info(f"Embedding tutti presenti in cache ({len(keys)} documenti)")
+        return keys
+
+    def flush(self, keep=None):
+        """Aggiunge su disco i vettori in sospeso; con ``keep`` le altre chiavi diventano superate.
+
+        Costo proporzionale ai vettori nuovi; i file vengono riscritti solo per la compattazione.
+        """
+        if keep is not None:
+            keep = set(keep)
+            self.discard([key for key in list(self._rows) + list(self._pending) if key not in keep])
+        with self._locked():
+            self._sync()
+            self._append()
+            # Riscrittura solo dopo molte righe superate: costo ammortizzato costante per aggiornamento
+            if self.stale and self.stale > COMPACT_RATIO * len(self._keys):
+                self._compact()
+
+    def compact(self):
+        """Riscrive i file con le sole righe vive (i vettori in sospeso vengono prima aggiunti)"""
+        with self._locked():
+            self._sync()
+            self._append()
+            if self.stale:
+                self._compact()
+
+    def _append(self):
+        if not self._pending:
+            return
+        keys = list(self._pending)
+        data = "".join(f"{key}\n" for key in keys).encode("ascii")
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(np.stack(list(self._pending.values())), dtype="float32").tobytes())
+        with open(self.keys_path, "ab") as f:
+            f.write(data)
+        for row, key in enumerate(keys, len(self._keys)):
+            self._rows[key] = row
+        self._keys.extend(keys)
+        self._keys_bytes += len(data)
+        self._pending = {}
+        self._write_meta(len(self._keys), self._keys_bytes, self._generation or uuid.uuid4().hex)
+        self._map()
+
+    def _compact(self):
+        live = sorted(self._rows.items(), key=lambda item: item[1])
+        keys = [key for key, row in live]
+        vectors = np.asarray(self._vectors[[row for key, row in live]]) if live else np.empty((0, self.dim or 0))
+        data = "".join(f"{key}\n" for key in keys).encode("ascii")
+        logging.info(f"Cache embedding compattata: {len(self._keys)} -> {len(keys)} vettori")
+        # meta.json azzerato per primo: un'interruzione lascia una cache vuota, mai incoerente.
+        # I file sono sostituiti (non riscritti sul posto): le mappe delle altre istanze restano valide
+        generation = uuid.uuid4().hex
+        self._write_meta(0, 0, generation)
+        self._vectors = None
+        _atomic_write(self.vectors_path, lambda f: f.write(np.ascontiguousarray(vectors, dtype="float32").tobytes()))
+        _atomic_write(self.keys_path, lambda f: f.write(data))
+        self._write_meta(len(keys), len(data), generation)
+        self._keys = keys
+        self._keys_bytes = len(data)
+        self._rows = {key: row for row, key in enumerate(keys)}
+        self._map()
+
+    def index_path(self, name="index"):
+        return os.path.join(self.dir, f"{name}.faiss")
+
+    def load_index(self, fingerprint, name="index"):
+        """Ricarica l'indice FAISS salvato se corrisponde all'impronta del corpus"""
+        path = self.index_path(name)
+        meta_path = f"{path}.json"
+        with self._locked():
+            if not (os.path.exists(path) and os.path.exists(meta_path)):
+                return None
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("fingerprint") != fingerprint:
+                logging.info("Indice FAISS salvato non aggiornato, verrà ricostruito")
+                return None
+            index = faiss.read_index(path)
+        logging.info(f"Indice FAISS ricaricato da {path}")
+        return index
+
+    def save_index(self, index, fingerprint, name="index"):
+        # Indice e impronta scritti sotto lo stesso lock: un'altra istanza non può accoppiarli male
+        path = self.index_path(name)
+        tmp_path = f"{path}.tmp"
+        with self._locked():
+            faiss.write_index(index, tmp_path)
+            os.replace(tmp_path, path)
+            _atomic_write(f"{path}.json", lambda f: json.dump({"fingerprint": fingerprint}, f), mode="w")
+
+
+def corpus_fingerprint(keys, extra=""):
+    """Impronta dell'intero corpus (chiavi in ordine) per validare l'indice salvato"""
+    h = hashlib.sha256(extra.encode("utf-8"))
+    for key in keys:
+        h.update(key.encode("ascii"))
+    return h.hexdigest()
@@ -0,0 +1,90 @@
+from collections import deque
+from .lexical import TOKEN_PATTERN, stem
+from .registry import registry
+
+# Glossario dei termini giuridici ricorrenti (e spesso polisemici tra aree del diritto)
+GLOSSARY = (
+    "azione", "annullabilità", "appello", "capacità", "capacità giuridica", "capacità di agire", "caso fortuito",
+    "circolare", "colpa", "competenza", "condanna", "contratto", "custodia", "danno", "danno ingiusto",
+    "decadenza", "dolo", "emergenza", "evacuazione", "fatto illecito", "forza maggiore", "giurisdizione",
+    "imputabilità", "inadempimento", "incendio", "interessi", "legittima difesa", "locazione", "nullità",
+    "obbligazione", "pena", "possesso", "prescrizione", "procedura", "proprietà", "reato", "responsabilità",
+    "responsabilità civile", "ricorso", "risarcimento", "sanzione", "sentenza", "sequestro", "stato di necessità",
+    "successione", "termine",
+)
+
+
+def normalize(text):
+    """Token minuscoli con lo stesso stemming dell'indice lessicale (singolare e plurale coincidono)"""
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+class AhoCorasick:
+    """Automa di Aho-Corasick su sequenze di simboli.
+
+    Trova in un solo passaggio tutte le occorrenze di tutti i pattern: il costo è
+    lineare nella lunghezza dell'input, indipendente dal numero di pattern.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for sequence, value in patterns:
+            self._add(sequence, value)
+        self._link()
+
+    def _add(self, sequence, value):
+        state = 0
+        for symbol in sequence:
+            next_state = self.goto[state].get(symbol)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][symbol] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append(value)
+
+    def _link(self):
+        # Link di fallimento in ampiezza: ogni stato eredita le uscite del suo suffisso più lungo
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and symbol not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(symbol, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter_matches(self, symbols):
+        """Valori dei pattern trovati, nell'ordine in cui terminano"""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for symbol in symbols:
+            while state and symbol not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(symbol, 0)
+            if output[state]:
+                yield from output[state]
+
+
+class LegalTermMatcher:
+    """Estrae i termini del glossario da un testo (per token, con stemming)"""
+
+    def __init__(self, glossary=GLOSSARY):
+        self.automaton = AhoCorasick((normalize(term), term) for term in glossary)
+
+    def extract(self, text):
+        """Termini trovati, senza ripetizioni, in ordine di apparizione"""
+        return list(dict.fromkeys(self.automaton.iter_matches(normalize(text))))
+
+    def term_set(self, text):
+        return frozenset(self.automaton.iter_matches(normalize(text)))
+
+
+def get_term_matcher():
+    return registry.get("legal_terms", LegalTermMatcher)
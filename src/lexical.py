@@ -0,0 +1,108 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+# Parole funzionali italiane escluse dall'indice
+STOPWORDS = frozenset("""
+a ad al alla alle allo agli ai all anche che chi con cui da dal dalla dalle dallo dagli dai
+degli dei del della delle dello di e ed gli i il in la le lo ma ne negli nei nel nella nelle
+nello non o per quale quali quando questo questa questi queste se si sia sono su sul sulla
+sulle sullo sugli sui tra fra un una uno come cosa dove è essere ha hanno ho
+""".split())
+
+# Suffissi derivazionali rimossi dallo stemmer leggero (dal più lungo al più corto)
+SUFFIXES = tuple(sorted((
+    "amento", "amenti", "imento", "imenti", "azione", "azioni", "mente",
+    "abile", "abili", "ibile", "ibili", "ità", "ista", "iste", "isti", "ismo", "ismi",
+), key=len, reverse=True))
+
+VOWELS = "aeiouàèéìòù"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def stem(word):
+    """Stemmer leggero per l'italiano: suffissi derivazionali e vocale finale (genere/numero)"""
+    if word.isdigit() or len(word) <= 3:
+        return word
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    if len(word) > 3 and word[-1] in VOWELS:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Token normalizzati: minuscolo, senza stopword, con stemming (numeri di articolo invariati)"""
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Indice invertito BM25 aggiornabile documento per documento"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}   # termine -> {etichetta: frequenza}
+        self.doc_terms = {}  # etichetta -> termini distinti (per la rimozione)
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def add(self, label, text):
+        if label in self.doc_terms:
+            self.remove(label)
+        tokens = tokenize(text)
+        terms = Counter(tokens)
+        self.doc_terms[label] = tuple(terms)
+        self.doc_lengths[label] = len(tokens)
+        self.total_length += len(tokens)
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[label] = tf
+
+    def remove(self, label):
+        terms = self.doc_terms.pop(label, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_lengths.pop(label)
+        for term in terms:
+            docs = self.postings[term]
+            del docs[label]
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query, k=10, allowed=None):
+        """Le ``k`` etichette con punteggio BM25 più alto, come lista di (etichetta, punteggio).
+
+        ``allowed`` (array booleano per etichetta) limita la classifica ai documenti ammessi dai filtri.
+        """
+        n_docs = len(self.doc_terms)
+        if not n_docs:
+            return []
+        avg_length = self.total_length / n_docs
+        scores = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for label, tf in docs.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[label] / avg_length)
+                scores[label] = scores.get(label, 0.0) + idf * tf * (self.k1 + 1) / norm
+        if allowed is not None:
+            scores = {label: score for label, score in scores.items() if label < len(allowed) and allowed[label]}
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fonde più classifiche di etichette: punteggio = somma di 1 / (k + posizione)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, label in enumerate(ranking, start=1):
+            scores[label] = scores.get(label, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda label: scores[label], reverse=True)
@@ -1,24 +1,24 @@
-from transformers import pipeline
-import torch
+import copy
+import logging
+import re
+import threading
+import time
+from . import config
+from .registry import registry
+from .metrics import get_metrics
 
-class LLM:
-    def __init__(self):
-        # Usa un modello più potente e adatto all'italiano
-        self.model = pipeline(
-            "text-generation",
-            model="mistralai/Mixtral-8x7B-Instruct-v0.1",
-            device="cuda" if torch.cuda.is_available() else "cpu"
-        )
+MODEL_NAME = "mistralai/Mixtral-8x7B-Instruct-v0.1"
+CPU_MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.2"
 
-    def generate_response(self, query, docs_text):
-        prompt = f"""Analizza la seguente query legale e tutte le informazioni disponibili dal database:
-
-Query: {query}
+# Intestazioni del prompt: lo stub le usa per ritrovare il contesto recuperato
+CONTEXT_HEADER = "Informazioni disponibili:"
+INSTRUCTIONS_HEADER = "Istruzioni per la risposta:"
+ANSWER_HEADER = "Rispondi in modo chiaro, completo e ben strutturato in italiano:"
 
-Informazioni disponibili:
-{docs_text}
+# Parte costante del prompt, in testa: la sua KV cache si calcola una volta e si riusa
+PROMPT_PREFIX = f"""Analizza la query legale che segue e tutte le informazioni disponibili dal database.
 
-Istruzioni per la risposta:
+{INSTRUCTIONS_HEADER}
 1. Analizza tutte le fonti fornite (leggi, sentenze, procedure)
 2. Integra le informazioni in modo coerente
 3. Se ci sono interpretazioni giurisprudenziali, considerale nell'analisi
@@ -27,14 +27,262 @@ Istruzioni per la risposta:
 6. Cita le fonti specifiche quando appropriato
 7. Usa SOLO le informazioni fornite, senza aggiungere interpretazioni non supportate
 
-Rispondi in modo chiaro, completo e ben strutturato in italiano:"""
+"""
+
+GENERATION_KWARGS = {
+    "temperature": 0.7,
+    "do_sample": True,
+    "top_p": 0.95,
+}
+
+
+def generation_kwargs():
+    """Parametri di generazione; ``max_new_tokens`` riserva spazio alla risposta indipendentemente dal prompt"""
+    return {**GENERATION_KWARGS, "max_new_tokens": config.get("llm_max_new_tokens")}
+
+
+class LLMBackend:
+    """Interfaccia comune dei backend di generazione"""
+
+    name = None
+
+    def count_tokens(self, text):
+        raise NotImplementedError
+
+    def generate_batch(self, prompts):
+        """Una risposta per ogni prompt, nello stesso ordine"""
+        raise NotImplementedError
+
+    def generate_stream(self, prompt):
+        """Generatore di frammenti di testo della risposta"""
+        raise NotImplementedError
+
+
+class HFPipelineBackend(LLMBackend):
+    """Pipeline transformers a precisione piena (GPU se disponibile)"""
+
+    name = "hf"
+
+    def __init__(self, model_name=MODEL_NAME):
+        from transformers import pipeline
+        import torch
+
+        self.model_name = model_name
+        self.model = pipeline(
+            "text-generation",
+            model=model_name,
+            device="cuda" if torch.cuda.is_available() else "cpu"
+        )
+        self._setup()
+
+    def _setup(self):
+        # La pipeline non è rientrante: una generazione alla volta per backend
+        self._lock = threading.Lock()
+        tokenizer = self.model.tokenizer
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        # Padding a sinistra per generare in batch con un modello decoder-only
+        tokenizer.padding_side = "left"
+        self._prefix = None
+        self.prefix_hits = 0
+
+    def count_tokens(self, text):
+        return len(self.model.tokenizer.encode(text, add_special_tokens=False))
+
+    def _prefix_state(self):
+        """Token e KV cache di ``PROMPT_PREFIX``, calcolati al primo uso (da chiamare con il lock)"""
+        if self._prefix is None:
+            import torch
+
+            ids = self.model.tokenizer(PROMPT_PREFIX, return_tensors="pt").input_ids.to(self.model.model.device)
+            with torch.no_grad():
+                past = self.model.model(input_ids=ids, use_cache=True).past_key_values
+            self._prefix = (ids[0].tolist(), past)
+            logging.info(f"KV cache del prefisso del prompt calcolata: {ids.shape[1]} token")
+        return self._prefix
+
+    def _single_inputs(self, prompt):
+        """Input di generazione per un solo prompt, con la KV cache del prefisso se applicabile"""
+        inputs = dict(self.model.tokenizer(prompt, return_tensors="pt").to(self.model.model.device))
+        if not config.get("llm_prefix_cache"):
+            return inputs
+        prefix_ids, past = self._prefix_state()
+        ids = inputs["input_ids"][0]
+        # Il riuso è corretto solo se la tokenizzazione del prompt inizia esattamente con quella del prefisso
+        if len(ids) > len(prefix_ids) and ids[:len(prefix_ids)].tolist() == prefix_ids:
+            # Le cache a oggetti (DynamicCache) vengono estese in place durante la generazione
+            inputs["past_key_values"] = copy.deepcopy(past) if hasattr(past, "get_seq_length") else past
+            self.prefix_hits += 1
+        return inputs
+
+    def generate_batch(self, prompts):
+        with self._lock:
+            if len(prompts) == 1:
+                # Un solo prompt: generazione diretta, riusando il prefisso già calcolato
+                inputs = self._single_inputs(prompts[0])
+                output = self.model.model.generate(**inputs, **generation_kwargs())
+                text = self.model.tokenizer.decode(
+                    output[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True
+                )
+                return [text.strip()]
+            # Con il padding a sinistra le posizioni del prefisso variano tra i prompt: nessun riuso
+            responses = self.model(
+                list(prompts),
+                batch_size=len(prompts),
+                num_return_sequences=1,
+                return_full_text=False,
+                **generation_kwargs()
+            )
+        return [response[0]["generated_text"].strip() for response in responses]
+
+    def generate_stream(self, prompt):
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+        import torch
+
+        tokenizer = self.model.tokenizer
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop = threading.Event()
+        errors = []
+
+        class StopOnClose(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full((input_ids.shape[0],), stop.is_set(), dtype=torch.bool, device=input_ids.device)
+
+        def run():
+            try:
+                with self._lock:
+                    inputs = self._single_inputs(prompt)
+                    self.model.model.generate(
+                        **inputs, streamer=streamer, stopping_criteria=StoppingCriteriaList([StopOnClose()]),
+                        **generation_kwargs()
+                    )
+            except Exception as e:
+                errors.append(e)
+                # Sblocca il consumatore in attesa sullo streamer
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+        finally:
+            # Se il consumatore chiude lo stream la generazione si ferma al token successivo e libera il lock
+            stop.set()
+            thread.join()
+        if errors:
+            raise errors[0]
+
+
+class QuantizedCPUBackend(HFPipelineBackend):
+    """Modello più piccolo su CPU con quantizzazione dinamica int8 dei layer lineari"""
+
+    name = "cpu"
+
+    def __init__(self, model_name=CPU_MODEL_NAME):
+        from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+        import torch
+
+        self.model_name = model_name
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+        model.eval()
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = pipeline("text-generation", model=model, tokenizer=tokenizer, device="cpu")
+        self._setup()
+
+
+class StubBackend(LLMBackend):
+    """Backend deterministico in-process: restituisce il contesto recuperato, senza modello né rete"""
+
+    name = "stub"
+
+    def __init__(self, model_name="echo"):
+        self.model_name = model_name
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def _answer(self, prompt):
+        match = re.search(
+            rf"{re.escape(CONTEXT_HEADER)}\n(.*?)\n\n{re.escape(ANSWER_HEADER)}", prompt, re.DOTALL
+        )
+        context = match.group(1).strip() if match else ""
+        if not context:
+            return "Nessuna informazione disponibile nel database per questa domanda."
+        return f"In base alle fonti disponibili:\n{context}"
+
+    def generate_batch(self, prompts):
+        return [self._answer(prompt) for prompt in prompts]
+
+    def generate_stream(self, prompt):
+        for chunk in re.findall(r"\S+\s*", self._answer(prompt)):
+            yield chunk
+
+
+BACKENDS = {backend.name: backend for backend in (HFPipelineBackend, QuantizedCPUBackend, StubBackend)}
+
+
+def get_backend(name=None, model_name=None):
+    """Backend condiviso dal processo, scelto da argomenti o configurazione (LEGALAI_LLM_BACKEND/_MODEL)"""
+    name = name or config.get("llm_backend")
+    if name not in BACKENDS:
+        raise ValueError(f"Backend LLM non valido: {name} (ammessi: {', '.join(BACKENDS)})")
+    model_name = model_name or config.get("llm_model") or None
+    backend_cls = BACKENDS[name]
+    factory = (lambda: backend_cls(model_name)) if model_name else backend_cls
+    return registry.get(f"llm:{name}:{model_name or 'default'}", factory)
+
+
+class LLM:
+    def __init__(self, backend=None, model_name=None):
+        # Il backend (e il suo modello) è condiviso da tutte le sessioni
+        self.backend = get_backend(backend, model_name)
+        self.model_name = f"{self.backend.name}:{self.backend.model_name}"
+
+    def count_tokens(self, text):
+        return self.backend.count_tokens(text)
+
+    def build_prompt(self, query, docs_text):
+        # Istruzioni costanti in testa (prefisso riusabile), poi la parte che cambia a ogni richiesta
+        return f"""{PROMPT_PREFIX}Query: {query}
+
+{CONTEXT_HEADER}
+{docs_text}
+
+{ANSWER_HEADER}"""
+
+    def generate_response(self, query, docs_text):
+        return self.backend.generate_batch([self.build_prompt(query, docs_text)])[0]
+
+    def generate_batch(self, prompts):
+        """Genera le risposte per più prompt in un unico batch"""
+        return self.backend.generate_batch(prompts)
+
+    def generate_stream(self, query, docs_text):
+        """Generatore di frammenti di testo, prodotti man mano che il modello genera i token"""
+        return self.stream_prompt(self.build_prompt(query, docs_text))
+
+    def stream_prompt(self, prompt):
+        """Streaming di un prompt già costruito, con le metriche di latenza del primo token e di throughput"""
+        start = time.perf_counter()
+        first_token_at = None
+        text = []
+        for chunk in self.backend.generate_stream(prompt):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            text.append(chunk)
+            yield chunk
 
-        response = self.model(
-            prompt,
-            max_length=2000,
-            temperature=0.7,
-            do_sample=True,
-            top_p=0.95,
-            num_return_sequences=1
+        elapsed = time.perf_counter() - start
+        n_tokens = self.count_tokens("".join(text))
+        ttft = (first_token_at - start) if first_token_at is not None else elapsed
+        generation_time = elapsed - ttft
+        tokens_per_second = n_tokens / generation_time if generation_time > 0 else 0.0
+        metrics = get_metrics()
+        metrics.observe("time_to_first_token_seconds", ttft)
+        metrics.observe("generation_tokens_per_second", tokens_per_second, buckets=(1, 5, 10, 20, 50, 100, 200, 500))
+        logging.info(
+            f"Streaming completato: primo token in {ttft:.2f}s, {n_tokens} token, {tokens_per_second:.1f} token/s"
         )
-        return response[0]["generated_text"].split("Rispondi")[1].strip()
\ No newline at end of file
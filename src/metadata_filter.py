@@ -0,0 +1,150 @@
+import numpy as np
+
+# Campi filtrabili per valore (confronto senza distinzione di maiuscole)
+FILTER_FIELDS = ("type", "codice", "evento", "context")
+# Campo filtrabile per intervallo di date ISO (inizio, fine), estremi inclusi e opzionali
+DATE_FIELD = "data_vigore"
+# Filtri rimossi uno alla volta, dal meno importante, quando i documenti ammessi sono troppo pochi
+RELAX_ORDER = ("data_vigore", "context", "evento", "codice", "type")
+
+
+def _normalize(value):
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+def doc_metadata(doc):
+    """Valori indicizzati di un documento; ``context`` è il contesto principale (prima della virgola)"""
+    structure = doc["structure"]
+    return {
+        "type": doc["type"],
+        "codice": structure.get("codice"),
+        "evento": structure.get("evento"),
+        "context": doc["context"].split(",")[0],
+    }
+
+
+def _parse_date(value):
+    try:
+        return np.datetime64(value, "D")
+    except (TypeError, ValueError):
+        return np.datetime64("NaT")
+
+
+def filters_from_entities(entities):
+    """Filtri ricavati dalle entità del QueryParser (``tipo``, ``codice``, ``evento``).
+
+    Tutti i codici citati (``codici``, es. in un confronto tra codice penale e civile)
+    diventano un unico filtro in OR.
+    """
+    filters = {}
+    for entity, field in (("tipo", "type"), ("codice", "codice"), ("evento", "evento")):
+        if entities.get(entity):
+            filters[field] = entities[entity]
+    codes = entities.get("codici") or []
+    if len(codes) > 1:
+        filters["codice"] = list(codes)
+    return filters
+
+
+class MetadataIndex:
+    """Bitmap per valore dei metadati, indicizzate per etichetta FAISS.
+
+    Ogni valore di ``type``, ``codice``, ``evento`` e contesto principale ha un array
+    booleano sulle etichette; i filtri sono intersezioni (AND tra campi, OR tra più
+    valori dello stesso campo) e ``data_vigore`` è un confronto vettoriale sulle date.
+    Un campo esclude solo i documenti che lo hanno con un altro valore: ``codice`` esiste
+    solo per le leggi, quindi un filtro sul codice civile tiene sentenze, procedure e
+    circolari (es. la sentenza che interpreta l'art. 2051) e scarta gli altri codici.
+    """
+
+    def __init__(self):
+        self.capacity = 0
+        self.alive = np.zeros(0, dtype=bool)
+        self.dates = np.zeros(0, dtype="datetime64[D]")
+        self.bitmaps = {field: {} for field in FILTER_FIELDS}
+        # Etichette che hanno un valore per il campo
+        self.present = {field: np.zeros(0, dtype=bool) for field in FILTER_FIELDS}
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def _grow(self, label):
+        if label < self.capacity:
+            return
+        capacity = max(label + 1, 2 * self.capacity, 1024)
+        extra = capacity - self.capacity
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        self.dates = np.concatenate([self.dates, np.full(extra, np.datetime64("NaT"), dtype="datetime64[D]")])
+        for values in self.bitmaps.values():
+            for value, bitmap in values.items():
+                values[value] = np.concatenate([bitmap, np.zeros(extra, dtype=bool)])
+        for field, bitmap in self.present.items():
+            self.present[field] = np.concatenate([bitmap, np.zeros(extra, dtype=bool)])
+        self.capacity = capacity
+
+    def add(self, label, doc):
+        self._grow(label)
+        self.remove(label)
+        for field, value in doc_metadata(doc).items():
+            value = _normalize(value)
+            if value is None:
+                continue
+            bitmap = self.bitmaps[field].get(value)
+            if bitmap is None:
+                bitmap = self.bitmaps[field][value] = np.zeros(self.capacity, dtype=bool)
+            bitmap[label] = True
+            self.present[field][label] = True
+        self.dates[label] = _parse_date(doc["structure"].get(DATE_FIELD))
+        self.alive[label] = True
+
+    def remove(self, label):
+        if label >= self.capacity or not self.alive[label]:
+            return
+        for values in self.bitmaps.values():
+            for bitmap in values.values():
+                bitmap[label] = False
+        for bitmap in self.present.values():
+            bitmap[label] = False
+        self.dates[label] = np.datetime64("NaT")
+        self.alive[label] = False
+
+    def mask(self, filters):
+        """Array booleano delle etichette che soddisfano tutti i filtri"""
+        unknown = set(filters) - set(FILTER_FIELDS) - {DATE_FIELD}
+        if unknown:
+            raise ValueError(f"Filtri non validi: {sorted(unknown)} (ammessi: {', '.join(RELAX_ORDER)})")
+        mask = self.alive.copy()
+        for field, value in filters.items():
+            if field == DATE_FIELD:
+                start, end = value
+                if start is not None:
+                    mask &= self.dates >= np.datetime64(start, "D")
+                if end is not None:
+                    mask &= self.dates <= np.datetime64(end, "D")
+                continue
+            values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+            # Documenti senza il campo (es. sentenze per ``codice``) non sono esclusi
+            allowed = ~self.present[field]
+            for item in values:
+                bitmap = self.bitmaps[field].get(_normalize(item))
+                if bitmap is not None:
+                    allowed |= bitmap
+            mask &= allowed
+        return mask
+
+    def plan(self, filters, min_matches):
+        """Filtri effettivamente applicabili: se ammettono meno di ``min_matches`` documenti si allentano.
+
+        Restituisce ``(filtri applicati, maschera o None, documenti ammessi, campi rimossi)``.
+        """
+        active = dict(filters)
+        relaxed = []
+        while active:
+            mask = self.mask(active)
+            matches = int(mask.sum())
+            if matches >= min_matches:
+                return active, mask, matches, relaxed
+            field = next(field for field in RELAX_ORDER if field in active)
+            relaxed.append(field)
+            del active[field]
+        return {}, None, len(self), relaxed
@@ -0,0 +1,274 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from . import config
+from .registry import registry
+
+PREFIX = "legalai_"
+
+# Limiti superiori dei bucket degli istogrammi
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+RATIO_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1)
+
+# Trace della richiesta in corso: gli span annidati (es. nel Retriever) vi si registrano
+_current_trace = contextvars.ContextVar("legalai_trace", default=None)
+
+
+class _NoopSpan:
+    """Span e trace vuoti usati quando le metriche sono disabilitate"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def span(self, name):
+        return self
+
+    def activate(self):
+        return self
+
+    def set(self, **attributes):
+        pass
+
+    def finish(self, status="ok"):
+        pass
+
+
+NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "trace", "start")
+
+    def __init__(self, metrics, name, trace=None):
+        self.metrics = metrics
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.metrics.observe("stage_seconds", elapsed, stage=self.name)
+        trace = self.trace or _current_trace.get()
+        if trace is not None:
+            trace.record(self.name, elapsed)
+        return False
+
+
+class Trace:
+    """Tempi per fase di una singola richiesta, esportati a ``finish``"""
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = {}
+        self.attributes = {}
+
+    def span(self, name):
+        return _Span(self.metrics, name, self)
+
+    def record(self, name, elapsed):
+        self.spans[name] = self.spans.get(name, 0.0) + elapsed
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def activate(self):
+        """Rende la trace corrente nel blocco ``with``, per gli span creati con ``Metrics.span``"""
+        return _Activation(self)
+
+    def finish(self, status="ok"):
+        elapsed = time.perf_counter() - self.start
+        outcome = self.attributes.get("outcome", "none")
+        self.metrics.observe("request_seconds", elapsed, kind=self.name)
+        self.metrics.inc("requests_total", kind=self.name, outcome=outcome, status=status)
+        self.metrics.exporter.export_trace({
+            "trace": self.name,
+            "status": status,
+            "seconds": round(elapsed, 6),
+            "spans": {name: round(value, 6) for name, value in self.spans.items()},
+            **self.attributes,
+        })
+
+
+class _Activation:
+    __slots__ = ("trace", "token")
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self.token)
+        return False
+
+
+class Metrics:
+    """Contatori e istogrammi di processo con etichette, più span temporali per fase.
+
+    Se ``enabled`` è False ``span`` e ``trace`` restituiscono un oggetto vuoto condiviso
+    e ``inc``/``observe`` escono subito: il costo è una chiamata di funzione.
+    """
+
+    def __init__(self, enabled=True, exporter=None):
+        self.enabled = enabled
+        self.exporter = exporter or InMemoryExporter()
+        self._lock = threading.Lock()
+        self._counters = {}    # (nome, etichette) -> valore
+        self._histograms = {}  # (nome, etichette) -> {"buckets", "counts", "sum", "count"}
+
+    def span(self, name):
+        if not self.enabled:
+            return NOOP
+        return _Span(self, name)
+
+    def trace(self, name):
+        if not self.enabled:
+            return NOOP
+        return Trace(self, name)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    "buckets": buckets, "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0
+                }
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    break
+            else:
+                i = len(histogram["buckets"])
+            histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self):
+        """Copia dei valori correnti: contatori e istogrammi come liste di dict"""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self._counters.items()
+            ]
+            histograms = [
+                {"name": name, "labels": dict(labels), "buckets": list(h["buckets"]), "counts": list(h["counts"]),
+                 "sum": h["sum"], "count": h["count"]}
+                for (name, labels), h in self._histograms.items()
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+    def render(self):
+        """Metriche nel formato dell'exporter configurato"""
+        return self.exporter.render(self.snapshot())
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+class Exporter:
+    """Interfaccia degli exporter: ``export_trace`` a fine richiesta, ``render`` su richiesta"""
+
+    def export_trace(self, trace):
+        pass
+
+    def render(self, snapshot):
+        raise NotImplementedError
+
+
+class InMemoryExporter(Exporter):
+    """Conserva le ultime trace; ``render`` restituisce lo snapshot come dict"""
+
+    def __init__(self, max_traces=100):
+        self.traces = deque(maxlen=max_traces)
+
+    def export_trace(self, trace):
+        self.traces.append(trace)
+
+    def render(self, snapshot):
+        return {**snapshot, "traces": list(self.traces)}
+
+
+def _labels_text(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+class PrometheusExporter(Exporter):
+    """Formato testuale di esposizione di Prometheus"""
+
+    def render(self, snapshot):
+        lines = []
+        typed = set()
+        # Le serie di una stessa metrica devono essere contigue, sotto un'unica riga TYPE
+        for counter in sorted(snapshot["counters"], key=lambda item: item["name"]):
+            name = PREFIX + counter["name"]
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels_text(counter['labels'])} {counter['value']}")
+        for histogram in sorted(snapshot["histograms"], key=lambda item: item["name"]):
+            name = PREFIX + histogram["name"]
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(list(histogram["buckets"]) + ["+Inf"], histogram["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels_text(histogram['labels'], {'le': bound})} {cumulative}")
+            lines.append(f"{name}_sum{_labels_text(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{_labels_text(histogram['labels'])} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class JSONLogExporter(Exporter):
+    """Una riga JSON nel log per ogni richiesta; ``render`` restituisce lo snapshot in JSON"""
+
+    def export_trace(self, trace):
+        logging.info(json.dumps(trace, ensure_ascii=False, default=str))
+
+    def render(self, snapshot):
+        return json.dumps(snapshot, ensure_ascii=False)
+
+
+EXPORTERS = {
+    "memory": InMemoryExporter,
+    "prometheus": PrometheusExporter,
+    "json": JSONLogExporter,
+}
+
+
+def get_metrics():
+    """Metriche condivise dal processo, configurate con LEGALAI_METRICS_ENABLED e LEGALAI_METRICS_EXPORTER"""
+    return registry.get("metrics", lambda: Metrics(
+        enabled=config.get("metrics_enabled"),
+        exporter=EXPORTERS[config.get("metrics_exporter")]()
+    ))
@@ -1,21 +1,129 @@
-import spacy
+import re
+from .registry import registry
+from .legal_terms import get_term_matcher
+
+SPACY_MODEL = "it_core_news_lg"
+
+# Forme (minuscole) riconosciute dalle regole e valore normalizzato dell'entità
+CODES = {
+    "codice civile": "codice civile",
+    "codice penale": "codice penale",
+    "codice di procedura civile": "codice di procedura civile",
+    "codice di procedura penale": "codice di procedura penale",
+}
+DOCUMENT_TYPES = {
+    "procedura": "procedura", "procedure": "procedura",
+    "sentenza": "sentenza", "sentenze": "sentenza",
+    "circolare": "circolare", "circolari": "circolare",
+}
+EVENTS = {"incendi": "Incendio"}
+ARTICLE_WORDS = ["articolo", "articoli", "art", "art.", "artt", "artt."]
+ARTICLE_INLINE = re.compile(r"^artt?\.?(\d+)", re.IGNORECASE)
+
+
+def get_nlp(model_name=SPACY_MODEL):
+    """Pipeline spaCy completa, condivisa da tutte le sessioni del processo (caricata al primo uso)"""
+    import spacy
+
+    return registry.get(f"spacy:{model_name}", lambda: spacy.load(model_name))
+
+
+def _build_rules():
+    """Tokenizer italiano (nessun modello statistico) con Matcher e PhraseMatcher compilati una volta"""
+    import spacy
+    from spacy.matcher import Matcher, PhraseMatcher
+
+    nlp = spacy.blank("it")
+    matcher = Matcher(nlp.vocab)
+    matcher.add("INTENT_COMPARE", [[{"LOWER": {"REGEX": r"^(confront|differenz)"}}]])
+    matcher.add("ARTICOLO", [
+        [{"LOWER": {"IN": ARTICLE_WORDS}}, {"ORTH": ".", "OP": "?"}, {"LIKE_NUM": True}],
+        [{"LOWER": {"REGEX": ARTICLE_INLINE.pattern}}],
+    ])
+    matcher.add("TIPO", [[{"LOWER": {"IN": list(DOCUMENT_TYPES)}}]])
+    matcher.add("EVENTO", [[{"LOWER": {"REGEX": "|".join(EVENTS)}}]])
+    codes = PhraseMatcher(nlp.vocab, attr="LOWER")
+    codes.add("CODICE", [nlp.make_doc(phrase) for phrase in CODES])
+    return nlp, matcher, codes
+
+
+def get_rules():
+    return registry.get("spacy:rules-it", _build_rules)
 
-nlp = spacy.load("it_core_news_lg")
 
 class QueryParser:
-    def __init__(self):
-        self.nlp = nlp
+    """Estrae intento ed entità dalla query.
+
+    ``mode="rules"`` (predefinito) usa solo il tokenizer e regole compilate; ``mode="full"``
+    mantiene il comportamento originale sulla pipeline completa di ``it_core_news_lg``.
+    Le risorse spaCy vengono caricate al primo utilizzo, non all'import.
+    """
+
+    def __init__(self, mode="rules"):
+        if mode not in ("rules", "full"):
+            raise ValueError(f"Modalità parser non valida: {mode}")
+        self.mode = mode
+
+    @property
+    def nlp(self):
+        return get_rules()[0] if self.mode == "rules" else get_nlp()
 
     def parse(self, query):
-        doc = self.nlp(query)
+        if self.mode == "full":
+            return self._parse_full(self.nlp(query))
+        return self._parse_rules(self.nlp(query))
+
+    def extract_legal_terms(self, query):
+        """Termini del glossario giuridico presenti nella query (automa Aho-Corasick, nessun modello spaCy)"""
+        return get_term_matcher().extract(query)
+
+    def parse_batch(self, queries, batch_size=256):
+        """Parse di più query con ``nlp.pipe``; risultati nello stesso ordine"""
+        handler = self._parse_full if self.mode == "full" else self._parse_rules
+        return [handler(doc) for doc in self.nlp.pipe(queries, batch_size=batch_size)]
+
+    def _parse_rules(self, doc):
+        _, matcher, codes = get_rules()
+        intent = "info"
+        entities = {"codice": None, "codici": [], "articolo": None, "tipo": None, "evento": None}
+        vocab = doc.vocab
+
+        # Tutti i codici citati, nell'ordine della query ("codice" resta il primo)
+        code_tokens = set()
+        for match_id, start, end in codes(doc):
+            code = CODES[doc[start:end].text.lower()]
+            if code not in entities["codici"]:
+                entities["codici"].append(code)
+            code_tokens.update(range(start, end))
+        if entities["codici"]:
+            entities["codice"] = entities["codici"][0]
+
+        for match_id, start, end in matcher(doc):
+            label = vocab.strings[match_id]
+            span = doc[start:end]
+            if label == "INTENT_COMPARE":
+                intent = "compare"
+            elif label == "ARTICOLO":
+                inline = ARTICLE_INLINE.match(span[-1].text)
+                entities["articolo"] = inline.group(1) if inline else span[-1].text
+            elif label == "TIPO" and start not in code_tokens:
+                # "procedura" dentro "codice di procedura civile" non indica il tipo di documento
+                entities["tipo"] = DOCUMENT_TYPES[span.text.lower()]
+            elif label == "EVENTO":
+                entities["evento"] = next(value for key, value in EVENTS.items() if key in span.text.lower())
+
+        return {"intent": intent, "entities": entities}
+
+    def _parse_full(self, doc):
         intent = "info"
-        entities = {"codice": None, "articolo": None, "tipo": None, "evento": None}
+        entities = {"codice": None, "codici": [], "articolo": None, "tipo": None, "evento": None}
 
         for token in doc:
             if "confronta" in token.text.lower() or "differenze" in token.text.lower():
                 intent = "compare"
             if token.text.lower() in ["codice civile", "codice penale"]:
                 entities["codice"] = token.text.lower()
+                entities["codici"].append(token.text.lower())
             if "articolo" in token.text.lower() and token.head.is_digit:
                 entities["articolo"] = token.head.text
             if token.text.lower() in ["procedura", "sentenza", "circolare"]:
@@ -23,4 +131,4 @@ class QueryParser:
             if "incendio" in token.text.lower():
                 entities["evento"] = "Incendio"
 
-        return {"intent": intent, "entities": entities}
\ No newline at end of file
+        return {"intent": intent, "entities": entities}
@@ -1,7 +1,18 @@
 from .llm import LLM
-from .retrieval import Retriever
+from .retrieval import get_retriever
 from .query_parser import QueryParser
+from .metadata_filter import filters_from_entities
+from .scheduler import QueueFullError, get_scheduler
+from .context_builder import get_context_builder
+from .answer_cache import SemanticAnswerCache, docs_fingerprint
+from .registry import registry
+from .metrics import COUNT_BUCKETS, NOOP, TOKEN_BUCKETS, get_metrics
+from . import config
+from collections import deque
+from contextlib import closing
+import itertools
 import logging
+import numpy as np
 
 # Logging visibile nella console
 logging.basicConfig(
@@ -10,16 +21,33 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
+def get_answer_cache():
+    """Cache semantica delle risposte condivisa da tutte le sessioni"""
+    return registry.get("answer_cache", lambda: SemanticAnswerCache(
+        threshold=config.get("answer_cache_threshold"),
+        max_entries=config.get("answer_cache_max_entries"),
+        max_bytes=config.get("answer_cache_max_mb") * 2**20,
+        ttl=config.get("answer_cache_ttl"),
+        path=config.get("answer_cache_path") or None
+    ))
+
 class QueryProcessor:
-    def __init__(self):
+    def __init__(self, db_path="data/database.json", retriever=None):
+        # Le risorse pesanti sono condivise via registry: per sessione resta solo questo oggetto.
+        # ``retriever`` permette di usare un'istanza con cache o indice non predefiniti
         logging.info("Inizializzazione QueryProcessor")
         try:
             self.llm = LLM()
+            # Tutte le sessioni accodano le generazioni sullo stesso scheduler
+            self.scheduler = get_scheduler(self.llm)
+            self.context_builder = get_context_builder(self.llm)
             logging.info("LLM inizializzato")
-            self.retriever = Retriever()
+            self.retriever = retriever or get_retriever(db_path)
             logging.info("Retriever inizializzato")
             self.parser = QueryParser()
             logging.info("QueryParser inizializzato")
+            self.answer_cache = get_answer_cache() if config.get("answer_cache_enabled") else None
+            self.metrics = get_metrics()
         except Exception as e:
             logging.error(f"Errore durante inizializzazione QueryProcessor: {str(e)}")
             raise
@@ -33,12 +61,12 @@ class QueryProcessor:
             "conflicts": []
         }
 
+        # Contesto principale e termini di ogni documento sono precalcolati dal Retriever
+        features = [self.retriever.doc_features(doc) for doc in docs]
+
         # Caso 1: Ambiguità per mancanza di contesto specifico
         if len(docs) > 3:  # Troppi risultati rilevanti
-            common_contexts = set()
-            for doc in docs:
-                context = doc["context"].split(",")[0].strip()  # Prendi il contesto principale
-                common_contexts.add(context)
+            common_contexts = list(dict.fromkeys(primary for primary, _ in features))
             
             if len(common_contexts) > 1:
                 ambiguity_info.update({
@@ -52,13 +80,10 @@ class QueryProcessor:
                 })
 
         # Caso 2: Ambiguità per conflitto temporale
-        temporal_conflicts = []
-        for doc in docs:
-            if "data_vigore" in doc["structure"]:
-                temporal_conflicts.append({
-                    "id": doc["id"],
-                    "data": doc["structure"]["data_vigore"]
-                })
+        temporal_conflicts = [
+            {"id": doc["id"], "data": doc["structure"]["data_vigore"]}
+            for doc in docs if "data_vigore" in doc["structure"]
+        ]
         
         if len(temporal_conflicts) > 1:
             ambiguity_info.update({
@@ -76,11 +101,10 @@ class QueryProcessor:
         term_conflicts = {}
         
         for term in legal_terms:
-            term_docs = [doc for doc in docs if term.lower() in doc["text"].lower()]
-            if len(term_docs) > 1:
-                contexts = set(doc["context"] for doc in term_docs)
-                if len(contexts) > 1:
-                    term_conflicts[term] = list(contexts)
+            # Appartenenza a insiemi precalcolati: costo indipendente dalla lunghezza dei testi
+            contexts = list(dict.fromkeys(doc["context"] for doc, (_, terms) in zip(docs, features) if term in terms))
+            if len(contexts) > 1:
+                term_conflicts[term] = contexts
 
         if term_conflicts:
             ambiguity_info.update({
@@ -121,68 +145,258 @@ class QueryProcessor:
         response_parts.append("\nPuoi riformulare la domanda con più dettagli?")
         return "\n".join(response_parts)
 
-    def process(self, query):
+    def _prepare(self, query, trace=NOOP):
+        """Parse, ricerca e controllo ambiguità.
+
+        Restituisce ``(risposta, None, None)`` se la risposta è già pronta (saluto,
+        ambiguità o cache), altrimenti ``(None, contesto, chiave_cache)``.
+        I tempi di ogni fase vengono registrati in ``trace``.
+        """
         logging.info(f"Query ricevuta: {query}")
         
         # Gestione saluti
+        greeting = self._greeting(query, trace)
+        if greeting is not None:
+            return greeting, None, None
+
+        # Parse della query
+        with trace.span("parse"):
+            parsed = self.parser.parse(query)
+        
+        # Ricerca documenti (l'embedding della query serve anche alla cache delle risposte)
+        with trace.span("query_encoding"):
+            embedding = self.retriever.encode_query(query)
+        # Tipo, codice ed evento citati nella query limitano la ricerca (filtri allentati se troppo selettivi)
+        docs = self.retriever.search(query, intent=parsed["intent"], embedding=embedding,
+                                     filters=filters_from_entities(parsed["entities"]))
+        return self._resolve(query, embedding, docs, trace)
+
+    def _greeting(self, query, trace=NOOP):
         saluti = ["ciao", "hello", "salve", "buongiorno", "buonasera"]
         if query.lower().strip() in saluti:
             logging.info("Rilevato saluto")
+            trace.set(outcome="greeting")
             return "Ciao! Sono LegalAI, il tuo assistente giuridico perfetto. Come posso aiutarti oggi?"
+        return None
 
-        # Parse della query
-        parsed = self.parser.parse(query)
-        
-        # Ricerca documenti
-        docs = self.retriever.search(query, intent=parsed["intent"])
+    def _resolve(self, query, embedding, docs, trace=NOOP):
+        """Ambiguità, cache delle risposte e contesto per i documenti già recuperati (come ``_prepare``)"""
+        self.metrics.observe("retrieved_docs", len(docs), buckets=COUNT_BUCKETS)
         
         # Controllo ambiguità
-        ambiguity_info = self.check_ambiguity(query, docs)
+        with trace.span("ambiguity_check"):
+            ambiguity_info = self.check_ambiguity(query, docs)
         if ambiguity_info["is_ambiguous"]:
-            return self.handle_ambiguity(query, ambiguity_info)
-
-        # Organizza i documenti per tipo
-        organized_docs = {
-            "leggi": [],
-            "sentenze": [],
-            "procedure": [],
-            "altri": []
-        }
-        
-        for doc in docs:
-            if doc["type"] == "legge":
-                organized_docs["leggi"].append(doc)
-            elif doc["type"] == "sentenza":
-                organized_docs["sentenze"].append(doc)
-            elif doc["type"] == "procedura":
-                organized_docs["procedure"].append(doc)
+            trace.set(outcome="ambiguous")
+            self.metrics.inc("ambiguous_total", reason=ambiguity_info["reason"])
+            return self.handle_ambiguity(query, ambiguity_info), None, None
+
+        # Risposta già generata per una query simile con gli stessi documenti e la stessa versione del database
+        cache_key = None
+        if self.answer_cache is not None:
+            revision = self.retriever.revision
+            if self.answer_cache.version != revision:
+                self.answer_cache.invalidate(revision)
+            cache_key = (embedding, docs_fingerprint(docs), revision)
+            with trace.span("answer_cache"):
+                cached = self.answer_cache.lookup(*cache_key)
+            self.metrics.inc("answer_cache_lookups_total", result="miss" if cached is None else "hit")
+            if cached is not None:
+                logging.info("Risposta servita dalla cache semantica")
+                trace.set(outcome="cache")
+                return cached, None, None
+
+        with trace.span("context_build"):
+            full_context = self._build_context(docs)
+        return None, full_context, cache_key
+
+    def _build_context(self, docs):
+        """Contesto strutturato per il prompt (leggi, sentenze, procedure) entro il budget di token"""
+        full_context, stats = self.context_builder.build(docs)
+        self.metrics.observe("context_tokens", stats["tokens"], buckets=TOKEN_BUCKETS)
+        if stats["dropped"]:
+            self.metrics.inc("context_docs_dropped_total", stats["dropped"])
+        return full_context
+
+    def _remember(self, query, cache_key, response):
+        if cache_key is not None:
+            self.answer_cache.store(query, *cache_key, response)
+
+    def _record_tokens(self, prompt, response):
+        # Il conteggio dei token ha un costo: solo con le metriche attive
+        if self.metrics.enabled:
+            self.metrics.observe("prompt_tokens", self.llm.count_tokens(prompt), buckets=TOKEN_BUCKETS)
+            self.metrics.observe("output_tokens", self.llm.count_tokens(response), buckets=TOKEN_BUCKETS)
+
+    def process(self, query):
+        trace = self.metrics.trace("process")
+        try:
+            with trace.activate():
+                response, full_context, cache_key = self._prepare(query, trace)
+            if response is None:
+                # Genera la risposta tramite la coda condivisa (batching tra utenti concorrenti)
+                prompt = self.llm.build_prompt(query, full_context)
+                with trace.span("generation"):
+                    response = self.scheduler.generate(prompt)
+                trace.set(outcome="generated")
+                self._record_tokens(prompt, response)
+                self._remember(query, cache_key, response)
+        except Exception:
+            trace.finish(status="error")
+            raise
+        trace.finish()
+        return response
+
+    def process_stream(self, query):
+        """Come ``process``, ma restituisce un generatore di frammenti della risposta"""
+        trace = self.metrics.trace("process_stream")
+        try:
+            with trace.activate():
+                response, full_context, cache_key = self._prepare(query, trace)
+            if response is not None:
+                yield response
             else:
-                organized_docs["altri"].append(doc)
+                # Anche lo streaming passa dalla coda condivisa: limite, timeout e annullamento alla chiusura
+                prompt = self.llm.build_prompt(query, full_context)
+                chunks = []
+                with trace.span("generation"), closing(self.scheduler.stream(prompt)) as stream:
+                    for chunk in stream:
+                        chunks.append(chunk)
+                        yield chunk
+                response = "".join(chunks)
+                trace.set(outcome="generated")
+                self._record_tokens(prompt, response)
+                self._remember(query, cache_key, response)
+        except GeneratorExit:
+            # Il client ha smesso di leggere lo stream
+            trace.finish(status="cancelled")
+            raise
+        except Exception:
+            trace.finish(status="error")
+            raise
+        trace.finish()
 
-        # Costruisci il contesto strutturato
-        context_parts = []
-        
-        if organized_docs["leggi"]:
-            context_parts.append("Articoli di legge pertinenti:")
-            for doc in organized_docs["leggi"]:
-                context_parts.append(f"- {doc['id']}: {doc['text']}")
-                context_parts.append(f"  Contesto: {doc['context']}")
-        
-        if organized_docs["sentenze"]:
-            context_parts.append("\nInterpretazioni giurisprudenziali:")
-            for doc in organized_docs["sentenze"]:
-                context_parts.append(f"- Sentenza {doc['id']}:")
-                context_parts.append(f"  {doc['text']}")
-        
-        if organized_docs["procedure"]:
-            context_parts.append("\nProcedure correlate:")
-            for doc in organized_docs["procedure"]:
-                context_parts.append(f"- {doc['id']}:")
-                context_parts.append(f"  {doc['text']}")
+    def process_batch(self, queries, batch_size=None, timeout=None):
+        """Elabora un iterabile di query a blocchi di ``batch_size`` (uso offline: valutazioni, pre-riscaldamento cache).
 
-        full_context = "\n".join(context_parts)
-        
-        # Genera la risposta
-        response = self.llm.generate_response(query, full_context)
-        logging.info(f"Risposta generata: {response}")
-        return response
\ No newline at end of file
+        Per blocco: parse con ``parse_batch``, codifica e ricerca FAISS in un'unica chiamata,
+        generazione in batch tramite lo scheduler condiviso. Produce un dict
+        ``{"index", "query", "response", "error"}`` per query, nello stesso ordine; un errore
+        riguarda solo la query che lo ha causato. In memoria c'è un solo blocco alla volta.
+        """
+        batch_size = batch_size or config.get("batch_size")
+        iterator = iter(queries)
+        offset = 0
+        while True:
+            chunk = list(itertools.islice(iterator, batch_size))
+            if not chunk:
+                return
+            yield from self._process_chunk(chunk, offset, timeout)
+            offset += len(chunk)
+
+    @staticmethod
+    def _bulk(results, indices, fn):
+        """Applica ``fn`` alle query ``indices`` in una chiamata; se fallisce, una per volta per isolare gli errori.
+
+        Restituisce gli indici riusciti e i valori corrispondenti.
+        """
+        if not indices:
+            return [], []
+        try:
+            return indices, list(fn(indices))
+        except Exception:
+            pass
+        ok, values = [], []
+        for i in indices:
+            try:
+                values.append(fn([i])[0])
+                ok.append(i)
+            except Exception as e:
+                results[i]["error"] = f"{type(e).__name__}: {e}"
+        return ok, values
+
+    def _process_chunk(self, queries, offset, timeout=None):
+        results = [{"index": offset + i, "query": query, "response": None, "error": None}
+                   for i, query in enumerate(queries)]
+        trace = self.metrics.trace("process_batch")
+        prompts = {}
+        with trace.activate():
+            pending = []
+            for i, query in enumerate(queries):
+                greeting = self._greeting(query)
+                if greeting is not None:
+                    results[i]["response"] = greeting
+                else:
+                    pending.append(i)
+
+            with trace.span("parse"):
+                pending, parsed = self._bulk(
+                    results, pending, lambda idx: self.parser.parse_batch([queries[i] for i in idx]))
+            filters = {i: filters_from_entities(result["entities"]) for i, result in zip(pending, parsed)}
+            with trace.span("query_encoding"):
+                pending, rows = self._bulk(
+                    results, pending, lambda idx: self.retriever.encode_queries([queries[i] for i in idx]))
+            embeddings = dict(zip(pending, rows))
+            pending, found = self._bulk(results, pending, lambda idx: self.retriever.search_batch(
+                [queries[i] for i in idx], np.vstack([embeddings[i] for i in idx]), filters=[filters[i] for i in idx]))
+
+            for i, docs in zip(pending, found):
+                try:
+                    response, full_context, cache_key = self._resolve(queries[i], embeddings[i], docs, trace)
+                except Exception as e:
+                    results[i]["error"] = f"{type(e).__name__}: {e}"
+                    continue
+                if response is not None:
+                    results[i]["response"] = response
+                else:
+                    prompts[i] = (self.llm.build_prompt(queries[i], full_context), cache_key)
+
+        with trace.span("generation"):
+            outcomes = self._generate_all({i: prompt for i, (prompt, _) in prompts.items()}, timeout)
+        for i, (prompt, cache_key) in prompts.items():
+            outcome = outcomes[i]
+            if isinstance(outcome, Exception):
+                results[i]["error"] = f"{type(outcome).__name__}: {outcome}"
+                continue
+            results[i]["response"] = outcome
+            self._record_tokens(prompt, outcome)
+            self._remember(queries[i], cache_key, outcome)
+
+        errors = sum(result["error"] is not None for result in results)
+        trace.set(outcome="batch", items=len(results), errors=errors)
+        trace.finish(status="error" if errors else "ok")
+        return results
+
+    def _generate_all(self, prompts, timeout=None):
+        """Accoda i prompt sullo scheduler condiviso, che li raggruppa in batch.
+
+        Al più metà della coda è occupata dal batch offline, così le sessioni interattive
+        restano servite. Restituisce indice -> testo generato oppure l'eccezione.
+        """
+        max_in_flight = max(1, self.scheduler.max_queue // 2)
+        in_flight = deque()
+        outcomes = {}
+
+        def collect():
+            i, future = in_flight.popleft()
+            try:
+                outcomes[i] = future.result(timeout)
+            except Exception as e:
+                outcomes[i] = e
+
+        for i, prompt in prompts.items():
+            while len(in_flight) >= max_in_flight:
+                collect()
+            while True:
+                try:
+                    in_flight.append((i, self.scheduler.submit(prompt, timeout)))
+                    break
+                except QueueFullError as e:
+                    # Coda piena per il traffico interattivo: si attende una delle proprie richieste
+                    if not in_flight:
+                        outcomes[i] = e
+                        break
+                    collect()
+        while in_flight:
+            collect()
+        return outcomes
\ No newline at end of file
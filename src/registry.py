@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+import time
+
+
+def rss_bytes():
+    """Memoria residente del processo in byte (0 se non misurabile)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        # Senza /proc si usa il picco come approssimazione
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+def peak_rss_bytes():
+    """Picco di memoria residente del processo in byte (0 se non misurabile)"""
+    try:
+        import resource
+    except ImportError:
+        return rss_bytes()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in KB su Linux e in byte su macOS
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class ResourceRegistry:
+    """Registro di processo per le risorse pesanti condivise tra le sessioni.
+
+    Ogni risorsa viene costruita una sola volta, anche con richieste concorrenti:
+    il primo chiamante esegue la factory, gli altri attendono e ricevono la stessa istanza.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resources = {}
+        self._load_locks = {}
+        self._stats = {}
+
+    def get(self, name, factory):
+        try:
+            return self._resources[name]
+        except KeyError:
+            pass
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            if name in self._resources:
+                return self._resources[name]
+            logging.info(f"Caricamento risorsa condivisa: {name}")
+            rss_before = rss_bytes()
+            start = time.perf_counter()
+            resource = factory()
+            elapsed = time.perf_counter() - start
+            rss_delta = max(rss_bytes() - rss_before, 0)
+            with self._lock:
+                self._resources[name] = resource
+                self._stats[name] = {
+                    "load_seconds": round(elapsed, 3),
+                    "rss_delta_mb": round(rss_delta / 2**20, 1),
+                    "loaded_at": time.time(),
+                }
+            logging.info(f"Risorsa {name} caricata in {elapsed:.2f}s (+{rss_delta / 2**20:.1f} MB RSS)")
+            return resource
+
+    def is_loaded(self, name):
+        return name in self._resources
+
+    def stats(self):
+        """Tempi di caricamento e memoria per risorsa"""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def clear(self, name=None):
+        """Rimuove una risorsa (o tutte) dal registro"""
+        with self._lock:
+            names = [name] if name is not None else list(self._resources)
+            for key in names:
+                self._resources.pop(key, None)
+                self._stats.pop(key, None)
+
+
+registry = ResourceRegistry()
@@ -1,68 +1,409 @@
+import json
 import re
 from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
-from .utils import load_database
-from functools import lru_cache
+import logging
+import time
+import threading
+from .document_store import DocumentStore
+from .embedding_cache import EmbeddingCache, content_key, corpus_fingerprint, doc_text
+from . import config
+from .registry import registry
+from .lexical import BM25Index, reciprocal_rank_fusion
+from .legal_terms import get_term_matcher
+from .metadata_filter import MetadataIndex
+from .metrics import RATIO_BUCKETS, get_metrics
+from .vector_index import build_index, build_signature, filtered_search_params, normalize_config, set_search_params
+from collections import OrderedDict
+
+DEFAULT_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+DEFAULT_CACHE_DIR = "data/cache"
+QUERY_CACHE_SIZE = 1000
+# Parole chiave per area (minuscole, confrontate con contesto e testo in minuscolo)
+CONTEXT_KEYWORDS = {
+    "civile": ["cc-", "civile", "contratto", "risarcimento", "danno"],
+    "penale": ["cp-", "penale", "reato", "pena"],
+    "procedura": ["proc-", "procedura", "processo"],
+    "giurisprudenza": ["cass-", "sentenza", "cassazione"]
+}
+
+def lexical_text(doc):
+    """Campi indicizzati da BM25: id (numeri di articolo), testo e contesto"""
+    return f"{doc['id']} {doc['text']} {doc['context']}"
+# Id citati nella query (es. CC-L4-T9-C1-Art.2051); il punto finale di frase non fa parte dell'id
+REFERENCE_PATTERN = re.compile(r"(CC|CP|Proc|Cass)-[A-Za-z0-9.-]*[A-Za-z0-9]")
+
+def get_retriever(db_path="data/database.json", model_name=DEFAULT_MODEL, cache_dir=DEFAULT_CACHE_DIR,
+                  index_config=None):
+    """Retriever condiviso (modello, indice e database) per il database indicato.
+
+    La chiave comprende modello, cartella della cache e configurazione dell'indice in forma
+    canonica: configurazioni diverse non ricevono l'istanza costruita per un'altra.
+    """
+    index_key = json.dumps(normalize_config(index_config), sort_keys=True)
+    return registry.get(
+        f"retriever:{db_path}:{model_name}:{cache_dir}:{index_key}",
+        lambda: Retriever(db_path, model_name=model_name, cache_dir=cache_dir, index_config=index_config)
+    )
 
 class Retriever:
-    def __init__(self, db_path="data/database.json"):
-        self.model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-        self.db = load_database(db_path)
-        self.embeddings = self.model.encode([f"{doc['text']} {doc['context']}" for doc in self.db])
-        self.index = faiss.IndexFlatL2(self.embeddings.shape[1])
-        self.index.add(np.array(self.embeddings))
-
-    @lru_cache(maxsize=1000)
+    def __init__(self, db_path="data/database.json", model_name=DEFAULT_MODEL, cache_dir=DEFAULT_CACHE_DIR,
+                 index_config=None):
+        self.model_name = model_name
+        # Tipo di indice: flat (esatto), ivf_flat, ivf_pq o hnsw; vedi vector_index
+        self.index_config = normalize_config(index_config)
+        self.model = registry.get(f"encoder:{model_name}", lambda: SentenceTransformer(model_name))
+        # Lo store fornisce gli indici per id e per citazioni e gli aggiornamenti incrementali
+        self.store = DocumentStore(db_path)
+        self._lock = threading.RLock()
+        self._query_cache = OrderedDict()
+        self.metrics = get_metrics()
+        # Cartella della cache per modello e database: corpus diversi non si scartano i vettori a vicenda
+        self.cache = EmbeddingCache(cache_dir, model_name, scope=db_path) if cache_dir is not None else None
+
+        # La riga di ogni documento nello store è la sua etichetta intera nell'indice FAISS
+        docs = self.store.docs
+        labels = np.fromiter((doc.row for doc in docs), dtype="int64", count=len(docs))
+
+        # Indice lessicale BM25, bitmap dei metadati per i filtri, contesto principale e
+        # termini giuridici per il controllo di ambiguità
+        self.lexical = BM25Index()
+        self.metadata = MetadataIndex()
+        self.term_matcher = get_term_matcher()
+        self._features = {}
+        for label, doc in zip(labels, docs):
+            self._index_text(int(label), doc)
+
+        if self.cache is None:
+            # Nessuna cache: codifica completa come in passato
+            self.index = self._build_index(self._encode(docs), labels)
+            return
+
+        # Solo i documenti nuovi o modificati vengono ricodificati
+        keys = self.cache.encode_missing([doc_text(doc) for doc in docs], self.model.encode)
+        self.cache.flush(keep=keys)
+
+        fingerprint = corpus_fingerprint(keys, build_signature(self.index_config))
+        self.index = self.cache.load_index(fingerprint, name=self.index_config["kind"])
+        if self.index is not None:
+            set_search_params(self.index, self.index_config)
+        else:
+            self.index = self._build_index(self.cache.get(keys), labels)
+            self.cache.save_index(self.index, fingerprint, name=self.index_config["kind"])
+            logging.info(f"Indice FAISS costruito e salvato: {self.index.ntotal} vettori")
+
+    @property
+    def db(self):
+        return self.store.docs
+
+    @property
+    def version(self):
+        """Versione del database: cambia a ogni upsert/delete"""
+        return self.store.version
+
+    @property
+    def revision(self):
+        """Come ``version``, ma stabile tra riavvii finché il file non cambia"""
+        return self.store.revision
+
+    def encode_query(self, query):
+        """Embedding della query, con una piccola LRU per le query ripetute"""
+        with self._lock:
+            embedding = self._query_cache.get(query)
+            if embedding is not None:
+                self._query_cache.move_to_end(query)
+                return embedding
+        embedding = np.asarray(self.model.encode([query]), dtype="float32")
+        with self._lock:
+            self._query_cache[query] = embedding
+            if len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return embedding
+
+    def encode_queries(self, queries):
+        """Embedding di più query in un'unica chiamata al modello (solo per quelle non in cache)"""
+        with self._lock:
+            cached = [self._query_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, cached) if embedding is None))
+        if missing:
+            encoded = np.asarray(self.model.encode(missing), dtype="float32")
+            new = {query: encoded[i:i + 1] for i, query in enumerate(missing)}
+            with self._lock:
+                for query, embedding in new.items():
+                    self._query_cache[query] = embedding
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+            cached = [embedding if embedding is not None else new[query] for query, embedding in zip(queries, cached)]
+        return np.vstack(cached) if cached else np.zeros((0, 0), dtype="float32")
+
+    def _encode(self, docs):
+        texts = [doc_text(doc) for doc in docs]
+        if self.cache is None:
+            return np.asarray(self.model.encode(texts), dtype="float32")
+        keys = self.cache.encode_missing(texts, self.model.encode)
+        return np.asarray(self.cache.get(keys), dtype="float32")
+
+    def _persist_vectors(self, superseded, current=()):
+        """Vettori nuovi aggiunti in coda alla cache, quelli delle versioni superate segnati per la compattazione.
+
+        Chiamato prima del commit dello store: se il commit fallisce i vettori superati tornano a
+        essere calcolati quando servono, senza incoerenze tra cache e indice.
+        """
+        if self.cache is None:
+            return
+        stale = set(superseded) - set(current)
+        self.cache.discard([content_key(self.model_name, text) for text in stale])
+        self.cache.flush()
+
+    def _index_text(self, label, doc):
+        self.lexical.add(label, lexical_text(doc))
+        self.metadata.add(label, doc)
+        self._features[doc["id"]] = self._compute_features(doc)
+
+    def _unindex_text(self, label, id):
+        self.lexical.remove(label)
+        self.metadata.remove(label)
+        self._features.pop(id, None)
+
+    def _compute_features(self, doc):
+        return doc["context"].split(",")[0].strip(), self.term_matcher.term_set(doc["text"])
+
+    def doc_features(self, doc):
+        """(contesto principale, termini giuridici del testo), precalcolati al caricamento"""
+        features = self._features.get(doc["id"])
+        return features if features is not None else self._compute_features(doc)
+
+    def _build_index(self, embeddings, labels):
+        return build_index(embeddings, self.index_config, ids=labels)
+
+    def _remove_labels(self, labels):
+        if not labels:
+            return
+        labels = np.asarray(labels, dtype="int64")
+        try:
+            self.index.remove_ids(labels)
+        except RuntimeError:
+            # HNSW non supporta la rimozione: si ricostruisce dai vettori già indicizzati
+            logging.info(f"Indice {self.index_config['kind']} ricostruito per rimuovere {len(labels)} vettori")
+            inner = faiss.downcast_index(self.index.index)
+            vectors = inner.reconstruct_n(0, inner.ntotal)
+            current = faiss.vector_to_array(self.index.id_map)
+            keep = ~np.isin(current, labels)
+            self.index = self._build_index(vectors[keep], current[keep])
+
+    def upsert(self, entries):
+        """Aggiunge o aggiorna documenti: solo le entry modificate vengono validate, codificate e reindicizzate"""
+        with self._lock:
+            changed = self.store.prepare_upsert(entries)
+            if not changed:
+                return self.version
+            vectors = self._encode(changed)
+            old = {doc["id"]: self.store.row(doc["id"]) for doc in changed if doc["id"] in self.store}
+            superseded = [doc_text(self.store.get(id)) for id in old]
+            # Prima i passi che possono fallire (cache su disco), poi il commit: un errore lascia
+            # database, store e indici alla versione precedente
+            self._persist_vectors(superseded, [doc_text(doc) for doc in changed])
+            self.store.commit(upserts=changed)
+
+            # Ogni versione aggiornata ha una riga (e quindi un'etichetta) nuova nello store
+            self._remove_labels(list(old.values()))
+            for id, label in old.items():
+                self._unindex_text(label, id)
+            labels = np.asarray([self.store.row(doc["id"]) for doc in changed], dtype="int64")
+            for label, doc in zip(labels, changed):
+                self._index_text(int(label), doc)
+            self.index.add_with_ids(vectors, labels)
+            return self.version
+
+    def delete(self, ids):
+        """Elimina documenti dal database e dall'indice"""
+        with self._lock:
+            ids = self.store.prepare_delete(ids)
+            labels = [self.store.row(id) for id in ids]
+            superseded = [doc_text(self.store.get(id)) for id in ids]
+            self._persist_vectors(superseded)
+            self.store.commit(deletes=ids)
+            for label, id in zip(labels, ids):
+                self._unindex_text(label, id)
+            self._remove_labels(labels)
+            return self.version
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Regola il compromesso recall/latenza senza ricostruire l'indice"""
+        if nprobe is not None:
+            self.index_config["nprobe"] = nprobe
+        if ef_search is not None:
+            self.index_config["ef_search"] = ef_search
+        set_search_params(self.index, self.index_config)
+
     def search_by_id(self, id):
-        return [doc for doc in self.db if doc["id"] == id] or []
+        doc = self.store.get(id)
+        return [doc] if doc is not None else []
 
-    @lru_cache(maxsize=1000)
-    def search_semantic(self, query, k=10):
-        query_embedding = self.model.encode([query])
-        distances, indices = self.index.search(np.array(query_embedding), k)
-        return [self.db[i] for i in indices[0]]
+    def search_related(self, id):
+        """Documenti collegati per citazione: chi cita l'id e cosa cita l'id"""
+        return self.store.citing(id) + self.store.cites(id)
 
-    def search(self, query, tipo=None, intent=None):
-        # Ricerca semantica iniziale più ampia
-        results = self.search_semantic(query, k=10)
-        
-        # Filtraggio intelligente basato sul contesto
+    def _docs_for_labels(self, labels):
+        docs = (self.store.at(label) for label in labels)
+        return [doc for doc in docs if doc is not None]
+
+    def filter_plan(self, filters, k=10):
+        """Etichette ammesse dai filtri sui metadati, allentati se ne ammettono meno di
+        ``filter_min_matches`` (al massimo ``k``).
+
+        Restituisce ``None`` senza filtri, altrimenti un dict con ``mask`` (None se tutti i
+        filtri sono stati rimossi), ``applied``, ``relaxed``, ``matches`` e ``selectivity``.
+        """
+        if not filters:
+            return None
+        with self.metrics.span("metadata_filter"), self._lock:
+            total = len(self.metadata)
+            min_matches = min(config.get("filter_min_matches"), k, total)
+            applied, mask, matches, relaxed = self.metadata.plan(filters, min_matches)
+        selectivity = matches / total if total else 0.0
+        self.metrics.observe("filter_selectivity", selectivity, buckets=RATIO_BUCKETS)
+        for field in relaxed:
+            self.metrics.inc("filter_relaxed_total", field=field)
+        return {"mask": mask, "applied": applied, "relaxed": relaxed, "matches": matches,
+                "selectivity": round(selectivity, 6)}
+
+    def _dense_labels(self, embedding, k, mask=None):
+        with self._lock:
+            if mask is None:
+                distances, labels = self.index.search(embedding, k)
+            else:
+                # Filtro applicato dentro la ricerca FAISS: i k risultati rispettano tutti i filtri
+                params, _selector = filtered_search_params(self.index, self.index_config, mask, k)
+                distances, labels = self.index.search(embedding, k, params=params)
+            # Gli indici approssimati (o k > documenti) restituiscono -1 per gli slot vuoti
+            return [int(label) for label in labels[0] if label >= 0]
+
+    def _dense_labels_batch(self, embeddings, k):
+        """Una sola ricerca FAISS per tutte le query"""
+        with self._lock:
+            distances, labels = self.index.search(np.ascontiguousarray(embeddings, dtype="float32"), k)
+        return [[int(label) for label in row if label >= 0] for row in labels]
+
+    def search_semantic(self, query, k=10, embedding=None):
+        query_embedding = embedding if embedding is not None else self.encode_query(query)
+        return self._docs_for_labels(self._dense_labels(query_embedding, k))
+
+    def search_lexical(self, query, k=10):
+        with self._lock:
+            ranked = self.lexical.search(query, k)
+        return self._docs_for_labels([label for label, score in ranked])
+
+    def search_hybrid(self, query, k=10, k_dense=None, k_lexical=None, rrf_k=60, embedding=None, filters=None):
+        """Ricerca densa (FAISS) e lessicale (BM25) fuse con reciprocal rank fusion.
+
+        Restituisce ``(documenti, tempi)`` con i tempi in millisecondi per fase. Con ``filters``
+        (es. ``{"type": "sentenza", "codice": "codice civile"}``, vedi metadata_filter) entrambe
+        le ricerche sono limitate ai documenti ammessi; ``tempi`` contiene anche ``filter_ms``
+        e ``filter`` con filtri applicati, allentati e selettività.
+        """
+        timings = {}
+        mask = None
+        if filters:
+            start = time.perf_counter()
+            plan = self.filter_plan(filters, k)
+            timings["filter_ms"] = (time.perf_counter() - start) * 1000
+            mask = plan.pop("mask")
+            timings["filter"] = plan
+
+        start = time.perf_counter()
+        if embedding is None:
+            embedding = self.encode_query(query)
+        timings["encode_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        dense = self._dense_labels(embedding, k_dense or k, mask)
+        timings["dense_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with self._lock:
+            lexical = [label for label, score in self.lexical.search(query, k_lexical or k, allowed=mask)]
+        timings["lexical_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        fused = reciprocal_rank_fusion([dense, lexical], k=rrf_k)[:k]
+        docs = self._docs_for_labels(fused)
+        timings["fusion_ms"] = (time.perf_counter() - start) * 1000
+        return docs, timings
+
+    def search(self, query, tipo=None, intent=None, embedding=None, filters=None):
+        # Ricerca iniziale più ampia: semantica e lessicale fuse, limitate dai filtri sui metadati
+        with self.metrics.span("semantic_search"):
+            results, _ = self.search_hybrid(query, k=10, embedding=embedding, filters=filters)
+        return self._refine(query, results)
+
+    def search_batch(self, queries, embeddings=None, k=10, rrf_k=60, filters=None):
+        """Come ``search`` per più query: codifica in batch e una sola ricerca FAISS; risultati nello stesso ordine.
+
+        ``filters`` è una lista parallela alle query: quelle con filtri sono cercate una alla volta.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        if embeddings is None:
+            embeddings = self.encode_queries(queries)
+        filters = filters or [None] * len(queries)
+        with self.metrics.span("semantic_search"):
+            plain = [i for i, query_filters in enumerate(filters) if not query_filters]
+            dense = dict(zip(plain, self._dense_labels_batch(embeddings[plain], k))) if plain else {}
+            results = []
+            for i, query in enumerate(queries):
+                mask = None
+                if filters[i]:
+                    mask = self.filter_plan(filters[i], k)["mask"]
+                    dense[i] = self._dense_labels(embeddings[i:i + 1], k, mask)
+                with self._lock:
+                    lexical = [label for label, score in self.lexical.search(query, k, allowed=mask)]
+                fused = reciprocal_rank_fusion([dense[i], lexical], k=rrf_k)[:k]
+                results.append(self._docs_for_labels(fused))
+        return [self._refine(query, docs) for query, docs in zip(queries, results)]
+
+    def _refine(self, query, results):
+        """Riferimenti diretti citati nella query e filtro per area sui risultati della ricerca ibrida"""
+        # Filtraggio intelligente basato sul contesto (deduplica per id)
         filtered_results = []
+        seen_ids = set()
+
+        def add(doc):
+            if doc["id"] not in seen_ids:
+                seen_ids.add(doc["id"])
+                filtered_results.append(doc)
         
         # Cerca riferimenti diretti (es. articoli citati)
-        direct_refs = re.finditer(r"(CC|CP|Proc|Cass)-[A-Za-z0-9-]+", query)
-        for ref in direct_refs:
-            ref_results = self.search_by_id(ref.group(0))
-            filtered_results.extend(ref_results)
-            
-            # Cerca anche documenti correlati (es. sentenze che citano l'articolo)
-            for doc in self.db:
-                if "riferimenti" in doc["structure"] and ref.group(0) in doc["structure"]["riferimenti"]:
-                    filtered_results.append(doc)
+        with self.metrics.span("reference_lookup"):
+            for ref in REFERENCE_PATTERN.finditer(query):
+                for doc in self.search_by_id(ref.group(0)):
+                    add(doc)
+
+                # Cerca anche documenti correlati (sentenze che citano l'articolo e viceversa)
+                for doc in self.search_related(ref.group(0)):
+                    add(doc)
         
         # Analisi semantica per trovare documenti correlati
         query_parts = query.lower().split()
-        context_keywords = {
-            "civile": ["CC-", "civile", "contratto", "risarcimento", "danno"],
-            "penale": ["CP-", "penale", "reato", "pena"],
-            "procedura": ["Proc-", "procedura", "processo"],
-            "giurisprudenza": ["Cass-", "sentenza", "cassazione"]
-        }
+        # Aree citate nella query: il controllo non dipende dal documento
+        active_keywords = [
+            keywords for keywords in CONTEXT_KEYWORDS.values()
+            if any(kw in query_parts for kw in keywords)
+        ]
         
         # Aggiungi risultati basati sul contesto
         for result in results:
             # Verifica se il documento è rilevante per il contesto
-            is_relevant = False
-            for context_type, keywords in context_keywords.items():
-                if any(kw in query_parts for kw in keywords) and \
-                   any(kw in result["context"].lower() or kw in result["text"].lower() for kw in keywords):
-                    is_relevant = True
-                    break
+            search_text = f"{result['context']} {result['text']}".lower() if active_keywords else ""
+            is_relevant = any(
+                any(kw in search_text for kw in keywords) for keywords in active_keywords
+            )
             
             # Aggiungi documenti rilevanti che non sono già inclusi
-            if is_relevant and result not in filtered_results:
-                filtered_results.append(result)
+            if is_relevant:
+                add(result)
         
         # Se non abbiamo trovato risultati diretti, usa i risultati semantici
         if not filtered_results:
@@ -0,0 +1,257 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from .registry import registry
+
+
+class QueueFullError(RuntimeError):
+    """La coda di generazione ha raggiunto la capienza massima"""
+
+
+# Fine dello stream nella coda dei frammenti
+_END = object()
+
+
+class _Request:
+    __slots__ = ("prompt", "tokens", "future", "enqueued_at", "deadline", "chunks", "cancelled")
+
+    def __init__(self, prompt, tokens, timeout, stream=False):
+        self.prompt = prompt
+        self.tokens = tokens
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.deadline = self.enqueued_at + timeout if timeout else None
+        # Solo per lo streaming: frammenti prodotti dal worker e richiesta di interruzione del consumatore
+        self.chunks = queue.Queue() if stream else None
+        self.cancelled = threading.Event() if stream else None
+
+    def fail(self, error):
+        self.future.set_exception(error)
+        if self.chunks is not None:
+            self.chunks.put(error)
+
+
+class GenerationScheduler:
+    """Coda di generazione condivisa con batching dinamico.
+
+    Un solo worker preleva le richieste in attesa e le raggruppa in batch con padding:
+    il costo di un batch è ``token del prompt più lungo * numero di prompt`` e non
+    supera ``max_batch_tokens``. Ogni richiesta ha il suo Future, un timeout e può
+    essere annullata finché non è entrata in un batch.
+
+    Le richieste in streaming (``stream``) passano dalla stessa coda, con lo stesso limite,
+    timeout e metriche, ma sono generate da sole con ``generate_stream``: chiudere il
+    generatore restituito (client disconnesso) interrompe la generazione al frammento successivo.
+    """
+
+    def __init__(self, generate_batch, count_tokens, max_queue=64, max_batch_size=8,
+                 max_batch_tokens=8192, max_wait=0.02, default_timeout=300.0, generate_stream=None):
+        self.generate_batch = generate_batch
+        self.generate_stream = generate_stream
+        self.count_tokens = count_tokens
+        self.max_queue = max_queue
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.default_timeout = default_timeout
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0,
+                          "timed_out": 0, "cancelled": 0, "batches": 0, "streams": 0}
+        self._batch_sizes = deque(maxlen=1000)
+        self._wait_times = deque(maxlen=1000)
+        self._worker = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt, timeout=None):
+        """Accoda un prompt e restituisce un Future con il testo generato"""
+        return self._enqueue(_Request(prompt, self.count_tokens(prompt), timeout or self.default_timeout)).future
+
+    def _enqueue(self, request):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler di generazione chiuso")
+            if len(self._queue) >= self.max_queue:
+                self._counters["rejected"] += 1
+                raise QueueFullError(f"Coda di generazione piena ({self.max_queue} richieste in attesa)")
+            self._queue.append(request)
+            self._counters["submitted"] += 1
+            self._cond.notify()
+        return request
+
+    def stream(self, prompt, timeout=None):
+        """Accoda un prompt in streaming e restituisce un generatore dei frammenti della risposta.
+
+        Solleva TimeoutError se la generazione non termina entro ``timeout``; alla chiusura
+        anticipata del generatore la richiesta viene annullata, in coda o in generazione.
+        """
+        if self.generate_stream is None:
+            raise RuntimeError("Scheduler senza generazione in streaming")
+        timeout = timeout or self.default_timeout
+        request = self._enqueue(_Request(prompt, self.count_tokens(prompt), timeout, stream=True))
+        return self._consume(request, timeout)
+
+    def _consume(self, request, timeout):
+        try:
+            while True:
+                try:
+                    item = request.chunks.get(timeout=max(request.deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    raise TimeoutError(f"Generazione non completata entro {timeout}s")
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Uscita anticipata (client disconnesso, timeout, errore): il worker smette di generare
+            request.cancelled.set()
+            request.future.cancel()
+
+    def generate(self, prompt, timeout=None):
+        """Versione bloccante di ``submit``: attende il risultato o solleva TimeoutError"""
+        timeout = timeout or self.default_timeout
+        future = self.submit(prompt, timeout)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Se non è ancora in un batch la richiesta viene scartata dal worker
+            future.cancel()
+            raise TimeoutError(f"Generazione non completata entro {timeout}s")
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if self._closed and not self._queue:
+                return None
+            # Breve attesa per raccogliere altre richieste concorrenti (non per uno stream, generato da solo)
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed and self._queue[0].chunks is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            longest = 0
+            now = time.monotonic()
+            while self._queue and len(batch) < self.max_batch_size:
+                request = self._queue[0]
+                cost = max(longest, request.tokens) * (len(batch) + 1)
+                if batch and (cost > self.max_batch_tokens or request.chunks is not None):
+                    break
+                self._queue.popleft()
+                # Prima l'annullamento: un Future già annullato non accetta più eccezioni
+                if not request.future.set_running_or_notify_cancel():
+                    self._counters["cancelled"] += 1
+                    continue
+                if request.deadline is not None and now > request.deadline:
+                    self._counters["timed_out"] += 1
+                    request.fail(TimeoutError("Richiesta scaduta in coda"))
+                    continue
+                longest = max(longest, request.tokens)
+                batch.append(request)
+                if request.chunks is not None:
+                    break
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue
+            started = time.monotonic()
+            waits = [started - request.enqueued_at for request in batch]
+            if batch[0].chunks is not None:
+                self._run_stream(batch[0], waits)
+                continue
+            try:
+                results = self.generate_batch([request.prompt for request in batch])
+            except Exception as e:
+                logging.error(f"Errore durante la generazione di un batch di {len(batch)} richieste: {str(e)}")
+                for request in batch:
+                    request.future.set_exception(e)
+                with self._cond:
+                    self._counters["failed"] += len(batch)
+                continue
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+            with self._cond:
+                self._counters["completed"] += len(batch)
+                self._counters["batches"] += 1
+                self._batch_sizes.append(len(batch))
+                self._wait_times.extend(waits)
+            logging.debug(
+                f"Batch di {len(batch)} richieste in {time.monotonic() - started:.2f}s, "
+                f"attesa massima {max(waits):.2f}s"
+            )
+
+    def _run_stream(self, request, waits):
+        chunks = []
+        generator = self.generate_stream(request.prompt)
+        try:
+            for chunk in generator:
+                if request.cancelled.is_set():
+                    break
+                chunks.append(chunk)
+                request.chunks.put(chunk)
+        except Exception as e:
+            logging.error(f"Errore durante la generazione in streaming: {str(e)}")
+            request.fail(e)
+            with self._cond:
+                self._counters["failed"] += 1
+            return
+        finally:
+            # Chiude la generazione del backend anche se interrotta a metà
+            generator.close()
+        with self._cond:
+            self._wait_times.extend(waits)
+            if request.cancelled.is_set():
+                self._counters["cancelled"] += 1
+            else:
+                self._counters["completed"] += 1
+                self._counters["streams"] += 1
+        if request.cancelled.is_set():
+            request.fail(RuntimeError("Streaming annullato dal client"))
+        else:
+            request.future.set_result("".join(chunks))
+            request.chunks.put(_END)
+
+    def stats(self):
+        """Profondità della coda, dimensione dei batch e tempi di attesa"""
+        with self._cond:
+            sizes = list(self._batch_sizes)
+            waits = list(self._wait_times)
+            stats = dict(self._counters)
+            stats["queue_depth"] = len(self._queue)
+        stats["batch_size_mean"] = round(float(np.mean(sizes)), 2) if sizes else 0.0
+        stats["batch_size_max"] = max(sizes) if sizes else 0
+        stats["wait_seconds_p50"] = round(float(np.percentile(waits, 50)), 4) if waits else 0.0
+        stats["wait_seconds_p95"] = round(float(np.percentile(waits, 95)), 4) if waits else 0.0
+        return stats
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            self._worker.join()
+
+
+def get_scheduler(llm, **kwargs):
+    """Scheduler condiviso da tutte le sessioni per il modello dell'LLM indicato"""
+    return registry.get(
+        f"scheduler:{llm.model_name}",
+        lambda: GenerationScheduler(llm.generate_batch, llm.count_tokens, generate_stream=llm.stream_prompt, **kwargs)
+    )
@@ -0,0 +1,441 @@
+"""Servizio HTTP/JSON asincrono (solo libreria standard) sopra un QueryProcessor condiviso.
+
+    python -m src.server --host 0.0.0.0 --port 8000
+
+Endpoint:
+    GET  /health        processo attivo e stato di caricamento dei modelli
+    GET  /ready         200 solo quando i modelli sono caricati (per il load balancer)
+    GET  /metrics       metriche in formato Prometheus
+    POST /query         {"query": "..."} -> {"response": "..."}
+    POST /query/stream  {"query": "..."} -> righe NDJSON {"chunk": "..."}, poi {"done": true}
+    POST /batch         {"queries": [...], "batch_size": 32} -> una riga NDJSON per query, in ordine
+    POST /database      {"entries": [...], "delete": ["id", ...]} -> {"version": n}
+
+Ricerca e generazione sono bloccanti e girano in un pool di thread; al più
+``max_concurrency`` richieste sono in esecuzione, altre ``max_pending`` possono
+attendere, oltre si risponde 503 con Retry-After.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from . import config
+from .document_store import StaleDatabaseError
+from .metrics import PrometheusExporter, get_metrics
+from .registry import registry
+from .scheduler import QueueFullError
+
+MAX_BODY_BYTES = 16 * 2**20
+MAX_HEADER_LINES = 100
+# Righe NDJSON prodotte dal thread e non ancora inviate al client
+STREAM_BUFFER = 64
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class StreamingResponse:
+    """Risposta NDJSON inviata con chunked transfer encoding"""
+
+    def __init__(self, lines):
+        self.lines = lines
+
+
+class QueryService:
+    def __init__(self, db_path="data/database.json", max_concurrency=None, max_pending=None, timeout=None,
+                 processor_factory=None):
+        self.db_path = db_path
+        self.max_concurrency = max_concurrency or config.get("server_max_concurrency")
+        self.max_pending = config.get("server_max_pending") if max_pending is None else max_pending
+        self.timeout = timeout or config.get("server_timeout")
+        self.processor_factory = processor_factory or self._default_processor
+        self.processor = None
+        self.load_error = None
+        self.started_at = time.time()
+        self.metrics = get_metrics()
+        # Un thread in più per il caricamento iniziale dei modelli
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency + 1, thread_name_prefix="legalai-http")
+        self._semaphore = None
+        self._active = 0
+        self._pending = 0
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/ready"): self.ready,
+            ("GET", "/metrics"): self.metrics_text,
+            ("POST", "/query"): self.query,
+            ("POST", "/query/stream"): self.query_stream,
+            ("POST", "/batch"): self.batch,
+            ("POST", "/database"): self.update_database,
+        }
+
+    def _default_processor(self):
+        from .query_processor import QueryProcessor
+
+        return QueryProcessor(self.db_path)
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            self.processor = self.processor_factory()
+        except Exception as e:
+            self.load_error = f"{type(e).__name__}: {e}"
+            logging.error(f"Errore durante il caricamento dei modelli: {self.load_error}")
+            return
+        logging.info(f"Servizio pronto in {time.perf_counter() - start:.1f}s")
+
+    async def start(self, host, port):
+        """Avvia il server; i modelli si caricano in background e /ready diventa 200 a caricamento concluso"""
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        asyncio.get_running_loop().run_in_executor(self._executor, self._load)
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        logging.info(f"Servizio HTTP in ascolto su {host}:{port}")
+        return server
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    # Ammissione e esecuzione
+
+    async def _acquire(self):
+        if self.processor is None:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, self.load_error or "Servizio non pronto: modelli in caricamento",
+                            {"Retry-After": "5"})
+        if not self._semaphore.locked():
+            # Posto libero: acquisizione immediata, senza cedere il controllo al loop
+            await self._semaphore.acquire()
+        else:
+            if self._pending >= self.max_pending:
+                self.metrics.inc("http_rejected_total", reason="backpressure")
+                raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Troppe richieste in attesa", {"Retry-After": "1"})
+            self._pending += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.metrics.inc("http_rejected_total", reason="queue_timeout")
+                raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Attesa in coda oltre il timeout", {"Retry-After": "1"})
+            finally:
+                self._pending -= 1
+        self._active += 1
+
+    def _release(self):
+        self._active -= 1
+        self._semaphore.release()
+
+    async def _run(self, fn, *args):
+        """Esegue una funzione bloccante nel pool, con timeout, nel posto ottenuto con ``_acquire``.
+
+        Il posto è rilasciato quando il thread termina e non allo scadere del timeout: un
+        thread ancora al lavoro continua a contare nella concorrenza e l'ammissione resta limitata.
+        """
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        try:
+            # shield: timeout o disconnessione del client non annullano il future (e il suo callback)
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, f"Richiesta non completata entro {self.timeout}s")
+
+    async def _iterate(self, make_iterator):
+        """Consuma un iteratore bloccante in un thread, con buffer limitato (il thread attende se il client è lento)"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            iterator = None
+            try:
+                iterator = make_iterator()
+                for item in iterator:
+                    if stop.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            except Exception as e:
+                if not stop.is_set():
+                    asyncio.run_coroutine_threadsafe(queue.put(e), loop).result()
+            finally:
+                if iterator is not None and hasattr(iterator, "close"):
+                    iterator.close()
+                if not stop.is_set():
+                    asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+
+        producer = loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), self.timeout)
+                except asyncio.TimeoutError:
+                    raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, f"Nessun dato entro {self.timeout}s")
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Client disconnesso o errore: si ferma il produttore svuotando il buffer
+            stop.set()
+            while not producer.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.wait([producer], timeout=0.05)
+
+    # Endpoint
+
+    async def health(self, body):
+        state = "loaded" if self.processor is not None else ("error" if self.load_error else "loading")
+        return HTTPStatus.OK, {
+            "status": "ok",
+            "models": state,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+        }
+
+    async def ready(self, body):
+        payload = {
+            "ready": self.processor is not None,
+            "resources": registry.stats(),
+            "active": self._active,
+            "pending": self._pending,
+        }
+        if self.processor is None:
+            payload["error"] = self.load_error
+            return HTTPStatus.SERVICE_UNAVAILABLE, payload
+        payload["scheduler"] = self.processor.scheduler.stats()
+        return HTTPStatus.OK, payload
+
+    async def metrics_text(self, body):
+        return HTTPStatus.OK, PrometheusExporter().render(self.metrics.snapshot())
+
+    async def query(self, body):
+        query = _require_query(body)
+        await self._acquire()
+        start = time.perf_counter()
+        response = await self._run(self.processor.process, query)
+        return HTTPStatus.OK, {"response": response, "seconds": round(time.perf_counter() - start, 3)}
+
+    async def query_stream(self, body):
+        query = _require_query(body)
+        await self._acquire()
+
+        async def lines():
+            try:
+                async for chunk in self._iterate(lambda: self.processor.process_stream(query)):
+                    yield {"chunk": chunk}
+                yield {"done": True}
+            finally:
+                self._release()
+
+        return HTTPStatus.OK, StreamingResponse(lines())
+
+    async def batch(self, body):
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Campo 'queries' mancante o non valido (lista di stringhe)")
+        batch_size = body.get("batch_size")
+        await self._acquire()
+
+        async def lines():
+            try:
+                async for result in self._iterate(lambda: self.processor.process_batch(queries, batch_size=batch_size)):
+                    yield result
+            finally:
+                self._release()
+
+        return HTTPStatus.OK, StreamingResponse(lines())
+
+    async def update_database(self, body):
+        entries = body.get("entries", [])
+        deletes = body.get("delete", [])
+        if not isinstance(entries, list) or not isinstance(deletes, list) or not (entries or deletes):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Specificare 'entries' e/o 'delete' come liste")
+        def apply():
+            # Upsert ed eliminazioni nello stesso thread: un solo posto per tutto l'aggiornamento
+            retriever = self.processor.retriever
+            version = retriever.version
+            if entries:
+                version = retriever.upsert(entries)
+            if deletes:
+                version = retriever.delete(deletes)
+            return version
+
+        await self._acquire()
+        return HTTPStatus.OK, {"version": await self._run(apply)}
+
+    # HTTP
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HTTPError as e:
+                    await _write_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._dispatch(writer, method, path, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, writer, method, path, body, keep_alive):
+        start = time.perf_counter()
+        route = path.split("?", 1)[0]
+        handler = self.routes.get((method, route))
+        extra_headers = {}
+        try:
+            if handler is None:
+                known = any(route == known_path for _, known_path in self.routes)
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED if known else HTTPStatus.NOT_FOUND,
+                                f"{method} {route} non supportato")
+            payload = {}
+            if method == "POST":
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "Corpo JSON non valido")
+                if not isinstance(payload, dict):
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "Il corpo deve essere un oggetto JSON")
+            status, result = await handler(payload)
+        except HTTPError as e:
+            status, result, extra_headers = e.status, {"error": str(e)}, e.headers
+        except QueueFullError as e:
+            status, result, extra_headers = HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}, {"Retry-After": "1"}
+        except StaleDatabaseError as e:
+            status, result = HTTPStatus.CONFLICT, {"error": str(e)}
+        except (ValueError, KeyError) as e:
+            status, result = HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            logging.error(f"Errore su {method} {route}: {type(e).__name__}: {e}")
+            status, result = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+
+        if isinstance(result, StreamingResponse):
+            await _write_stream(writer, status, result.lines, keep_alive)
+        elif isinstance(result, str):
+            await _write_body(writer, status, result.encode("utf-8"), "text/plain; version=0.0.4", keep_alive)
+        else:
+            await _write_json(writer, status, result, keep_alive, extra_headers)
+        self.metrics.inc("http_requests_total", route=route if handler else "other", status=int(status))
+        self.metrics.observe("http_request_seconds", time.perf_counter() - start, route=route if handler else "other")
+
+
+def _require_query(body):
+    query = body.get("query")
+    if not isinstance(query, str) or not query.strip():
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Campo 'query' mancante o vuoto")
+    return query
+
+
+async def _read_request(reader):
+    """(metodo, percorso, header, corpo) oppure None a connessione chiusa"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Riga di richiesta non valida")
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Troppi header")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Content-Length non valido")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Corpo oltre {MAX_BODY_BYTES} byte")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, headers, body
+
+
+def _head(status, headers, keep_alive):
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _write_body(writer, status, data, content_type, keep_alive, headers=None):
+    head = _head(status, {"Content-Type": content_type, "Content-Length": len(data), **(headers or {})}, keep_alive)
+    writer.write(head + data)
+    await writer.drain()
+
+
+async def _write_json(writer, status, payload, keep_alive, headers=None):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await _write_body(writer, status, data, "application/json; charset=utf-8", keep_alive, headers)
+
+
+async def _write_stream(writer, status, lines, keep_alive):
+    writer.write(_head(status, {"Content-Type": "application/x-ndjson; charset=utf-8",
+                                "Transfer-Encoding": "chunked"}, keep_alive))
+    try:
+        try:
+            async for line in lines:
+                data = (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+                writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+                await writer.drain()
+        except HTTPError as e:
+            # Stato già inviato: l'errore viaggia come ultima riga dello stream
+            data = (json.dumps({"error": str(e)}, ensure_ascii=False) + "\n").encode("utf-8")
+            writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+        except Exception as e:
+            logging.error(f"Errore durante lo streaming: {type(e).__name__}: {e}")
+            data = (json.dumps({"error": f"{type(e).__name__}: {e}"}, ensure_ascii=False) + "\n").encode("utf-8")
+            writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+    finally:
+        await lines.aclose()
+
+
+async def serve(host, port, db_path="data/database.json", **kwargs):
+    service = QueryService(db_path, **kwargs)
+    server = await service.start(host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servizio HTTP/JSON di LegalAI")
+    parser.add_argument("--host", default=config.get("server_host"))
+    parser.add_argument("--port", type=int, default=config.get("server_port"))
+    parser.add_argument("--db", default="data/database.json")
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--max-pending", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.db, max_concurrency=args.max_concurrency,
+                          max_pending=args.max_pending, timeout=args.timeout))
+    except KeyboardInterrupt:
+        logging.info("Servizio HTTP arrestato")
+
+
+if __name__ == "__main__":
+    main()
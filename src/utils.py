@@ -1,6 +1,17 @@
+import glob
 import json
 import logging
 import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from .registry import peak_rss_bytes
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock tra processi
+    fcntl = None
 
 # Logging visibile nella console
 logging.basicConfig(
@@ -9,20 +20,23 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 
-def validate_entry(entry, db=None):
-    logging.info(f"Validating entry: {entry['id']}")
-    required_base = {"id", "type", "text", "context", "structure"}
-    if not all(field in entry for field in required_base):
-        missing = required_base - set(entry.keys())
-        logging.error(f"Campi base mancanti in {entry['id']}: {missing}")
+REQUIRED_BASE = frozenset({"id", "type", "text", "context", "structure"})
+
+REQUIRED_STRUCTURE = {
+    "legge": ["codice", "libro", "titolo", "capo", "articolo", "commi"],
+    "procedura": ["evento", "steps"],
+    "sentenza": ["numero", "anno", "sezione", "riferimenti"],
+    "circolare": ["ente", "numero", "data"]
+}
+
+def validate_entry(entry, db=None, known_ids=None):
+    # Nessun log per entry valida: con milioni di entries il logging domina il caricamento
+    missing = REQUIRED_BASE - entry.keys()
+    if missing:
+        logging.error(f"Campi base mancanti in {entry.get('id')}: {missing}")
         raise ValueError(f"Campi base mancanti: {missing}")
     
-    required_structure = {
-        "legge": ["codice", "libro", "titolo", "capo", "articolo", "commi"],
-        "procedura": ["evento", "steps"],
-        "sentenza": ["numero", "anno", "sezione", "riferimenti"],
-        "circolare": ["ente", "numero", "data"]
-    }
+    required_structure = REQUIRED_STRUCTURE
     tipo = entry["type"]
     if tipo not in required_structure:
         logging.error(f"Tipo non valido in {entry['id']}: {tipo}")
@@ -38,31 +52,149 @@ def validate_entry(entry, db=None):
         logging.error(f"ID non valido in {entry['id']}")
         raise ValueError(f"ID non valido: {entry['id']}")
     
-    if tipo == "sentenza" and db:
+    if tipo == "sentenza" and (db or known_ids is not None):
         refs = structure.get("riferimenti", [])
         for ref in refs:
-            if not any(doc["id"] == ref for doc in db):
+            found = ref in known_ids if known_ids is not None else any(doc["id"] == ref for doc in db)
+            if not found:
                 logging.error(f"Riferimento non trovato nel database per {entry['id']}: {ref}")
                 raise ValueError(f"Riferimento non trovato nel database: {ref}")
     
-    logging.info(f"Entry {entry['id']} validata con successo")
     return True
 
-def load_database(db_path):
-    logging.info(f"Caricamento database da {db_path}")
+_WHITESPACE = re.compile(r"\s*")
+
+def _iter_json_array(f, chunk_size=1 << 20):
+    """Legge un array JSON elemento per elemento, senza caricare tutto il file in memoria"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos >= len(buffer):
+            if eof:
+                raise ValueError("JSON troncato: array non chiuso")
+            fill()
+            continue
+        char = buffer[pos]
+        if not started:
+            if char != "[":
+                raise ValueError("Il database JSON deve essere un array di entries")
+            started = True
+            pos += 1
+        elif char == "]":
+            return
+        elif char == ",":
+            pos += 1
+        else:
+            try:
+                entry, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            pos = end
+            yield entry
+
+def database_files(db_path):
+    """File del database: il file stesso o gli shard .json/.jsonl della cartella, in ordine di nome"""
+    if os.path.isdir(db_path):
+        return sorted(glob.glob(os.path.join(db_path, "*.json")) + glob.glob(os.path.join(db_path, "*.jsonl")))
+    return [db_path]
+
+def iter_entries(db_path):
+    """Entries da un array JSON, da un file JSONL o da una cartella di shard (.json/.jsonl, in ordine di nome)"""
+    if os.path.isdir(db_path):
+        for shard in database_files(db_path):
+            yield from iter_entries(shard)
+        return
     with open(db_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    for entry in data:
-        validate_entry(entry, data)
-    logging.info(f"Database caricato con successo: {len(data)} entries")
-    return data
-
-def update_database(db_path, new_data):
-    logging.info(f"Aggiornamento database in {db_path}")
-    current_db = load_database(db_path)
-    for entry in new_data:
-        validate_entry(entry, current_db + new_data)
-    with open(db_path, "w", encoding="utf-8") as f:
-        json.dump(new_data, f, ensure_ascii=False, indent=2)
-    logging.info("Database aggiornato")
-    return load_database(db_path)
\ No newline at end of file
+        if db_path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _iter_json_array(f)
+
+def load_database_with_stats(db_path, into=None):
+    """Caricamento in un solo passaggio: validazione strutturale subito, riferimenti alla fine contro l'insieme degli id.
+
+    ``into`` riceve le entry con ``append`` (predefinito: una lista), es. le colonne del DocumentStore.
+    """
+    logging.info(f"Caricamento database da {db_path}")
+    start = time.perf_counter()
+    data = [] if into is None else into
+    ids = set()
+    pending_refs = []
+    for entry in iter_entries(db_path):
+        validate_entry(entry)
+        if entry["id"] in ids:
+            logging.error(f"ID duplicato nel database: {entry['id']}")
+            raise ValueError(f"ID duplicato: {entry['id']}")
+        ids.add(entry["id"])
+        if entry["type"] == "sentenza":
+            pending_refs.append((entry["id"], entry["structure"].get("riferimenti", [])))
+        data.append(entry)
+
+    # Controllo differito dei riferimenti: ogni lookup è O(1)
+    for id, refs in pending_refs:
+        for ref in refs:
+            if ref not in ids:
+                logging.error(f"Riferimento non trovato nel database per {id}: {ref}")
+                raise ValueError(f"Riferimento non trovato nel database: {ref}")
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "entries": len(data),
+        "seconds": round(elapsed, 3),
+        "entries_per_second": round(len(data) / elapsed, 1) if elapsed > 0 else 0.0,
+        "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1),
+    }
+    logging.info(
+        f"Database caricato con successo: {stats['entries']} entries in {stats['seconds']}s "
+        f"({stats['entries_per_second']} entries/s, picco RSS {stats['peak_rss_mb']} MB)"
+    )
+    return data, stats
+
+def load_database(db_path):
+    return load_database_with_stats(db_path)[0]
+
+def write_database(db_path, data):
+    """Scrittura atomica: file temporaneo nella stessa cartella e rename (JSON o JSONL secondo l'estensione)"""
+    if os.path.isdir(db_path):
+        raise ValueError(f"Database a shard in sola lettura: {db_path}")
+    directory = os.path.dirname(os.path.abspath(db_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".database-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            if db_path.endswith(".jsonl"):
+                for entry in data:
+                    f.write(json.dumps(entry, ensure_ascii=False))
+                    f.write("\n")
+            else:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@contextmanager
+def file_lock(path):
+    """Lock consultivo esclusivo sul file indicato, tra thread, istanze e processi (non rientrante)"""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
@@ -0,0 +1,200 @@
+import argparse
+import json
+import logging
+import math
+import time
+
+import faiss
+import numpy as np
+
+INDEX_KINDS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Da incrementare quando cambia la struttura degli indici salvati (2: id espliciti)
+INDEX_FORMAT = 2
+
+# Parametri di costruzione (entrano nell'impronta dell'indice salvato)
+BUILD_DEFAULTS = {
+    "flat": {},
+    "ivf_flat": {"nlist": 1024},
+    "ivf_pq": {"nlist": 1024, "pq_m": 16, "pq_nbits": 8},
+    "hnsw": {"hnsw_m": 32, "ef_construction": 200},
+}
+
+# Parametri di ricerca (modificabili a runtime senza ricostruire)
+SEARCH_DEFAULTS = {"nprobe": 16, "ef_search": 64}
+# Limite di efSearch quando un filtro selettivo obbliga HNSW a esplorare più nodi
+MAX_FILTERED_EF_SEARCH = 4096
+
+
+def normalize_config(config=None):
+    """Completa una configurazione parziale con i valori predefiniti del tipo di indice"""
+    config = dict(config or {})
+    kind = config.pop("kind", "flat")
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Tipo di indice non valido: {kind} (ammessi: {', '.join(INDEX_KINDS)})")
+    normalized = {"kind": kind, **BUILD_DEFAULTS[kind], **SEARCH_DEFAULTS}
+    unknown = set(config) - set(normalized)
+    if unknown:
+        raise ValueError(f"Parametri non validi per l'indice {kind}: {sorted(unknown)}")
+    normalized.update(config)
+    return normalized
+
+
+def build_signature(config):
+    """Stringa stabile con i soli parametri che influenzano la costruzione"""
+    config = normalize_config(config)
+    build = {key: config[key] for key in ["kind", *BUILD_DEFAULTS[config["kind"]]]}
+    build["format"] = INDEX_FORMAT
+    return json.dumps(build, sort_keys=True)
+
+
+def _largest_divisor(dim, limit):
+    for m in range(min(limit, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def build_index(embeddings, config=None, ids=None):
+    """Costruisce, addestra e popola l'indice richiesto sugli embedding esistenti.
+
+    ``ids`` (predefinito: numero di riga) permette di aggiungere e rimuovere vettori
+    per id senza ricostruire: gli indici IVF gestiscono gli id nativamente, flat e
+    HNSW vengono avvolti in un ``IndexIDMap2``.
+    """
+    config = normalize_config(config)
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    n, dim = embeddings.shape
+    kind = config["kind"]
+
+    if kind in ("ivf_flat", "ivf_pq"):
+        # Con pochi vettori le liste invertite vanno ridotte (faiss vuole almeno un punto per centroide)
+        nlist = max(1, min(config["nlist"], n // 39 or 1))
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            pq_nbits = min(config["pq_nbits"], int(math.log2(n)) if n > 1 else 1)
+            if pq_nbits < 1 or n < 2 ** pq_nbits:
+                logging.warning(f"Troppi pochi vettori ({n}) per addestrare IVF-PQ, uso indice flat")
+                return build_index(embeddings, {"kind": "flat"}, ids=ids)
+            pq_m = _largest_divisor(dim, config["pq_m"])
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+        if n:
+            index.train(embeddings)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config["hnsw_m"])
+        index.hnsw.efConstruction = config["ef_construction"]
+    else:
+        index = faiss.IndexFlatL2(dim)
+
+    if not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap2(index)
+    if ids is None:
+        ids = np.arange(n, dtype="int64")
+    index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    set_search_params(index, config)
+    return index
+
+
+def set_search_params(index, config):
+    """Applica nprobe (IVF) ed efSearch (HNSW) a un indice già costruito o ricaricato"""
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    if isinstance(inner, faiss.IndexIVF) and config.get("nprobe"):
+        inner.nprobe = min(int(config["nprobe"]), inner.nlist)
+    if isinstance(inner, faiss.IndexHNSW) and config.get("ef_search"):
+        inner.hnsw.efSearch = int(config["ef_search"])
+
+
+def filtered_search_params(index, config, mask, k=10):
+    """SearchParameters che limitano la ricerca alle etichette ammesse da ``mask`` (IDSelectorBitmap).
+
+    Con filtri selettivi nprobe (IVF) ed efSearch (HNSW) crescono come 1/selettività, così
+    le liste e i nodi visitati contengono ancora ``k`` documenti ammessi. Restituisce anche
+    gli oggetti da tenere in vita fino al termine della ricerca.
+    """
+    bits = np.packbits(mask, bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bits))
+    selectivity = max(float(mask.mean()), 1e-6) if len(mask) else 1.0
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    if isinstance(inner, faiss.IndexIVF):
+        nprobe = min(int(math.ceil(config["nprobe"] / selectivity)), inner.nlist)
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    elif isinstance(inner, faiss.IndexHNSW):
+        ef_search = min(max(config["ef_search"], int(k / selectivity)), MAX_FILTERED_EF_SEARCH)
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return params, (bits, selector)
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+def evaluate_indexes(embeddings, queries, configs, k=10):
+    """Confronta recall@k e latenza di ogni configurazione con l'indice flat esatto"""
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    k = min(k, len(embeddings))
+
+    exact = build_index(embeddings, {"kind": "flat"})
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for config in configs:
+        config = normalize_config(config)
+        start = time.perf_counter()
+        index = build_index(embeddings, config)
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            _, found = index.search(query.reshape(1, -1), k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(set(found[0]) & set(expected))
+
+        report.append({
+            "config": config,
+            "build_seconds": round(build_seconds, 3),
+            f"recall@{k}": round(hits / (k * len(queries)), 4) if len(queries) else 0.0,
+            "latency_ms_p50": round(_percentile(latencies, 50), 4),
+            "latency_ms_p95": round(_percentile(latencies, 95), 4),
+        })
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall@k e latenza degli indici FAISS rispetto all'indice flat")
+    parser.add_argument("vectors", help="Cartella della cache degli embedding (es. data/cache/<modello>/<database>) o file .npy")
+    parser.add_argument("--queries", type=int, default=200, help="Numero di query campionate dal corpus")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[1, 8, 32])
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[16, 64, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.vectors.endswith(".npy"):
+        embeddings = np.load(args.vectors, mmap_mode="r")
+    else:
+        from .embedding_cache import read_vectors
+
+        embeddings = read_vectors(args.vectors)
+    rng = np.random.default_rng(args.seed)
+    sample = rng.choice(len(embeddings), size=min(args.queries, len(embeddings)), replace=False)
+    # Query leggermente perturbate per non premiare il match esatto del vettore stesso
+    queries = np.asarray(embeddings[np.sort(sample)]) + rng.normal(0, 0.01, (len(sample), embeddings.shape[1]))
+
+    configs = [{"kind": "flat"}]
+    configs += [{"kind": "ivf_flat", "nprobe": p} for p in args.nprobe]
+    configs += [{"kind": "ivf_pq", "nprobe": p} for p in args.nprobe]
+    configs += [{"kind": "hnsw", "ef_search": ef} for ef in args.ef_search]
+
+    for row in evaluate_indexes(embeddings, queries, configs, k=args.k):
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
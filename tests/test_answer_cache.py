@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from src.answer_cache import SemanticAnswerCache
+
+
+class TestSemanticAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.embedding = np.array([1.0, 0.0, 0.0], dtype="float32")
+        self.similar = np.array([0.99, 0.05, 0.0], dtype="float32")
+        self.different = np.array([0.0, 1.0, 0.0], dtype="float32")
+
+    def test_hit_requires_similarity_docs_and_version(self):
+        cache = SemanticAnswerCache(threshold=0.95)
+        cache.store("q", self.embedding, "docs", "v1", "risposta")
+        self.assertEqual(cache.lookup(self.similar, "docs", "v1"), "risposta")
+        self.assertIsNone(cache.lookup(self.different, "docs", "v1"))
+        self.assertIsNone(cache.lookup(self.similar, "altri-docs", "v1"))
+        self.assertIsNone(cache.lookup(self.similar, "docs", "v2"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 3))
+
+    def test_lru_ttl_and_invalidation(self):
+        cache = SemanticAnswerCache(max_entries=2, ttl=0.05)
+        cache.store("a", self.embedding, "a", "v1", "A")
+        cache.store("b", self.embedding, "b", "v1", "B")
+        cache.lookup(self.embedding, "a", "v1")
+        cache.store("c", self.embedding, "c", "v2", "C")
+        self.assertIsNone(cache.lookup(self.embedding, "b", "v1"))
+        self.assertEqual(cache.lookup(self.embedding, "a", "v1"), "A")
+
+        cache.invalidate("v2")
+        self.assertEqual(len(cache), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.lookup(self.embedding, "c", "v2"))
+
+    def test_persistence(self):
+        path = os.path.join(tempfile.mkdtemp(), "answers.json")
+        cache = SemanticAnswerCache(path=path)
+        cache.store("q", self.embedding, "docs", "v1", "risposta")
+        cache.save()
+        self.assertEqual(SemanticAnswerCache(path=path).lookup(self.similar, "docs", "v1"), "risposta")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.compare import compare
+from benchmarks.corpus import generate_corpus, generate_queries, write_corpus
+from src.utils import load_database
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_synthetic_corpus_is_valid_and_reproducible(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "corpus.jsonl")
+            entries = write_corpus(path, 500, seed=3)
+            self.assertEqual(load_database(path), entries)
+        self.assertEqual(generate_corpus(500, seed=3), entries)
+        self.assertEqual({entry["type"] for entry in entries}, {"legge", "sentenza", "procedura", "circolare"})
+        self.assertTrue(any(entry["structure"].get("riferimenti") for entry in entries))
+        self.assertEqual(generate_queries(entries, 20, seed=3), generate_queries(entries, 20, seed=3))
+
+    def test_compare_flags_regressions(self):
+        baseline = {"stages": {"search": {"p95_ms": 10.0, "throughput_per_s": 100.0, "errors": 0}}}
+        current = {"stages": {"search": {"p95_ms": 11.0, "throughput_per_s": 70.0, "errors": 0}}}
+        self.assertEqual(compare(baseline, current, tolerance=0.2), [("search", "throughput_per_s", 100.0, 70.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
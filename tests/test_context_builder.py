@@ -0,0 +1,46 @@
+import json
+import unittest
+
+from src.context_builder import ContextBuilder
+
+
+def word_count(text):
+    word_count.calls += 1
+    return len(text.split())
+
+
+word_count.calls = 0
+
+
+class TestContextBuilder(unittest.TestCase):
+    def setUp(self):
+        with open("data/database.json", "r", encoding="utf-8") as f:
+            self.docs = json.load(f)
+
+    def test_sections_and_dedup(self):
+        builder = ContextBuilder(word_count, budget=10000)
+        context, stats = builder.build(self.docs + self.docs[:2])
+        self.assertTrue(context.startswith("Articoli di legge pertinenti:\n- CC-L4-T9-C1-Art.2043: "))
+        self.assertIn("\n\nInterpretazioni giurisprudenziali:\n- Sentenza Cass-Civ-12345-2020:", context)
+        self.assertIn("\n\nProcedure correlate:\n- Proc-Emerg-Incendio-001:", context)
+        self.assertEqual(context.count("CC-L4-T9-C1-Art.2043:"), 1)
+        self.assertEqual(stats["docs"], len(self.docs))
+        self.assertEqual(stats["dropped"], 0)
+
+    def test_budget_keeps_most_relevant_docs(self):
+        builder = ContextBuilder(word_count, budget=40)
+        selected, used, dropped = builder.select(self.docs)
+        self.assertLessEqual(used, 40)
+        self.assertGreater(dropped, 0)
+        self.assertEqual(selected[0]["id"], self.docs[0]["id"])
+
+    def test_token_counts_are_cached(self):
+        builder = ContextBuilder(word_count)
+        builder.build(self.docs)
+        calls = word_count.calls
+        builder.build(self.docs)
+        self.assertEqual(word_count.calls, calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
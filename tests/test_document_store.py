@@ -0,0 +1,178 @@
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from src.document_store import DocumentColumns, DocumentStore, StaleDatabaseError, StaleDocumentError
+
+
+class TestDocumentStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "database.json")
+        shutil.copy("data/database.json", self.db_path)
+        self.store = DocumentStore(self.db_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_upsert_skips_unchanged_and_bumps_version(self):
+        doc = copy.deepcopy(self.store.get("CC-L1-T1-C1-Art.1"))
+        self.assertEqual(self.store.prepare_upsert([doc]), [])
+
+        doc["text"] = "Testo aggiornato."
+        changed = self.store.prepare_upsert([doc])
+        self.assertEqual(self.store.commit(upserts=changed), 1)
+
+        with open(self.db_path, encoding="utf-8") as f:
+            saved = json.load(f)
+        self.assertEqual([d["id"] for d in saved], [d["id"] for d in self.store.docs])
+        self.assertEqual(self.store.get("CC-L1-T1-C1-Art.1")["text"], "Testo aggiornato.")
+
+    def test_documents_are_dict_compatible_views(self):
+        with open(self.db_path, encoding="utf-8") as f:
+            saved = json.load(f)
+        self.assertEqual(self.store.docs, saved)
+        doc = self.store.get("Cass-Civ-12345-2020")
+        self.assertEqual(dict(doc), saved[[d["id"] for d in saved].index(doc["id"])])
+        self.assertIsInstance(copy.deepcopy(doc), dict)
+        self.assertNotIn("assente", doc)
+
+    def test_upsert_moves_document_to_new_row(self):
+        old = self.store.get("CC-L1-T1-C1-Art.1")
+        doc = copy.deepcopy(old)
+        doc["text"] = "Testo aggiornato."
+        self.store.commit(upserts=self.store.prepare_upsert([doc]))
+        new = self.store.get("CC-L1-T1-C1-Art.1")
+        self.assertNotEqual(new.row, old.row)
+        self.assertIsNone(self.store.at(old.row))
+        self.assertEqual(self.store.at(new.row)["text"], "Testo aggiornato.")
+        # La vista sulla versione precedente resta leggibile
+        self.assertEqual(old["text"], "La capacità giuridica si acquista al momento della nascita.")
+
+    def test_repeated_upserts_keep_storage_bounded(self):
+        rows, size = len(self.store.columns), self.store.columns.nbytes()["text_file"]
+        doc = copy.deepcopy(self.store.get("CC-L1-T1-C1-Art.1"))
+        for i in range(200):
+            doc["text"] = f"Testo aggiornato {i}. " * 20
+            self.store.commit(upserts=self.store.prepare_upsert([doc]))
+            # Al massimo una riga in più (quella lasciata dall'ultimo commit)
+            self.assertLessEqual(len(self.store.columns), rows + 1)
+        self.assertLess(self.store.columns.nbytes()["text_file"], 2 * size + 4 * len(doc["text"].encode()))
+        self.assertEqual(self.store.get("CC-L1-T1-C1-Art.1")["text"], doc["text"])
+        with open(self.db_path, encoding="utf-8") as f:
+            self.assertEqual(self.store.docs, json.load(f))
+
+    def test_deleted_rows_are_reused_by_later_inserts(self):
+        deleted = self.store.get("Cass-Civ-12345-2020")
+        self.store.commit(deletes=self.store.prepare_delete([deleted["id"]]))
+        # La vista sulla riga eliminata resta leggibile fino al commit successivo
+        self.assertEqual(deleted["type"], "sentenza")
+        entry = {**deleted.to_dict(), "id": "Cass-Civ-99999-2021"}
+        self.store.commit(upserts=self.store.prepare_upsert([entry]))
+        self.assertEqual(self.store.row("Cass-Civ-99999-2021"), deleted.row)
+        self.assertEqual(self.store.at(deleted.row)["id"], "Cass-Civ-99999-2021")
+
+    def test_view_on_a_reused_row_raises_instead_of_reading_another_document(self):
+        held = self.store.get("CC-L1-T1-C1-Art.1")
+        doc = held.to_dict()
+        doc["text"] = "Testo aggiornato."
+        self.store.commit(upserts=self.store.prepare_upsert([doc]))
+        self.assertEqual(held["id"], "CC-L1-T1-C1-Art.1")
+        # Il commit successivo riusa la riga per un altro documento
+        other = {**self.store.get("CP-L1-T1-C1-Art.1").to_dict(), "text": "Altro testo."}
+        self.store.commit(upserts=self.store.prepare_upsert([other]))
+        self.assertEqual(self.store.row(other["id"]), held.row)
+        with self.assertRaises(StaleDocumentError):
+            held["id"]
+        with self.assertRaises(StaleDocumentError):
+            dict(held)
+        self.assertEqual(self.store.get(other["id"])["text"], "Altro testo.")
+
+    def test_revision_changes_with_content_even_with_same_size_and_mtime(self):
+        stat = os.stat(self.db_path)
+        with open(self.db_path, encoding="utf-8") as f:
+            content = f.read()
+        with open(self.db_path, "w", encoding="utf-8") as f:
+            f.write(content.replace("Art.2043", "Art.2044"))
+        os.utime(self.db_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(os.stat(self.db_path).st_size, stat.st_size)
+        self.assertNotEqual(DocumentStore(self.db_path).revision, self.store.revision)
+        # Stesso contenuto: stessa revisione anche tra riavvii
+        self.assertEqual(DocumentStore(self.db_path).revision, DocumentStore(self.db_path).revision)
+
+    def test_commit_refuses_to_overwrite_changes_from_another_instance(self):
+        other = DocumentStore(self.db_path)
+        first = copy.deepcopy(self.store.get("CC-L1-T1-C1-Art.1"))
+        first["text"] = "Modifica della prima istanza."
+        self.store.commit(upserts=self.store.prepare_upsert([first]))
+        second = copy.deepcopy(other.get("CC-L4-T9-C1-Art.2043"))
+        second["text"] = "Modifica della seconda istanza."
+        with self.assertRaises(StaleDatabaseError):
+            other.commit(upserts=other.prepare_upsert([second]))
+        self.assertEqual(other.version, 0)
+        # Ricaricato il file, la seconda modifica si applica senza perdere la prima
+        other = DocumentStore(self.db_path)
+        other.commit(upserts=other.prepare_upsert([second]))
+        reloaded = DocumentStore(self.db_path)
+        self.assertEqual(reloaded.get(first["id"])["text"], first["text"])
+        self.assertEqual(reloaded.get(second["id"])["text"], second["text"])
+
+    def test_upsert_rejects_missing_reference(self):
+        sentenza = copy.deepcopy(self.store.get("Cass-Civ-12345-2020"))
+        sentenza["structure"]["riferimenti"] = ["CC-Inesistente"]
+        with self.assertRaises(ValueError):
+            self.store.prepare_upsert([sentenza])
+
+    def test_delete_refuses_cited_documents(self):
+        with self.assertRaises(ValueError):
+            self.store.prepare_delete(["CC-L4-T9-C1-Art.2051"])
+        ids = self.store.prepare_delete(["Cass-Civ-12345-2020", "CC-L4-T9-C1-Art.2051"])
+        self.store.commit(deletes=ids)
+        self.assertEqual(self.store.citing("CC-L4-T9-C1-Art.2051"), [])
+        self.assertEqual(len(self.store), 4)
+
+
+class TestDocumentColumns(unittest.TestCase):
+    def test_concurrent_reads_during_appends(self):
+        columns = DocumentColumns()
+        entry = lambda i: {"id": f"CC-{i}", "type": "legge", "text": f"Testo {i} " * (i % 7 + 1),
+                           "context": "Codice Civile", "structure": {"articolo": str(i)}}
+        published = [0]
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                # Le righe appena pubblicate costringono a rimappare il file
+                row = published[0] - 1
+                try:
+                    if published[0] and (columns.text(row) != entry(row)["text"]
+                                         or columns.extra(row)["structure"]["articolo"] != str(row)):
+                        errors.append(row)
+                except Exception as e:
+                    errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for reader in readers:
+                reader.start()
+            for i in range(5000):
+                columns.append(entry(i))
+                published[0] = i + 1
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
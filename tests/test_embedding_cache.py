@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.embedding_cache import EmbeddingCache
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.calls = []
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        return np.array([[len(t), i] for i, t in enumerate(texts)], dtype="float32")
+
+    def test_only_new_texts_are_encoded(self):
+        cache = EmbeddingCache(self.cache_dir, "test-model")
+        keys = cache.encode_missing(["uno", "due"], self.encode)
+        cache.flush(keep=keys)
+
+        reloaded = EmbeddingCache(self.cache_dir, "test-model")
+        keys = reloaded.encode_missing(["uno", "tre"], self.encode)
+        reloaded.flush(keep=keys)
+
+        self.assertEqual(self.calls, [["uno", "due"], ["tre"]])
+        self.assertEqual(len(reloaded), 2)
+        self.assertEqual(reloaded.get(keys).shape, (2, 2))
+
+    def test_pending_vectors_are_served_without_rewriting_the_file(self):
+        cache = EmbeddingCache(self.cache_dir, "test-model")
+        keys = cache.encode_missing([f"testo {i}" for i in range(8)], self.encode)
+        cache.flush()
+        size = os.path.getsize(cache.vectors_path)
+        new = cache.encode_missing(["nuovo"], self.encode)
+        np.testing.assert_array_equal(cache.get(keys[:1] + new), [[7, 0], [5, 0]])
+        self.assertEqual(os.path.getsize(cache.vectors_path), size)
+        # Il flush aggiunge solo la riga nuova in coda
+        cache.flush()
+        self.assertEqual(os.path.getsize(cache.vectors_path), size + 2 * 4)
+        np.testing.assert_array_equal(EmbeddingCache(self.cache_dir, "test-model").get(new), [[5, 0]])
+
+    def test_discarded_vectors_are_compacted_past_the_threshold(self):
+        cache = EmbeddingCache(self.cache_dir, "test-model")
+        keys = cache.encode_missing([f"testo {i}" for i in range(8)], self.encode)
+        cache.flush()
+        cache.discard(keys[:2])
+        cache.flush()
+        self.assertEqual(os.path.getsize(cache.vectors_path), 8 * 2 * 4)
+        cache.discard(keys[2:3])
+        cache.flush()
+        self.assertEqual(os.path.getsize(cache.vectors_path), 5 * 2 * 4)
+        reloaded = EmbeddingCache(self.cache_dir, "test-model")
+        self.assertEqual(len(reloaded), 5)
+        np.testing.assert_array_equal(reloaded.get(keys[3:]), cache.get(keys[3:]))
+
+    def test_unconfirmed_tail_is_truncated(self):
+        cache = EmbeddingCache(self.cache_dir, "test-model")
+        keys = cache.encode_missing(["uno", "due"], self.encode)
+        cache.flush()
+        with open(cache.vectors_path, "ab") as f:
+            f.write(b"\x00" * 6)
+        reloaded = EmbeddingCache(self.cache_dir, "test-model")
+        self.assertEqual(reloaded.get(keys).shape, (2, 2))
+        self.assertEqual(os.path.getsize(cache.vectors_path), 2 * 2 * 4)
+
+    def test_instances_sharing_a_directory_stay_consistent(self):
+        first = EmbeddingCache(self.cache_dir, "test-model")
+        keys = first.encode_missing([f"testo {i}" for i in range(8)], self.encode)
+        first.flush()
+        expected = np.array(first.get(keys))
+
+        # Un'altra istanza aggiunge e compatta: i file vengono riscritti senza le chiavi che ha scartato
+        second = EmbeddingCache(self.cache_dir, "test-model")
+        other = second.encode_missing(["altro"], self.encode)
+        second.discard(keys[:5])
+        second.flush()
+        self.assertEqual(os.path.getsize(second.vectors_path), 4 * 2 * 4)
+
+        new = first.encode_missing(["nuovo"], self.encode)
+        first.flush()
+        np.testing.assert_array_equal(first.get(keys), expected)
+        np.testing.assert_array_equal(first.get(other + new), [[5, 0], [5, 0]])
+        # Le chiavi ancora vive per la prima istanza sono state riaggiunte in coda
+        reloaded = EmbeddingCache(self.cache_dir, "test-model")
+        np.testing.assert_array_equal(reloaded.get(keys), expected)
+        self.assertEqual(len(reloaded), 10)
+
+    def test_scope_separates_corpora(self):
+        first = EmbeddingCache(self.cache_dir, "test-model", scope="a.json")
+        second = EmbeddingCache(self.cache_dir, "test-model", scope="b.json")
+        self.assertNotEqual(first.dir, second.dir)
+        keys = second.encode_missing(["uno"], self.encode)
+        second.flush()
+        first.encode_missing(["due"], self.encode)
+        first.flush(keep=[])
+        np.testing.assert_array_equal(EmbeddingCache(self.cache_dir, "test-model", scope="b.json").get(keys), [[3, 0]])
+
+    def test_model_name_is_part_of_the_key(self):
+        EmbeddingCache(self.cache_dir, "model-a").encode_missing(["uno"], self.encode)
+        EmbeddingCache(self.cache_dir, "model-b").encode_missing(["uno"], self.encode)
+        self.assertEqual(len(self.calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+from src.legal_terms import AhoCorasick, LegalTermMatcher
+
+
+class TestAhoCorasick(unittest.TestCase):
+    def test_overlapping_patterns(self):
+        automaton = AhoCorasick((word, word) for word in ("he", "she", "his", "hers"))
+        self.assertEqual(list(automaton.iter_matches("ushers")), ["she", "he", "hers"])
+
+
+class TestLegalTermMatcher(unittest.TestCase):
+    def setUp(self):
+        self.matcher = LegalTermMatcher()
+
+    def test_extracts_single_and_multi_word_terms(self):
+        terms = self.matcher.extract("Responsabilità civile per i danni delle cose in custodia")
+        self.assertEqual(terms, ["responsabilità", "responsabilità civile", "danno", "custodia"])
+
+    def test_matches_whole_tokens_only(self):
+        self.assertNotIn("pena", self.matcher.term_set("Il codice penale"))
+        self.assertIn("pena", self.matcher.term_set("La pena è ridotta"))
+
+
+if __name__ == "__main__":
+    unittest.main()
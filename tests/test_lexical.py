@@ -0,0 +1,33 @@
+import unittest
+
+from src.lexical import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+class TestLexical(unittest.TestCase):
+    def test_tokenize_stems_and_keeps_article_numbers(self):
+        self.assertEqual(tokenize("La capacità giuridica"), tokenize("capacità giuridico"))
+        self.assertIn("2043", tokenize("CC-L4-T9-C1-Art.2043"))
+        self.assertNotIn("la", tokenize("La capacità"))
+
+    def test_bm25_ranking_and_incremental_updates(self):
+        index = BM25Index()
+        index.add(1, "La capacità giuridica si acquista al momento della nascita.")
+        index.add(2, "Chiunque cagiona ad altri un danno ingiusto è tenuto a risarcire il danno.")
+        index.add(3, "Procedura di emergenza per incendio.")
+        self.assertEqual(index.search("capacità giuridica", k=1)[0][0], 1)
+        self.assertEqual(index.search("risarcimento danno", k=1)[0][0], 2)
+
+        index.remove(2)
+        self.assertEqual(index.search("danno"), [])
+        index.add(3, "Testo aggiornato sul danno")
+        self.assertEqual([label for label, _ in index.search("danno")], [3])
+        self.assertEqual(len(index), 2)
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]])
+        self.assertEqual(fused[0], 1)
+        self.assertEqual(set(fused), {1, 2, 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from src.llm import LLM, PROMPT_PREFIX, StubBackend, get_backend
+
+
+class TestStubBackend(unittest.TestCase):
+    def setUp(self):
+        self.llm = LLM(backend="stub")
+
+    def test_stub_echoes_context_deterministically(self):
+        context = "- CC-L1-T1-C1-Art.1: La capacità giuridica si acquista al momento della nascita."
+        first = self.llm.generate_response("capacità giuridica", context)
+        self.assertIn(context, first)
+        self.assertEqual(first, self.llm.generate_response("capacità giuridica", context))
+
+    def test_stream_matches_batch(self):
+        context = "- Proc-Emerg-Incendio-001:\n  Evacuare l'edificio."
+        streamed = "".join(self.llm.generate_stream("incendio", context))
+        self.assertEqual(streamed, self.llm.generate_response("incendio", context))
+
+    def test_prompt_starts_with_constant_prefix(self):
+        prompt = self.llm.build_prompt("capacità giuridica", "- CC-L1-T1-C1-Art.1: testo")
+        self.assertTrue(prompt.startswith(PROMPT_PREFIX))
+        self.assertNotIn("capacità giuridica", PROMPT_PREFIX)
+
+    def test_backend_is_shared_and_validated(self):
+        self.assertIsInstance(self.llm.backend, StubBackend)
+        self.assertIs(get_backend("stub"), self.llm.backend)
+        with self.assertRaises(ValueError):
+            get_backend("inesistente")
+
+
+if __name__ == "__main__":
+    unittest.main()
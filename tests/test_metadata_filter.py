@@ -0,0 +1,64 @@
+import unittest
+
+from src.metadata_filter import MetadataIndex, filters_from_entities
+
+
+def entry(id, tipo, context, **structure):
+    return {"id": id, "type": tipo, "text": "", "context": context, "structure": structure}
+
+
+class TestMetadataIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = MetadataIndex()
+        self.docs = [
+            entry("CC-1", "legge", "Codice Civile, Contratti", codice="Codice Civile", data_vigore="1942-04-21"),
+            entry("CC-2", "legge", "Codice Civile, Obbligazioni", codice="Codice Civile", data_vigore="2020-01-01"),
+            entry("CP-1", "legge", "Codice Penale, Reati", codice="Codice Penale"),
+            entry("Proc-1", "procedura", "Procedura di emergenza", evento="Incendio"),
+        ]
+        for label, doc in enumerate(self.docs):
+            self.index.add(label, doc)
+
+    def labels(self, filters):
+        return [int(label) for label in self.index.mask(filters).nonzero()[0]]
+
+    def test_fields_are_combined_case_insensitively(self):
+        self.assertEqual(self.labels({"type": "legge", "codice": "codice civile"}), [0, 1])
+        self.assertEqual(self.labels({"codice": ["Codice Penale", "codice civile"]}), [0, 1, 2, 3])
+        self.assertEqual(self.labels({"evento": "incendio", "context": "procedura di emergenza"}), [3])
+
+    def test_structure_fields_only_filter_documents_that_have_them(self):
+        self.docs.append(entry("Cass-1", "sentenza", "Giurisprudenza, Responsabilità civile", numero="1"))
+        self.index.add(4, self.docs[4])
+        # Sentenze e procedure non hanno ``codice``: il filtro scarta solo gli altri codici
+        self.assertEqual(self.labels({"codice": "codice civile"}), [0, 1, 3, 4])
+        self.assertEqual(self.labels({"codice": "codice civile", "type": "sentenza"}), [4])
+        self.assertEqual(self.labels({"evento": "incendio", "type": "legge"}), [0, 1, 2])
+
+    def test_date_range(self):
+        self.assertEqual(self.labels({"data_vigore": ("2000-01-01", None)}), [1])
+        self.assertEqual(self.labels({"data_vigore": (None, "1999-12-31")}), [0])
+
+    def test_plan_relaxes_too_selective_filters(self):
+        applied, mask, matches, relaxed = self.index.plan({"type": "legge", "codice": "codice penale"}, 2)
+        self.assertEqual((applied, matches, relaxed), ({"type": "legge"}, 3, ["codice"]))
+        applied, mask, matches, relaxed = self.index.plan({"type": "circolare"}, 1)
+        self.assertIsNone(mask)
+        self.assertEqual(relaxed, ["type"])
+
+    def test_remove_and_unknown_field(self):
+        self.index.remove(1)
+        self.assertEqual(self.labels({"codice": "codice civile"}), [0, 3])
+        self.assertEqual(len(self.index), 3)
+        with self.assertRaises(ValueError):
+            self.index.mask({"anno": "2020"})
+
+    def test_filters_from_entities(self):
+        entities = {"codice": "codice civile", "articolo": "2043", "tipo": None, "evento": None}
+        self.assertEqual(filters_from_entities(entities), {"codice": "codice civile"})
+        entities = {"codice": "codice penale", "codici": ["codice penale", "codice civile"]}
+        self.assertEqual(filters_from_entities(entities), {"codice": ["codice penale", "codice civile"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+import unittest
+
+from src.metrics import NOOP, JSONLogExporter, Metrics, PrometheusExporter, TOKEN_BUCKETS
+
+
+class TestMetrics(unittest.TestCase):
+    def test_trace_collects_nested_spans(self):
+        metrics = Metrics()
+        trace = metrics.trace("process")
+        with trace.activate():
+            with trace.span("parse"):
+                pass
+            # Span creato altrove (es. nel Retriever) senza riferimento esplicito alla trace
+            with metrics.span("semantic_search"):
+                pass
+        trace.set(outcome="generated")
+        trace.finish()
+
+        exported = metrics.exporter.traces[-1]
+        self.assertEqual(set(exported["spans"]), {"parse", "semantic_search"})
+        self.assertEqual(exported["outcome"], "generated")
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(counters, [{"name": "requests_total", "labels": {"kind": "process", "outcome": "generated",
+                                                                         "status": "ok"}, "value": 1}])
+        with metrics.span("orphan"):
+            pass
+        self.assertEqual(len(metrics.exporter.traces), 1)
+
+    def test_prometheus_text_format(self):
+        metrics = Metrics(exporter=PrometheusExporter())
+        metrics.inc("answer_cache_lookups_total", result="hit")
+        metrics.observe("prompt_tokens", 100, buckets=TOKEN_BUCKETS)
+        metrics.observe("prompt_tokens", 10000, buckets=TOKEN_BUCKETS)
+        text = metrics.render()
+        self.assertIn("# TYPE legalai_answer_cache_lookups_total counter", text)
+        self.assertIn('legalai_answer_cache_lookups_total{result="hit"} 1', text)
+        self.assertIn('legalai_prompt_tokens_bucket{le="128"} 1', text)
+        self.assertIn('legalai_prompt_tokens_bucket{le="+Inf"} 2', text)
+        self.assertIn("legalai_prompt_tokens_count 2", text)
+
+    def test_json_log_exporter(self):
+        metrics = Metrics(exporter=JSONLogExporter())
+        with self.assertLogs(level="INFO") as logs:
+            trace = metrics.trace("process")
+            with trace.span("generation"):
+                pass
+            trace.finish()
+        self.assertEqual(json.loads(logs.records[-1].getMessage())["trace"], "process")
+
+    def test_disabled_is_noop(self):
+        metrics = Metrics(enabled=False)
+        self.assertIs(metrics.trace("process"), NOOP)
+        self.assertIs(metrics.span("parse"), NOOP)
+        metrics.inc("requests_total")
+        metrics.observe("stage_seconds", 1.0)
+        self.assertEqual(metrics.snapshot(), {"counters": [], "histograms": []})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from src.query_parser import QueryParser
+
+
+class TestQueryParser(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.parser = QueryParser()
+
+    def test_code_and_article(self):
+        entities = self.parser.parse("Cosa dice l'art. 2043 del Codice Civile?")["entities"]
+        self.assertEqual(entities["codice"], "codice civile")
+        self.assertEqual(entities["articolo"], "2043")
+        self.assertEqual(self.parser.parse("articolo 3 codice penale")["entities"]["articolo"], "3")
+        self.assertEqual(self.parser.parse("art.2043")["entities"]["articolo"], "2043")
+
+    def test_inline_article_is_case_insensitive(self):
+        self.assertEqual(self.parser.parse("Art.1 del codice civile")["entities"]["articolo"], "1")
+        self.assertEqual(self.parser.parse("ART.2043")["entities"]["articolo"], "2043")
+
+    def test_type_event_and_intent(self):
+        result = self.parser.parse("Confronta le sentenze sugli incendi")
+        self.assertEqual(result["intent"], "compare")
+        self.assertEqual(result["entities"]["tipo"], "sentenza")
+        self.assertEqual(result["entities"]["evento"], "Incendio")
+        result = self.parser.parse("codice di procedura civile")
+        self.assertEqual(result["entities"]["codice"], "codice di procedura civile")
+        self.assertIsNone(result["entities"]["tipo"])
+        self.assertEqual(self.parser.parse("Quando si acquista la capacità giuridica?")["intent"], "info")
+
+    def test_all_codes_are_collected(self):
+        entities = self.parser.parse("Differenze tra codice penale e codice civile")["entities"]
+        self.assertEqual(entities["codici"], ["codice penale", "codice civile"])
+        self.assertEqual(entities["codice"], "codice penale")
+
+    def test_parse_batch_keeps_order(self):
+        queries = ["procedura in caso di incendio", "differenze tra circolari", "ciao"]
+        self.assertEqual(self.parser.parse_batch(queries), [self.parser.parse(q) for q in queries])
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            QueryParser(mode="regex")
+
+
+if __name__ == "__main__":
+    unittest.main()
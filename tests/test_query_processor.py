@@ -0,0 +1,53 @@
+import os
+import unittest
+from unittest import mock
+
+from src.query_processor import QueryProcessor
+
+
+class TestQueryProcessorStub(unittest.TestCase):
+    """Pipeline completa con il backend stub: nessuna GPU né modello generativo richiesto"""
+
+    def setUp(self):
+        with mock.patch.dict(os.environ, {"LEGALAI_LLM_BACKEND": "stub"}):
+            self.processor = QueryProcessor()
+
+    def test_greeting(self):
+        self.assertIn("LegalAI", self.processor.process("ciao"))
+
+    def test_greeting_stream(self):
+        self.assertEqual("".join(self.processor.process_stream("salve")), self.processor.process("salve"))
+
+    def test_process_answers_with_context(self):
+        response = self.processor.process("Cosa dice CC-L1-T1-C1-Art.1?")
+        self.assertIsInstance(response, str)
+        self.assertTrue(response)
+
+    def test_check_ambiguity_terms_across_contexts(self):
+        docs = [
+            {"id": "A", "type": "legge", "text": "Il risarcimento del danno.", "context": "Codice Civile, Obbligazioni", "structure": {}},
+            {"id": "B", "type": "sentenza", "text": "Danni da reato.", "context": "Codice Penale, Reati", "structure": {}},
+        ]
+        info = self.processor.check_ambiguity("Come si calcola il danno?", docs)
+        self.assertEqual(info["reason"], "termini_ambigui")
+        self.assertEqual(info["conflicts"], {"danno": ["Codice Civile, Obbligazioni", "Codice Penale, Reati"]})
+
+    def test_process_batch_keeps_order_and_isolates_errors(self):
+        search_batch = self.processor.retriever.search_batch
+
+        def failing_search(queries, embeddings=None, filters=None):
+            if "rotta" in queries:
+                raise ValueError("ricerca non riuscita")
+            return search_batch(queries, embeddings, filters=filters)
+
+        with mock.patch.object(self.processor.retriever, "search_batch", side_effect=failing_search):
+            results = list(self.processor.process_batch(["ciao", "rotta", "buongiorno"], batch_size=2))
+        self.assertEqual([result["index"] for result in results], [0, 1, 2])
+        self.assertIn("LegalAI", results[0]["response"])
+        self.assertIn("ValueError", results[1]["error"])
+        self.assertIsNone(results[1]["response"])
+        self.assertIsNone(results[2]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import threading
+import time
+import unittest
+
+from src.registry import ResourceRegistry
+
+
+class TestResourceRegistry(unittest.TestCase):
+    def test_concurrent_get_builds_once(self):
+        registry = ResourceRegistry()
+        calls = []
+
+        def factory():
+            calls.append(1)
+            time.sleep(0.05)
+            return object()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get("model", factory))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertIn("load_seconds", registry.stats()["model"])
+
+    def test_clear_forces_reload(self):
+        registry = ResourceRegistry()
+        first = registry.get("db", object)
+        registry.clear("db")
+        self.assertIsNot(registry.get("db", object), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,14 @@
+import copy
+import os
+import shutil
+import tempfile
 import unittest
-from src.retrieval import Retriever
+from unittest import mock
+
+from src.metadata_filter import filters_from_entities
+from src.query_parser import QueryParser
+from src.registry import registry
+from src.retrieval import Retriever, get_retriever
 
 class TestRetrieval(unittest.TestCase):
     def setUp(self):
@@ -14,5 +23,106 @@ class TestRetrieval(unittest.TestCase):
         results = self.retriever.search_semantic("capacità giuridica")
         self.assertTrue(any("CC-L1-T1-C1-Art.1" in r["id"] for r in results))
 
+    def test_search_direct_reference_includes_citations(self):
+        results = self.retriever.search("Cosa dice CC-L4-T9-C1-Art.2051?")
+        ids = [r["id"] for r in results]
+        self.assertEqual(ids[0], "CC-L4-T9-C1-Art.2051")
+        self.assertIn("Cass-Civ-12345-2020", ids)
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_search_hybrid_reports_timings(self):
+        results, timings = self.retriever.search_hybrid("capacità giuridica", k=3)
+        self.assertEqual(results[0]["id"], "CC-L1-T1-C1-Art.1")
+        self.assertEqual(set(timings), {"encode_ms", "dense_ms", "lexical_ms", "fusion_ms"})
+
+    def test_search_batch_matches_search(self):
+        queries = ["capacità giuridica", "Cosa dice CC-L4-T9-C1-Art.2051?", "incendio", "capacità giuridica"]
+        self.assertEqual(self.retriever.search_batch(queries), [self.retriever.search(q) for q in queries])
+
+    def test_filtered_search_only_returns_matching_documents(self):
+        results, timings = self.retriever.search_hybrid("responsabilità", k=6, filters={"codice": "codice civile"})
+        # Il codice filtra solo le leggi: sentenze e procedure, che non hanno il campo, restano
+        self.assertEqual({r["id"] for r in results}, {"CC-L4-T9-C1-Art.2043", "CC-L4-T9-C1-Art.2051", "CC-L1-T1-C1-Art.1",
+                                                     "Cass-Civ-12345-2020", "Proc-Emerg-Incendio-001"})
+        self.assertEqual(timings["filter"]["relaxed"], [])
+        self.assertAlmostEqual(timings["filter"]["selectivity"], 5 / 6, places=5)
+        # Solo sentenza e procedura ammesse dal codice di procedura civile: filtro rimosso
+        results, timings = self.retriever.search_hybrid("responsabilità", k=3, filters={"codice": "codice di procedura civile"})
+        self.assertEqual(timings["filter"]["relaxed"], ["codice"])
+        self.assertEqual(len(results), 3)
+
+    def test_parsed_code_filter_keeps_case_law_and_compared_codes(self):
+        parser = QueryParser()
+        query = "responsabilità per le cose in custodia secondo il codice civile"
+        filters = filters_from_entities(parser.parse(query)["entities"])
+        self.assertIn("Cass-Civ-12345-2020", [r["id"] for r in self.retriever.search(query, filters=filters)])
+        query = "Differenze tra codice penale e codice civile"
+        filters = filters_from_entities(parser.parse(query)["entities"])
+        results, timings = self.retriever.search_hybrid(query, k=6, filters=filters)
+        ids = [r["id"] for r in results]
+        self.assertIn("CP-L1-T1-C1-Art.1", ids)
+        self.assertIn("CC-L1-T1-C1-Art.1", ids)
+        self.assertEqual(timings["filter"]["applied"], {"codice": ["codice penale", "codice civile"]})
+
+    def test_search_batch_with_filters_matches_search(self):
+        queries = ["capacità giuridica", "danno", "incendio"]
+        filters = [{"codice": "codice civile"}, None, {"type": "procedura"}]
+        self.assertEqual(self.retriever.search_batch(queries, filters=filters),
+                         [self.retriever.search(q, filters=f) for q, f in zip(queries, filters)])
+
+
+class TestRetrieverUpdates(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "database.json")
+        shutil.copy("data/database.json", self.db_path)
+        self.retriever = Retriever(self.db_path, cache_dir=os.path.join(self.tmp_dir, "cache"))
+
+    def tearDown(self):
+        self.retriever.store.columns.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_repeated_upserts_keep_labels_bounded(self):
+        n_docs = len(self.retriever.store)
+        doc = copy.deepcopy(self.retriever.store.get("CC-L1-T1-C1-Art.1"))
+        for i in range(100):
+            doc["text"] = f"La capacità giuridica, versione {i}."
+            self.retriever.upsert([doc])
+        labels = set(self.retriever.store.rows())
+        self.assertLessEqual(max(labels), n_docs)
+        self.assertEqual(self.retriever.index.ntotal, n_docs)
+        self.assertEqual(set(self.retriever.lexical.doc_terms), labels)
+        self.assertEqual(len(self.retriever.metadata), n_docs)
+        self.assertEqual(self.retriever.metadata.capacity, 1024)
+        results = self.retriever.search_semantic("capacità giuridica versione 99")
+        self.assertEqual(results[0]["text"], doc["text"])
+
+    def test_failed_cache_write_leaves_database_and_index_unchanged(self):
+        with open(self.db_path, encoding="utf-8") as f:
+            saved = f.read()
+        doc = copy.deepcopy(self.retriever.store.get("CC-L1-T1-C1-Art.1"))
+        doc["text"] = "Testo che non arriva al database."
+        with mock.patch.object(self.retriever.cache, "flush", side_effect=OSError("disco pieno")):
+            with self.assertRaises(OSError):
+                self.retriever.upsert([doc])
+        with open(self.db_path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), saved)
+        self.assertEqual(self.retriever.version, 0)
+        self.assertEqual(self.retriever.index.ntotal, len(self.retriever.store))
+        self.assertNotEqual(self.retriever.store.get(doc["id"])["text"], doc["text"])
+
+
+class TestGetRetriever(unittest.TestCase):
+    def tearDown(self):
+        for key in [key for key in registry.stats() if key.startswith("retriever:test.json")]:
+            registry.clear(key)
+
+    def test_key_includes_model_and_index_config(self):
+        with mock.patch("src.retrieval.Retriever", side_effect=lambda *args, **kwargs: object()):
+            flat = get_retriever("test.json")
+            self.assertIs(get_retriever("test.json", index_config={"kind": "flat"}), flat)
+            self.assertIsNot(get_retriever("test.json", index_config={"kind": "hnsw"}), flat)
+            self.assertIsNot(get_retriever("test.json", model_name="altro-modello"), flat)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,101 @@
+import threading
+import time
+import unittest
+
+from src.scheduler import GenerationScheduler, QueueFullError
+
+
+class TestGenerationScheduler(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate_batch(self, prompts):
+        self.release.wait()
+        self.batches.append(list(prompts))
+        return [p.upper() for p in prompts]
+
+    def make(self, **kwargs):
+        scheduler = GenerationScheduler(self.generate_batch, lambda p: len(p.split()), **kwargs)
+        self.addCleanup(scheduler.shutdown)
+        return scheduler
+
+    def test_concurrent_requests_are_batched_in_order(self):
+        scheduler = self.make(max_batch_size=4, max_wait=0.2)
+        futures = [scheduler.submit(f"domanda {i}") for i in range(4)]
+        self.assertEqual([f.result(5) for f in futures], [f"DOMANDA {i}" for i in range(4)])
+        self.assertEqual(self.batches, [[f"domanda {i}" for i in range(4)]])
+        self.assertEqual(scheduler.stats()["batch_size_max"], 4)
+
+    def test_token_budget_limits_batch(self):
+        scheduler = self.make(max_batch_size=8, max_batch_tokens=6, max_wait=0.2)
+        futures = [scheduler.submit("a b c") for _ in range(3)]
+        for f in futures:
+            f.result(5)
+        self.assertEqual([len(b) for b in self.batches], [2, 1])
+
+    def test_queue_full_timeout_and_cancel(self):
+        self.release.clear()
+        scheduler = self.make(max_queue=2, max_batch_size=1, max_wait=0)
+        running = scheduler.submit("primo")
+        time.sleep(0.05)
+        expiring = scheduler.submit("secondo", timeout=0.01)
+        cancelled = scheduler.submit("terzo")
+        with self.assertRaises(QueueFullError):
+            scheduler.submit("quarto")
+        self.assertTrue(cancelled.cancel())
+        time.sleep(0.05)
+        self.release.set()
+
+        self.assertEqual(running.result(5), "PRIMO")
+        with self.assertRaises(TimeoutError):
+            expiring.result(5)
+        stats = scheduler.stats()
+        self.assertEqual((stats["rejected"], stats["timed_out"], stats["cancelled"]), (1, 1, 1))
+
+    def test_stream_goes_through_the_queue(self):
+        scheduler = GenerationScheduler(self.generate_batch, lambda p: len(p.split()),
+                                        generate_stream=lambda p: (w for w in p.upper().split()))
+        self.addCleanup(scheduler.shutdown)
+        self.assertEqual(list(scheduler.stream("uno due tre")), ["UNO", "DUE", "TRE"])
+        stats = scheduler.stats()
+        self.assertEqual((stats["submitted"], stats["completed"], stats["streams"]), (1, 1, 1))
+
+    def test_closing_stream_stops_generation(self):
+        produced = []
+        closed = threading.Event()
+
+        def generate_stream(prompt):
+            try:
+                for i in range(1000):
+                    produced.append(i)
+                    time.sleep(0.01)
+                    yield str(i)
+            finally:
+                closed.set()
+
+        scheduler = GenerationScheduler(self.generate_batch, lambda p: 1, generate_stream=generate_stream)
+        self.addCleanup(scheduler.shutdown)
+        stream = scheduler.stream("domanda")
+        self.assertEqual(next(stream), "0")
+        stream.close()
+        self.assertTrue(closed.wait(5))
+        self.assertLess(len(produced), 1000)
+        # Il worker è di nuovo libero per le richieste successive
+        self.assertEqual(scheduler.generate("dopo", timeout=5), "DOPO")
+        self.assertEqual(scheduler.stats()["cancelled"], 1)
+
+    def test_stream_timeout(self):
+        def generate_stream(prompt):
+            time.sleep(0.5)
+            yield "tardi"
+
+        scheduler = GenerationScheduler(self.generate_batch, lambda p: 1, generate_stream=generate_stream)
+        self.addCleanup(scheduler.shutdown)
+        with self.assertRaises(TimeoutError):
+            list(scheduler.stream("domanda", timeout=0.05))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+import time
+import unittest
+from unittest import mock
+
+from src.query_processor import QueryProcessor
+from src.server import QueryService
+
+
+async def request(port, method, path, payload=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    if b"Transfer-Encoding: chunked" in head:
+        lines, rest = [], body
+        while True:
+            size, _, rest = rest.partition(b"\r\n")
+            if int(size, 16) == 0:
+                break
+            lines.append(json.loads(rest[:int(size, 16)]))
+            rest = rest[int(size, 16) + 2:]
+        return status, lines
+    return status, json.loads(body) if body.startswith(b"{") else body.decode()
+
+
+class SlowProcessor:
+    def process(self, query):
+        time.sleep(0.3)
+        return query
+
+
+class VerySlowProcessor:
+    def process(self, query):
+        time.sleep(1.0)
+        return query
+
+
+class TestQueryService(unittest.TestCase):
+    def serve(self, scenario, **kwargs):
+        async def main():
+            service = QueryService(**kwargs)
+            server = await service.start("127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                while service.processor is None and service.load_error is None:
+                    await asyncio.sleep(0.01)
+                return await scenario(port)
+            finally:
+                server.close()
+                await server.wait_closed()
+                service.close()
+
+        return asyncio.run(main())
+
+    def test_endpoints_with_stub_backend(self):
+        async def scenario(port):
+            status, health = await request(port, "GET", "/health")
+            self.assertEqual((status, health["models"]), (200, "loaded"))
+            self.assertEqual((await request(port, "GET", "/ready"))[0], 200)
+            status, body = await request(port, "POST", "/query", {"query": "ciao"})
+            self.assertEqual(status, 200)
+            self.assertIn("LegalAI", body["response"])
+            status, lines = await request(port, "POST", "/query/stream", {"query": "salve"})
+            self.assertEqual(lines[-1], {"done": True})
+            self.assertIn("LegalAI", "".join(line.get("chunk", "") for line in lines))
+            status, lines = await request(port, "POST", "/batch", {"queries": ["ciao", "buongiorno"]})
+            self.assertEqual([line["index"] for line in lines], [0, 1])
+            self.assertEqual((await request(port, "POST", "/query", {}))[0], 400)
+            self.assertEqual((await request(port, "GET", "/inesistente"))[0], 404)
+            status, text = await request(port, "GET", "/metrics")
+            self.assertIn("legalai_http_requests_total", text)
+
+        with mock.patch.dict(os.environ, {"LEGALAI_LLM_BACKEND": "stub"}):
+            self.serve(scenario, processor_factory=QueryProcessor)
+
+    def test_backpressure_rejects_when_full(self):
+        async def scenario(port):
+            results = await asyncio.gather(
+                request(port, "POST", "/query", {"query": "a"}),
+                request(port, "POST", "/query", {"query": "b"}),
+            )
+            self.assertEqual(sorted(status for status, _ in results), [200, 503])
+
+        self.serve(scenario, processor_factory=SlowProcessor, max_concurrency=1, max_pending=0)
+
+    def test_timeout(self):
+        async def scenario(port):
+            self.assertEqual((await request(port, "POST", "/query", {"query": "a"}))[0], 504)
+
+        self.serve(scenario, processor_factory=SlowProcessor, timeout=0.05)
+
+
+    def test_timed_out_requests_keep_their_slot_until_the_thread_ends(self):
+        async def scenario(port):
+            statuses = [(await request(port, "POST", "/query", {"query": str(i)}))[0] for i in range(8)]
+            # Due thread ancora al lavoro occupano i posti: le richieste successive sono respinte
+            self.assertEqual(statuses, [504, 504] + [503] * 6)
+
+        self.serve(scenario, processor_factory=VerySlowProcessor, max_concurrency=2, max_pending=0, timeout=0.1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import copy
+import json
+import os
+import tempfile
+import unittest
+
+from src import utils
+from src.utils import load_database, load_database_with_stats
+
+
+class TestLoadDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open("data/database.json", encoding="utf-8") as f:
+            self.entries = json.load(f)
+
+    def write(self, name, entries, jsonl=False, directory=None):
+        path = os.path.join(directory or self.tmp_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            if jsonl:
+                f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+            else:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+        return path
+
+    def test_json_jsonl_and_shards_load_the_same_entries(self):
+        expected = [e["id"] for e in self.entries]
+        self.assertEqual([e["id"] for e in load_database("data/database.json")], expected)
+        self.assertEqual([e["id"] for e in load_database(self.write("db.jsonl", self.entries, jsonl=True))], expected)
+
+        shard_dir = os.path.join(self.tmp_dir, "shards")
+        os.mkdir(shard_dir)
+        self.write("000.jsonl", self.entries[:3], jsonl=True, directory=shard_dir)
+        self.write("001.json", self.entries[3:], directory=shard_dir)
+        data, stats = load_database_with_stats(shard_dir)
+        self.assertEqual([e["id"] for e in data], expected)
+        self.assertEqual(stats["entries"], len(expected))
+
+    def test_streaming_parser_handles_small_chunks(self):
+        with open("data/database.json", encoding="utf-8") as f:
+            streamed = list(utils._iter_json_array(f, chunk_size=7))
+        self.assertEqual(streamed, self.entries)
+
+    def test_reference_checked_after_full_pass(self):
+        # La sentenza precede l'articolo citato: valido perché il controllo è differito
+        sentenza = next(e for e in self.entries if e["type"] == "sentenza")
+        others = [e for e in self.entries if e is not sentenza]
+        self.assertEqual(len(load_database(self.write("ordered.json", [sentenza] + others))), len(self.entries))
+
+        broken = copy.deepcopy(sentenza)
+        broken["structure"]["riferimenti"] = ["CC-Inesistente"]
+        with self.assertRaises(ValueError):
+            load_database(self.write("broken.json", others + [broken]))
+        with self.assertRaises(ValueError):
+            load_database(self.write("duplicate.json", self.entries + self.entries[:1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+import numpy as np
+
+from src.vector_index import build_index, evaluate_indexes, normalize_config
+
+
+class TestVectorIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.normal(size=(2000, 32)).astype("float32")
+        self.queries = self.embeddings[:50] + rng.normal(0, 0.01, (50, 32)).astype("float32")
+
+    def test_all_kinds_build_and_search(self):
+        for kind in ("flat", "ivf_flat", "ivf_pq", "hnsw"):
+            index = build_index(self.embeddings, {"kind": kind})
+            self.assertEqual(index.ntotal, len(self.embeddings))
+            _, found = index.search(self.queries[:1], 5)
+            self.assertEqual(found.shape, (1, 5))
+
+    def test_recall_report_against_flat(self):
+        report = evaluate_indexes(self.embeddings, self.queries, [{"kind": "flat"}, {"kind": "hnsw"}], k=10)
+        self.assertEqual(report[0]["recall@10"], 1.0)
+        self.assertGreater(report[1]["recall@10"], 0.8)
+
+    def test_unknown_parameters_are_rejected(self):
+        with self.assertRaises(ValueError):
+            normalize_config({"kind": "hnsw", "nlist": 10})
+
+
+if __name__ == "__main__":
+    unittest.main()